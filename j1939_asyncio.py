@@ -0,0 +1,94 @@
+import asyncio
+import time
+import j1939
+from j1939.ecu_asyncio import EcuRunner, SendError
+from j1939.virtual_bus import VirtualBus
+
+# two ECUs on a virtual bus, each run by an asyncio task instead of a busy loop,
+# runs on a host (CPython) as well, no CAN hardware needed
+
+RUN_TIME = 5
+
+received = {}
+
+def make_ca(ecu, address, identity_number):
+    name = j1939.Name(arbitrary_address_capable=0, industry_group=j1939.Name.IndustryGroup.Industrial,
+                      vehicle_system_instance=1, vehicle_system=1, function=1, function_instance=1,
+                      ecu_instance=1, manufacturer_code=666, identity_number=identity_number)
+    ca = j1939.ControllerApplication(name, address)
+    ecu.add_ca(controller_application=ca)
+    return ca
+
+def on_message(priority, pgn, sa, timestamp, data):
+    """Counts the received messages per PGN"""
+    received[pgn] = received.get(pgn, 0) + 1
+
+def dm1_data():
+    """Lamp status and active DTCs of the sender, three DTCs need the transport protocol"""
+    lamps = {'pl': j1939.DtcLamp.OFF, 'awl': j1939.DtcLamp.ON, 'rsl': j1939.DtcLamp.OFF, 'mil': j1939.DtcLamp.OFF}
+    dtcs = [{'spn': 100, 'fmi': 1}, {'spn': 110, 'fmi': 0}, {'spn': 190, 'fmi': 2, 'oc': 3}]
+    return lamps, dtcs
+
+async def ticker():
+    """Another task sharing the event loop, e.g. MQTT or Modbus"""
+    ticks = 0
+    while True:
+        await asyncio.sleep(0.1)
+        ticks += 1
+        if ticks % 10 == 0:
+            print("ticker: {} s".format(ticks // 10))
+
+async def main():
+    bus = VirtualBus(bitrate=250000)
+
+    sender_ecu = j1939.ElectronicControlUnit()
+    sender_ecu.connect(bus_type='virtual', bus=bus)
+    sender = make_ca(sender_ecu, 0x80, 1)
+
+    receiver_ecu = j1939.ElectronicControlUnit()
+    receiver_ecu.connect(bus_type='virtual', bus=bus)
+    receiver = make_ca(receiver_ecu, 0x81, 2)
+    receiver.subscribe(on_message)
+
+    sender_runner = EcuRunner(sender_ecu)
+    receiver_runner = EcuRunner(receiver_ecu)
+    sender_runner.start()
+    receiver_runner.start()
+    ticker_task = asyncio.create_task(ticker())
+
+    # address claiming of both CAs in parallel
+    claimed = await asyncio.gather(sender_runner.claim(sender), receiver_runner.claim(receiver))
+    print("address claimed: {}".format(claimed))
+
+    # cyclic DM1, sent with TP.BAM
+    dm1_task = asyncio.create_task(sender_runner.send_dm1(j1939.Dm1(sender), dm1_data))
+
+    # proprietary A PGN to the receiver, 100 bytes with RTS/CTS, every 0.5 s
+    started = time.monotonic()
+    transfers = 0
+    while time.monotonic() - started < RUN_TIME:
+        sent = time.monotonic()
+        try:
+            await sender_runner.send_pgn(sender, 0, 0xEF, 0x81, 6, list(range(100)))
+            transfers += 1
+            print("100 bytes sent in {:.3f} s".format(time.monotonic() - sent))
+        except SendError as e:
+            print("send failed: {}".format(e.reason))
+        await asyncio.sleep(0.5)
+
+    dm1_task.cancel()
+    ticker_task.cancel()
+    sender_runner.stop()
+    receiver_runner.stop()
+
+    print("transfers: {}".format(transfers))
+    print("sender runner: {}".format(sender_runner.stats))
+    print("receiver runner: {}".format(receiver_runner.stats))
+    for pgn in sorted(received):
+        print("PGN 0x{:05X}: {} messages".format(pgn, received[pgn]))
+
+    sender_ecu.disconnect()
+    receiver_ecu.disconnect()
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,521 @@
+import io
+import time
+import j1939
+from j1939.can import SoftwareCanBackend
+from j1939.signal_database import SignalDatabase
+from j1939.trace import TraceRecorder, TraceReader, TraceReplayer
+from j1939.transport import RxSessionManager
+from j1939.tx_scheduler import TxScheduler
+from j1939.virtual_bus import VirtualBus
+
+# recorded frame stream of a typical 250 kbit/s truck bus (about 1800 frames/s)
+# (can_id, data) pairs, broadcast PGNs, peer-to-peer requests and a DM1 via TP.BAM
+FRAME_STREAM = [
+    (0x0CF00400, bytearray([0xF0, 0x7D, 0x7D, 0x00, 0x1A, 0xFF, 0xFF, 0x7D])),   # EEC1
+    (0x0CF00300, bytearray([0xD1, 0x00, 0x00, 0xFF, 0xFF, 0x0F, 0x72, 0x7D])),   # EEC2
+    (0x18FEF100, bytearray([0xF7, 0x00, 0x32, 0xC0, 0x00, 0x00, 0x00, 0xFF])),   # CCVS
+    (0x18FEEE00, bytearray([0x8C, 0x57, 0x2F, 0x26, 0xFF, 0xFF, 0x4B, 0xFF])),   # ET1
+    (0x18FEEF00, bytearray([0xFF, 0xFF, 0xFF, 0x5A, 0xFF, 0xFF, 0xFF, 0xFF])),   # EFL/P1
+    (0x0CF00203, bytearray([0xC0, 0x00, 0x00, 0xFF, 0xF8, 0x00, 0x00, 0xFF])),   # ETC1
+    (0x18F00503, bytearray([0x7D, 0xFF, 0xFF, 0x7D, 0x4E, 0x20, 0xFF, 0xFF])),   # ETC2
+    (0x18FEF200, bytearray([0x00, 0x00, 0x00, 0x00, 0xFF, 0xFF, 0xFF, 0xFF])),   # LFE
+    (0x18EA80F9, bytearray([0xE5, 0xFE, 0x00])),                                 # request to 0x80
+    (0x18ECFF00, bytearray([0x20, 0x0E, 0x00, 0x02, 0xFF, 0xCA, 0xFE, 0x00])),   # TP.CM BAM DM1
+    (0x1CEBFF00, bytearray([0x01, 0x04, 0xFF, 0x9C, 0x00, 0x03, 0x01, 0x9D])),   # TP.DT 1
+    (0x1CEBFF00, bytearray([0x02, 0x00, 0x04, 0x01, 0xFF, 0xFF, 0xFF, 0xFF])),   # TP.DT 2
+    (0x18E00417, bytearray([0xFF] * 8)),                                         # peer-to-peer, not for us
+    (0x18FECA17, bytearray([0x00, 0xFF, 0x00, 0x00, 0x00, 0x00, 0xFF, 0xFF])),   # DM1 single frame
+]
+
+received = 0
+
+def on_message(priority, pgn, sa, timestamp, data):
+    global received
+    received += 1
+
+def bench_notify(ecu, repeat):
+    """Replays the recorded frame stream through ElectronicControlUnit.notify
+
+    :return: processed frames per second
+    """
+    frames = FRAME_STREAM
+    start = time.monotonic_ns()
+    for _ in range(repeat):
+        for can_id, data in frames:
+            ecu.notify(can_id, data, 0)
+    elapsed = time.monotonic_ns() - start
+    return repeat * len(frames) * 1e9 / elapsed
+
+def bench_receive(repeat):
+    """Frames injected into a software CAN bus, read into the receive ring
+    and delivered by ElectronicControlUnit.loop
+
+    :return: processed frames per second
+    """
+    ecu = j1939.ElectronicControlUnit()
+    bus = ecu.connect(bus_type='software', rx_buffers=len(FRAME_STREAM))
+    ecu.subscribe(on_message)
+    backend = bus.backend
+    frames = FRAME_STREAM
+    start = time.monotonic_ns()
+    for _ in range(repeat):
+        for can_id, data in frames:
+            backend.inject(can_id, data)
+        ecu.loop(time.time())
+    elapsed = time.monotonic_ns() - start
+    return repeat * len(frames) * 1e9 / elapsed
+
+def bench_send(repeat):
+    """Single frame PGNs sent by ElectronicControlUnit.send_pgn to a software CAN bus
+
+    :return: sent frames per second
+    """
+    ecu = j1939.ElectronicControlUnit()
+    bus = ecu.connect(bus_type='software')
+    sent = bus.backend.sent
+    data = bytearray(8)
+    start = time.monotonic_ns()
+    for _ in range(repeat):
+        for _ in range(100):
+            ecu.send_pgn(0, 0xF0, 0x04, 3, 0x80, data)
+        del sent[:]
+    elapsed = time.monotonic_ns() - start
+    return repeat * 100 * 1e9 / elapsed
+
+def bench_acceptance_filters(enabled, repeat):
+    """The frame stream on a software CAN bus emulating the six filters of a
+    MCP2515, received by an ECU with a CA at 0x80 subscribed to EEC1, CCVS,
+    ET1 and DM1
+
+    :param bool enabled:
+        Acceptance filters programmed from the subscriptions, False lets all frames pass.
+    :return: frames processed by the stack per second of bus traffic
+        (at the 1800 frames/s of the stream), stream frames handled per second
+    """
+    ecu = j1939.ElectronicControlUnit()
+    bus = ecu.connect(bus_type='software', rx_buffers=len(FRAME_STREAM), filter_slots=(2, 4), acceptance_filters=enabled)
+    name = j1939.Name(arbitrary_address_capable=0, industry_group=j1939.Name.IndustryGroup.Industrial,
+                      vehicle_system_instance=1, vehicle_system=1, function=1, function_instance=1,
+                      ecu_instance=1, manufacturer_code=666, identity_number=1)
+    ca = j1939.ControllerApplication(name, 0x80, bypass_address_claim=True)
+    ecu.add_ca(controller_application=ca)
+    for pgn in (0xF004, 0xFEF1, 0xFEEE, 0xFECA):
+        ca.subscribe(on_message, pgn)
+    ecu.loop(time.time())
+    backend = bus.backend
+    frames = FRAME_STREAM
+    start = time.monotonic_ns()
+    for _ in range(repeat):
+        for can_id, data in frames:
+            backend.inject(can_id, data)
+        ecu.loop(time.time())
+    elapsed = time.monotonic_ns() - start
+    processed = bus.stats['received'] / (repeat * len(frames))
+    return 1800 * processed, repeat * len(frames) * 1e9 / elapsed
+
+def bench_replay(repeat):
+    """Records the frame stream to a trace and replays it flat-out, this is
+    the decode and dispatch path including trace reading
+
+    :return: replayed frames per second
+    """
+    stream = io.BytesIO()
+    recorder = TraceRecorder(stream)
+    for i in range(repeat):
+        for can_id, data in FRAME_STREAM:
+            recorder.on_receive(can_id, data, i * 0.01)
+    recorder.flush()
+    stream.seek(0)
+
+    ecu = j1939.ElectronicControlUnit(send_message=lambda *args, **kwargs: None)
+    ecu.subscribe(on_message)
+    replayer = TraceReplayer(TraceReader(stream), ecu, speed=0)
+    start = time.monotonic_ns()
+    frames = replayer.run()
+    elapsed = time.monotonic_ns() - start
+    return frames * 1e9 / elapsed
+
+def bam_frames(size, src_address=0x90):
+    """Frames of a BAM transfer of size bytes (PGN 0xFECA, DM1)"""
+    num_packets = (size + 6) // 7
+    frames = [(0x18ECFF00 | src_address, bytearray([0x20, size & 0xFF, size >> 8, num_packets, 0xFF, 0xCA, 0xFE, 0x00]))]
+    for sequence in range(num_packets):
+        chunk = bytearray([sequence + 1] + [(sequence + i) & 0xFF for i in range(7)])
+        frames.append((0x1CEBFF00 | src_address, chunk))
+    return frames
+
+def bench_tp_reassembly(repeat):
+    """Reassembly of 1785 byte BAM transfers (255 TP.DT packets each)
+
+    :return: reassembled messages per second
+    """
+    ecu = j1939.ElectronicControlUnit(send_message=lambda *args, **kwargs: None)
+    ecu.subscribe(on_message)
+    frames = bam_frames(1785)
+    start = time.monotonic_ns()
+    for _ in range(repeat):
+        for can_id, data in frames:
+            ecu.notify(can_id, data, 0)
+    elapsed = time.monotonic_ns() - start
+    return repeat * 1e9 / elapsed
+
+def bench_tp_segmentation(data_link_layer, peer_to_peer, repeat):
+    """Segmentation of 1785 byte transfers into TP.DT frames, sent as BAM
+    or, answered by a CTS for all packets, via RTS/CTS
+
+    :return: sent messages per second
+    """
+    sent = [0]
+    def send_message(can_id, extended_id, data, fd_format=False):
+        sent[0] += 1
+    ecu = j1939.ElectronicControlUnit(data_link_layer, minimum_tp_bam_dt_interval=0, send_message=send_message)
+    # peer-to-peer frames (CTS, EOM ACK) are accepted for this address
+    ecu.subscribe(on_message, 0x20)
+    dll = ecu.j1939_dll
+    payload = [i & 0xFF for i in range(1785)]
+    if data_link_layer == 'j1939-22':
+        # BAM, 30 FD.TP.DT and the end of message status
+        frames = 32
+    else:
+        # BAM or RTS, 255 TP.DT
+        frames = 256
+    cts = bytearray([0x11, 0xFF, 0x01, 0xFF, 0xFF, 0x00, 0xEF, 0x00])
+    eom_ack = bytearray([0x13, 1785 & 0xFF, 1785 >> 8, 0xFF, 0xFF, 0x00, 0xEF, 0x00])
+    start = time.monotonic_ns()
+    for _ in range(repeat):
+        sent[0] = 0
+        if peer_to_peer:
+            ecu.send_pgn(0, 0xEF, 0x21, 7, 0x20, payload)
+            ecu.notify(0x1CEC2021, cts, 0)
+        else:
+            ecu.send_pgn(0, 0xFE, 0xCA, 7, 0x20, payload)
+        while sent[0] < frames:
+            dll.loop(time.time())
+        if peer_to_peer:
+            ecu.notify(0x1CEC2021, eom_ack, 0)
+        # let the data link layer free the send buffer
+        dll.loop(time.time())
+    elapsed = time.monotonic_ns() - start
+    return repeat * 1e9 / elapsed
+
+def stress_bam_sessions(senders, max_sessions, seconds):
+    """Senders ECUs broadcast a 60 byte DM1 via BAM every second on a virtual
+    bus, all at the same time, the monitor accepts max_sessions concurrent
+    receive sessions
+
+    :return: session statistics of the monitor
+    """
+    bus = VirtualBus(bitrate=250000)
+    ecus = []
+    for index in range(senders):
+        ecu = j1939.ElectronicControlUnit()
+        ecu.connect(bus_type='virtual', bus=bus)
+        name = j1939.Name(arbitrary_address_capable=0, industry_group=j1939.Name.IndustryGroup.Industrial,
+                          vehicle_system_instance=1, vehicle_system=1, function=1, function_instance=index,
+                          ecu_instance=1, manufacturer_code=666, identity_number=index)
+        ca = j1939.ControllerApplication(name, 0x10 + index, bypass_address_claim=True)
+        ecu.add_ca(controller_application=ca)
+        def send_dm1(cookie, ca=ca):
+            ca.send_pgn(0, 0xFE, 0xCA, 7, [0xFF] * 60)
+            return True
+        ca.add_timer(1.0, send_dm1)
+        ecus.append(ecu)
+    monitor = j1939.ElectronicControlUnit(rx_sessions=RxSessionManager(max_sessions=max_sessions))
+    monitor.connect(bus_type='virtual', bus=bus)
+    monitor.subscribe(on_message)
+    ecus.append(monitor)
+    end = time.time() + seconds
+    while time.time() < end:
+        now = time.time()
+        for ecu in ecus:
+            ecu.loop(now)
+    return monitor.j1939_dll.rx_sessions.stats
+
+class FrameCounter:
+    """Tracer counting the frames and bytes an ECU receives"""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    def on_receive(self, can_id, data, timestamp):
+        self.frames += 1
+        self.bytes += len(data)
+
+    def on_send(self, can_id, extended_id, data, fd_format=False, timestamp=None):
+        pass
+
+def stress_multi_pg(seconds):
+    """A j1939-22 ECU sends a C-PG of 1..24 bytes every millisecond, with
+    time limits of 0, 5, 20 and 50 ms and mixed priorities, over a virtual
+    CAN FD bus
+
+    :return: multi-PG frames on the bus, payload efficiency (C-PG data bytes / frame bytes), busload
+    """
+    bus = VirtualBus(bitrate=500000, data_bitrate=2000000)
+    sender = j1939.ElectronicControlUnit('j1939-22')
+    sender.connect(bus_type='virtual', bus=bus)
+    monitor = j1939.ElectronicControlUnit('j1939-22')
+    monitor.connect(bus_type='virtual', bus=bus)
+    counter = FrameCounter()
+    monitor.set_tracer(counter)
+    time_limits = (0.005, 0.020, 0.050, 0, 0.020, 0.050)
+    payload = 0
+    index = 0
+    start = time.time()
+    next_send = start
+    while True:
+        now = time.time()
+        if now - start >= seconds:
+            break
+        if now >= next_send:
+            size = (index * 7) % 24 + 1
+            sender.send_pgn(0, 0xFF, index & 0x0F, (index * 3) % 8, 0x20, [index & 0xFF] * size, time_limits[index % len(time_limits)])
+            payload += size
+            index += 1
+            next_send += 0.001
+        sender.loop(now)
+        monitor.loop(now)
+    # let the last C-PGs reach the monitor
+    end = time.time() + 0.1
+    while time.time() < end:
+        sender.loop(time.time())
+        monitor.loop(time.time())
+    return counter.frames, payload / counter.bytes if counter.bytes else 0.0, bus.stats['busload']
+
+def bench_dispatch(indexed, repeat):
+    """Dispatch cost with 50 subscribers and a mixed PGN stream
+
+    :param bool indexed:
+        True subscribes by PGN, False subscribes to everything and filters
+        the PGN in the callback (the way it had to be done before)
+    :return: dispatched messages per second
+    """
+    ecu = j1939.ElectronicControlUnit(send_message=lambda *args, **kwargs: None)
+    pgns = [0xFE00 + i for i in range(50)]
+    for pgn in pgns:
+        if indexed:
+            ecu.subscribe(on_message, pgn=pgn)
+        else:
+            def filtered(priority, msg_pgn, sa, timestamp, data, pgn=pgn):
+                if msg_pgn == pgn:
+                    on_message(priority, msg_pgn, sa, timestamp, data)
+            ecu.subscribe(filtered)
+    # every 4th message has a PGN nobody subscribed to
+    stream = [pgns[i % 50] if i % 4 else 0xF004 for i in range(200)]
+    data = bytearray(8)
+    start = time.monotonic_ns()
+    for _ in range(repeat):
+        for pgn in stream:
+            ecu._notify_subscribers(6, pgn, 0x00, 0xFF, 0, data)
+    elapsed = time.monotonic_ns() - start
+    return repeat * len(stream) * 1e9 / elapsed
+
+def bench_requests(responder, repeat):
+    """Requests for the software identification (PGN 65242, 3 fields) answered by a CA
+
+    :param bool responder:
+        True answers with a cached responder, False builds the answer in a
+        request subscriber every time (the way it had to be done before)
+    :return: answered requests per second
+    """
+    name = j1939.Name(arbitrary_address_capable=0, industry_group=j1939.Name.IndustryGroup.Industrial,
+                      vehicle_system_instance=1, vehicle_system=1, function=1, function_instance=1,
+                      ecu_instance=1, manufacturer_code=666, identity_number=654321)
+    ca = j1939.ControllerApplication(name, 0x80, bypass_address_claim=True)
+    ecu = j1939.ElectronicControlUnit(send_message=lambda *args, **kwargs: None)
+    ecu.add_ca(controller_application=ca)
+    versions = ("BOOT 1.2.0", "APP 4.17.3", "CAL 2024-05")
+
+    def software_identification(pgn):
+        text = "{}*".format(len(versions)) + "".join("{}*".format(version) for version in versions)
+        return text.encode()
+
+    if responder:
+        ca.add_responder(0xFEDA, generator=software_identification)
+    else:
+        def on_request(src_address, dest_address, pgn):
+            if pgn == 0xFEDA:
+                ca.send_pgn(0, 0xFE, 0xDA, 6, software_identification(pgn))
+                return True
+        ca.subscribe_request(on_request)
+    # global request, the answer (> 8 bytes) is sent with TP.BAM
+    request = bytearray([0xDA, 0xFE, 0x00])
+    start = time.monotonic_ns()
+    for _ in range(repeat):
+        ecu.notify(0x18EAFFF9, request, 0)
+        # end the BAM, the next answer can start
+        ecu.j1939_dll._snd_buffer.clear()
+    elapsed = time.monotonic_ns() - start
+    return repeat * 1e9 / elapsed
+
+def bench_timers(count, seconds):
+    """Runs count periodic transmit timers (10 ms .. 1 s cycle) for the given
+    amount of simulated time, the loop is stepped every millisecond
+
+    :return: timer callbacks per second of wall time
+    """
+    from j1939.timer_heap import TimerHeap
+    calls = [0]
+    def transmit(cookie):
+        calls[0] += 1
+        return True
+    timers = TimerHeap()
+    cycles = (0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+    for i in range(count):
+        timers.add(0, cycles[i % len(cycles)], transmit, i)
+    start = time.monotonic_ns()
+    for step in range(int(seconds * 1000)):
+        timers.run(step / 1000)
+    elapsed = time.monotonic_ns() - start
+    return calls[0] * 1e9 / elapsed
+
+class TxLimitedBackend(SoftwareCanBackend):
+    """Software CAN controller getting per_tick frames onto the bus per tick,
+    a send without a free transmit buffer raises RuntimeError"""
+
+    def __init__(self, per_tick):
+        super().__init__()
+        self.per_tick = per_tick
+        self.free = per_tick
+        self.on_bus = {}
+
+    def tick(self):
+        self.free = self.per_tick
+
+    def send(self, can_id, data, extended_id):
+        if not self.free:
+            raise RuntimeError("no free transmit buffer")
+        self.free -= 1
+        pgn = (can_id >> 8) & 0x3FFFF
+        self.on_bus[pgn] = self.on_bus.get(pgn, 0) + 1
+
+def bench_tx_scheduler(scheduled, ticks):
+    """1 ms ticks on a bus with room for 2 frames of the ECU per tick. The
+    ECU sends EEC1 (priority 3) every tick, after a burst of 4 priority 6
+    PGNs every 10 ticks, and a 60 byte DM1 via BAM (TP.DT priority 7) every
+    100 ticks. Without a scheduler the frames finding no free transmit
+    buffer are lost, with a TxScheduler they wait and EEC1 goes first
+
+    :return: EEC1 frames lost, maximum EEC1 latency in ticks, BAMs completed, BAMs sent
+    """
+    clock = [0.0]
+    scheduler = TxScheduler(max_frames=32, clock=lambda: clock[0]) if scheduled else None
+    ecu = j1939.ElectronicControlUnit(minimum_tp_bam_dt_interval=0, tx_scheduler=scheduler)
+    backend = TxLimitedBackend(2)
+    ecu.connect(backend=backend)
+    completed = [0]
+    def on_complete(reason):
+        if reason == 'completed':
+            completed[0] += 1
+    payload = [0xFF] * 8
+    bams = 0
+    for tick in range(ticks):
+        clock[0] = tick * 0.001
+        backend.tick()
+        # queued frames and the next BAM packet
+        ecu.loop(time.time())
+        frames = []
+        if tick % 10 == 0:
+            frames = [(0xFE, 0xF1), (0xFE, 0xEE), (0xFE, 0xEF), (0xFE, 0xF2)]
+        for pdu_format, pdu_specific in frames:
+            try:
+                ecu.send_pgn(0, pdu_format, pdu_specific, 6, 0x00, payload)
+            except RuntimeError:
+                pass
+        try:
+            ecu.send_pgn(0, 0xF0, 0x04, 3, 0x00, payload)
+        except RuntimeError:
+            pass
+        if tick % 100 == 50:
+            bams += 1
+            try:
+                ecu.send_pgn(0, 0xFE, 0xCA, 6, 0x00, [0xFF] * 60, on_complete=on_complete)
+            except RuntimeError:
+                pass
+    # let the queue drain
+    for tick in range(ticks, ticks + 20):
+        clock[0] = tick * 0.001
+        backend.tick()
+        ecu.loop(time.time())
+    latency = scheduler.stats['latency_max_by_priority'][3] / 0.001 if scheduled else 0
+    return ticks - backend.on_bus.get(0xF004, 0), latency, completed[0], bams
+
+def bench_signal_decode(repeat):
+    """Decodes the broadcast PGNs of the frame stream with j1939_signals.csv
+
+    :return: decoded PGNs per second
+    """
+    db = SignalDatabase.load('j1939_signals.csv')
+    stream = [((can_id >> 8) & 0x3FFFF, data) for can_id, data in FRAME_STREAM]
+    stream = [(pgn, data) for pgn, data in stream if pgn in db]
+    start = time.monotonic_ns()
+    for _ in range(repeat):
+        for pgn, data in stream:
+            db.decode(pgn, data)
+    elapsed = time.monotonic_ns() - start
+    db.close()
+    return repeat * len(stream) * 1e9 / elapsed
+
+def bench_signal_database(pgn_count, cache_size, repeat):
+    """Decodes PGNs of a CSV database with pgn_count PGNs (4 SPNs each),
+    once cycling over cache_size PGNs (all plans cached) and once over
+    2 * cache_size PGNs (each decode reads and compiles its PGN again)
+
+    :return: seconds to index the file, decoded PGNs per second cached and not cached
+    """
+    lines = ['pgn,spn,name,start_bit,length,scale,offset,unit']
+    for pgn in range(pgn_count):
+        for index in range(4):
+            lines.append('{},{},S{},{},16,0.5,-10,'.format(pgn, pgn * 4 + index, index, index * 16))
+    csv = io.BytesIO('\n'.join(lines).encode())
+    start = time.monotonic_ns()
+    db = SignalDatabase(cache_size=cache_size)
+    db.open_csv(csv)
+    indexed = time.monotonic_ns() - start
+    data = bytearray(range(8))
+    rates = []
+    for count in (cache_size, 2 * cache_size):
+        pgns = [i * pgn_count // count for i in range(count)]
+        start = time.monotonic_ns()
+        for _ in range(repeat):
+            for pgn in pgns:
+                db.decode(pgn, data)
+        elapsed = time.monotonic_ns() - start
+        rates.append(repeat * len(pgns) * 1e9 / elapsed)
+    return indexed / 1e9, rates[0], rates[1]
+
+def main():
+    name = j1939.Name(arbitrary_address_capable=0, industry_group=j1939.Name.IndustryGroup.Industrial,
+                      vehicle_system_instance=1, vehicle_system=1, function=1, function_instance=1,
+                      ecu_instance=1, manufacturer_code=666, identity_number=1234567)
+    ca = j1939.ControllerApplication(name, 0x80, bypass_address_claim=True)
+
+    ecu = j1939.ElectronicControlUnit(send_message=lambda *args, **kwargs: None)
+    ecu.add_ca(controller_application=ca)
+    ca.subscribe(on_message)
+
+    print("notify: {:.0f} frames/s".format(bench_notify(ecu, 500)))
+    print("receive, software bus: {:.0f} frames/s".format(bench_receive(500)))
+    print("send, software bus: {:.0f} frames/s".format(bench_send(100)))
+    print("acceptance filters off: {:.0f} frames/s processed, {:.0f} frames/s handled".format(*bench_acceptance_filters(False, 500)))
+    print("acceptance filters on: {:.0f} frames/s processed, {:.0f} frames/s handled".format(*bench_acceptance_filters(True, 500)))
+    print("replay, flat-out: {:.0f} frames/s".format(bench_replay(500)))
+    print("TP reassembly, 1785 bytes BAM: {:.0f} messages/s".format(bench_tp_reassembly(100)))
+    print("TP segmentation, 1785 bytes BAM: {:.0f} messages/s".format(bench_tp_segmentation('j1939-21', False, 100)))
+    print("TP segmentation, 1785 bytes RTS/CTS: {:.0f} messages/s".format(bench_tp_segmentation('j1939-21', True, 100)))
+    print("TP segmentation, 1785 bytes FD BAM (j1939-22): {:.0f} messages/s".format(bench_tp_segmentation('j1939-22', False, 100)))
+    print("BAM stress, 20 senders, 8 sessions: {}".format(stress_bam_sessions(20, 8, 3.5)))
+    print("multi-PG, 1 C-PG/ms for 2 s: {} frames, {:.0%} payload efficiency, {:.0%} busload".format(*stress_multi_pg(2)))
+    print("dispatch, 50 filtering subscribers: {:.0f} messages/s".format(bench_dispatch(False, 50)))
+    print("dispatch, 50 PGN subscribers: {:.0f} messages/s".format(bench_dispatch(True, 50)))
+    print("requests, answer built per request: {:.0f} requests/s".format(bench_requests(False, 5000)))
+    print("requests, cached responder: {:.0f} requests/s".format(bench_requests(True, 5000)))
+    print("timers, 2000 periodic: {:.0f} callbacks/s".format(bench_timers(2000, 2)))
+    print("transmit, 2 frames/ms, no scheduler: {} of 2000 EEC1 lost, max latency {:.0f} ms, {} of {} BAMs completed".format(*bench_tx_scheduler(False, 2000)))
+    print("transmit, 2 frames/ms, TxScheduler: {} of 2000 EEC1 lost, max latency {:.0f} ms, {} of {} BAMs completed".format(*bench_tx_scheduler(True, 2000)))
+    print("signal decode, j1939_signals.csv: {:.0f} PGNs/s".format(bench_signal_decode(500)))
+    print("signal database, 3000 PGNs, 64 plans cached: indexed in {:.3f} s, {:.0f} PGNs/s cached, {:.0f} PGNs/s lazily loaded".format(*bench_signal_database(3000, 64, 20)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+import adafruit_logging as logging
+import time
+import j1939
+from j1939.virtual_bus import VirtualBus
+from j1939.memory_access import Dm14Query, Dm14Responder
+
+# DM14/DM15/DM16 memory access between ECUs on a simulated CAN bus,
+# runs on a host (CPython) as well, no CAN hardware needed
+
+RUN_TIME = 3
+
+def make_ca(bus, index, address):
+    """Returns an ECU on the bus with a CA claiming the address"""
+    name = j1939.Name(arbitrary_address_capable=0, industry_group=j1939.Name.IndustryGroup.Industrial,
+                      vehicle_system_instance=1, vehicle_system=1, function=1, function_instance=index,
+                      ecu_instance=1, manufacturer_code=666, identity_number=2000 + index)
+    ecu = j1939.ElectronicControlUnit()
+    ecu.connect(bus_type='virtual', bus=bus)
+    ca = j1939.ControllerApplication(name, address)
+    ecu.add_ca(controller_application=ca)
+    ca.start()
+    return ecu, ca
+
+def seed_to_key(seed):
+    return seed ^ 0xA5A5
+
+def on_chunk(offset, data):
+    print("chunk at {}: {} bytes".format(offset, len(data)))
+
+def on_done(future):
+    if future.error is not None:
+        print("query failed: {}".format(future.error))
+    else:
+        print("query done: {}".format(future.result if not isinstance(future.result, bytes) else len(future.result)))
+
+def main():
+    print("Initializing")
+    bus = VirtualBus(bitrate=250000)
+
+    tester_ecu, tester = make_ca(bus, 0, 0xF9)
+    # an ECU with 1 kB of memory and one with 16 bit objects, protected by a key
+    server1_ecu, server1 = make_ca(bus, 1, 0x30)
+    server2_ecu, server2 = make_ca(bus, 2, 0x31)
+    ecus = [tester_ecu, server1_ecu, server2_ecu]
+
+    def run(seconds):
+        end = time.time() + seconds
+        while time.time() < end:
+            for ecu in ecus:
+                ecu.loop(time.time())
+
+    # address claiming
+    run(1)
+
+    Dm14Responder(server1, bytearray(range(256)) * 4)
+    Dm14Responder(server2, bytearray(64), object_byte_size=2, seed=0x1234, key_from_seed=seed_to_key)
+
+    query = Dm14Query(tester, chunk_size=255)
+    query.set_seed_key_algorithm(seed_to_key)
+
+    # two queries in parallel, the large read is streamed in chunks
+    big = query.read(0x30, 1, 0, 1024, return_raw_bytes=True, callback=on_done, on_chunk=on_chunk)
+    write = query.write(0x31, 1, 0, [1000, -1000, 42], object_byte_size=2, callback=on_done)
+
+    end = time.time() + RUN_TIME
+    while not (big.done and write.done) and time.time() < end:
+        for ecu in ecus:
+            ecu.loop(time.time())
+
+    query.read(0x31, 1, 0, 3, object_byte_size=2, signed=True, callback=on_done)
+    run(0.5)
+
+    for ecu in ecus:
+        ecu.disconnect()
+
+if __name__ == '__main__':
+    main()
@@ -3,8 +3,9 @@ import time
 import j1939
 import board
 
-logging.getLogger('electronic_control_unit').setLevel(logging.DEBUG)
-logging.getLogger('can').setLevel(logging.DEBUG)
+# log the stack at DEBUG level and print every frame sent and received
+j1939.log.set_level(logging.DEBUG)
+j1939.log.set_trace(True)
 
 # compose the name descriptor for the new ca
 name = j1939.Name(
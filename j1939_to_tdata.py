@@ -0,0 +1,89 @@
+import time
+import j1939
+import board
+import socketpool
+import wifi
+import adafruit_minimqtt.adafruit_minimqtt as MQTT
+from tdata.tdata import TData_MQTT_Gateway
+from j1939.signal_database import SignalDatabase
+from j1939.tdata_bridge import TDataBridge
+
+# Publishes engine signals and DM1 changes of every ECU on the J1939 bus
+# to T>Data, one T>Data device per source address
+
+### WiFi ###
+
+# Add a secrets.py to your filesystem that has a dictionary called secrets with "ssid" and
+# "password" keys with your WiFi credentials. DO NOT share that file or commit it into Git or other
+# source control.
+# pylint: disable=no-name-in-module,wrong-import-order
+try:
+    from secrets import secrets
+except ImportError:
+    print("WiFi secrets are kept in secrets.py, please add them there!")
+    raise
+
+print("Connecting to %s" % secrets["ssid"])
+wifi.radio.connect(secrets["ssid"], secrets["password"])
+print("Connected to %s!" % secrets["ssid"])
+
+# Create a socket pool
+pool = socketpool.SocketPool(wifi.radio)
+
+# Initialize a new MQTT Client object
+mqtt_client = MQTT.MQTT(
+    broker="tdata.tesacom.net",
+    port=1883,
+    username=secrets["tdata_gateway_token"],
+    password="",
+    socket_pool=pool,
+    # keep the MQTT loop short, the J1939 loop has to run often
+    socket_timeout=0.05,
+)
+
+# Initialize an TData Gateway Client
+tdata = TData_MQTT_Gateway(mqtt_client)
+
+print("Connecting to TDATA...")
+tdata.connect()
+
+print("Initializing J1939")
+
+# create the ElectronicControlUnit (one ECU can hold multiple ControllerApplications)
+ecu = j1939.ElectronicControlUnit()
+
+# Connect to the CAN bus
+ecu.connect(bus_type='mcp2515', bitrate=250000, cs = board.IO18, sck = board.IO6, mosi = board.IO7, miso = board.IO17)
+
+# a listen only CA, it does not claim an address
+name = j1939.Name(arbitrary_address_capable=0, industry_group=j1939.Name.IndustryGroup.Industrial,
+                  vehicle_system_instance=1, vehicle_system=1, function=1, function_instance=1,
+                  ecu_instance=1, manufacturer_code=666, identity_number=1234567)
+ca = j1939.ControllerApplication(name, 0xFE, bypass_address_claim=True)
+ecu.add_ca(controller_application=ca)
+
+bridge = TDataBridge(ca, tdata, SignalDatabase.load('j1939_signals.csv'), interval=10)
+bridge.add_signal(61444, 190, modes=('latest', 'min', 'max', 'avg'))  # engine speed
+bridge.add_signal(61443, 92, modes=('avg',))                          # engine load
+bridge.add_signal(65262, 110)                                         # coolant temperature
+bridge.add_signal(65263, 100)                                         # oil pressure
+bridge.add_signal(65266, 183, modes=('avg',))                         # fuel rate
+bridge.add_signal(65265, 84, modes=('latest', 'max'))                 # vehicle speed
+bridge.add_signal(65271, 168)                                         # battery potential
+bridge.start()
+
+print("Publishing J1939 telemetry every 10 seconds...")
+while True:
+    try:
+        # Explicitly pump the message loops.
+        tdata.loop(0.05)
+        ecu.loop(time.time())
+    except KeyboardInterrupt:
+        print('KeyboardInterrupt, stopping...')
+        break
+    except Exception as e:
+        print('Exception during execution: {}'.format(e))
+
+print("bridge: {}".format(bridge.stats))
+bridge.stop()
+ecu.disconnect()
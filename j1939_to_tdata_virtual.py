@@ -0,0 +1,98 @@
+import time
+import j1939
+from j1939.virtual_bus import VirtualBus
+from j1939.signal_database import SignalDatabase
+from j1939.tdata_bridge import TDataBridge
+from tdata.tdata import TData_MQTT_Gateway
+from tdata.tdata_fake_broker import FakeBroker
+
+# j1939_to_tdata.py end-to-end on a host: simulated ECUs on a virtual CAN
+# bus, the bridge publishing to an in-process fake broker. A broker outage
+# during a DM1 change shows the attributes being published after it.
+# Runs on CPython with the adafruit-circuitpython-minimqtt package, no
+# CAN hardware or network needed
+
+def make_ca(bus, index, address):
+    """Returns an ECU on the bus with a CA claiming the address"""
+    name = j1939.Name(arbitrary_address_capable=0, industry_group=j1939.Name.IndustryGroup.Industrial,
+                      vehicle_system_instance=1, vehicle_system=1, function=1, function_instance=index,
+                      ecu_instance=1, manufacturer_code=666, identity_number=3000 + index)
+    ecu = j1939.ElectronicControlUnit()
+    ecu.connect(bus_type='virtual', bus=bus)
+    ca = j1939.ControllerApplication(name, address)
+    ecu.add_ca(controller_application=ca)
+    ca.start()
+    return ecu, ca
+
+def main():
+    print("Initializing")
+    bus = VirtualBus(bitrate=250000)
+
+    engine1_ecu, engine1 = make_ca(bus, 1, 0x00)
+    engine2_ecu, engine2 = make_ca(bus, 2, 0x01)
+    bridge_ecu, bridge_ca = make_ca(bus, 0, 0xF9)
+    ecus = [engine1_ecu, engine2_ecu, bridge_ecu]
+
+    def run(seconds):
+        end = time.time() + seconds
+        while time.time() < end:
+            for ecu in ecus:
+                ecu.loop(time.time())
+
+    # address claiming
+    run(1)
+
+    broker = FakeBroker()
+    tdata = TData_MQTT_Gateway(broker.client(username="gateway-token"))
+    tdata.connect()
+
+    bridge = TDataBridge(bridge_ca, tdata, SignalDatabase.load('j1939_signals.csv'), interval=0.5)
+    bridge.add_signal(61444, 190, modes=('latest', 'min', 'max', 'avg'))  # engine speed
+    bridge.add_signal(65262, 110)                                         # coolant temperature
+    bridge.start()
+
+    speed = {0x00: 800.0, 0x01: 1500.0}
+
+    def send_eec1(cookie):
+        # EEC1 every 20 ms, engine speed in 0.125 rpm/bit
+        for ca in (engine1, engine2):
+            raw = int(speed[ca.device_address] / 0.125)
+            ca.send_pgn(0, 0xF0, 0x04, 3, [0xF0, 0x7D, 0x7D, raw & 0xFF, raw >> 8, 0xFF, 0xFF, 0x7D])
+            speed[ca.device_address] += 2.5
+        return True
+
+    def send_et1(cookie):
+        # ET1 every second, coolant 100 degC
+        engine1.send_pgn(0, 0xFE, 0xEE, 6, [0x8C, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF])
+        return True
+
+    engine1.add_timer(0.020, send_eec1)
+    engine1.add_timer(1.0, send_et1)
+
+    dtcs = [{'spn': 100, 'fmi': 1, 'oc': 1}]
+    lamps = {'pl': j1939.DtcLamp.OFF, 'awl': j1939.DtcLamp.ON, 'rsl': j1939.DtcLamp.OFF, 'mil': j1939.DtcLamp.OFF}
+    dm1 = j1939.Dm1(engine2)
+    dm1.start_send(lambda: (lamps, [dict(dtc) for dtc in dtcs]), 0.25)
+
+    run(1.2)
+
+    print("broker down, a second DTC becomes active")
+    broker.up = False
+    dtcs.append({'spn': 190, 'fmi': 0, 'oc': 2})
+    run(1.2)
+
+    print("broker up")
+    broker.up = True
+    tdata.reconnect()
+    run(1.2)
+
+    bridge.stop()
+    for ecu in ecus:
+        ecu.disconnect()
+
+    for topic, payload in broker.published:
+        print("{} {}".format(topic, payload))
+    print("bridge: {}".format(bridge.stats))
+
+if __name__ == '__main__':
+    main()
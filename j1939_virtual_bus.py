@@ -0,0 +1,70 @@
+import adafruit_logging as logging
+import time
+import j1939
+from j1939.virtual_bus import VirtualBus
+
+# runs on a host (CPython) as well, no CAN hardware needed
+
+ECU_COUNT = 8
+RUN_TIME = 5
+
+received = {}
+
+def on_message(priority, pgn, sa, timestamp, data):
+    """Counts the received messages per PGN"""
+    received[pgn] = received.get(pgn, 0) + 1
+
+def make_ca(ecu, index):
+    """Adds a CA claiming address 0x80 + index, sending one PGN every 10 ms"""
+    name = j1939.Name(arbitrary_address_capable=0, industry_group=j1939.Name.IndustryGroup.Industrial,
+                      vehicle_system_instance=1, vehicle_system=1, function=1, function_instance=index,
+                      ecu_instance=1, manufacturer_code=666, identity_number=1000 + index)
+    ca = j1939.ControllerApplication(name, 0x80 + index)
+    ecu.add_ca(controller_application=ca)
+
+    def send_cyclic(cookie):
+        if ca.state == j1939.ControllerApplication.State.NORMAL:
+            # proprietary B PGN 0xFF00 + index
+            ca.send_pgn(0, 0xFF, index, 6, [index] * 8)
+        return True
+
+    ca.start()
+    ca.add_timer(0.010, send_cyclic)
+    return ca
+
+def main():
+    print("Initializing")
+
+    # 250 kbit/s bus, 1 % of the frames get lost
+    bus = VirtualBus(bitrate=250000, drop_rate=0.01)
+
+    ecus = []
+    for index in range(ECU_COUNT):
+        ecu = j1939.ElectronicControlUnit()
+        # each node emulates the two receive buffers of a MCP2515
+        ecu.connect(bus_type='virtual', bus=bus, rx_buffers=2)
+        make_ca(ecu, index)
+        ecus.append(ecu)
+
+    monitor = j1939.ElectronicControlUnit()
+    monitor.connect(bus_type='virtual', bus=bus)
+    monitor.subscribe(on_message)
+    ecus.append(monitor)
+
+    startTime = time.time()
+    now = time.time()
+    while now - startTime < RUN_TIME:
+        for ecu in ecus:
+            ecu.loop(now)
+        now = time.time()
+
+    print("bus: {}".format(bus.stats))
+    print("monitor: {}".format(monitor._bus.stats))
+    for pgn in sorted(received):
+        print("PGN 0x{:05X}: {} messages".format(pgn, received[pgn]))
+
+    for ecu in ecus:
+        ecu.disconnect()
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,9 @@
 from .version import __version__
+from . import log
 from .electronic_control_unit import ElectronicControlUnit
 from .controller_application import ControllerApplication
 from .name import Name
 from .message_id import MessageId
 from .parameter_group_number import ParameterGroupNumber
 from .diagnostic_messages import *
-# from .memory_access import *
\ No newline at end of file
+from .memory_access import *
\ No newline at end of file
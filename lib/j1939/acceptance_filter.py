@@ -0,0 +1,149 @@
+import adafruit_logging as logging
+
+logger = logging.getLogger(__name__)
+
+# Acceptance filters of CAN controllers.
+#
+# A filter is a (can_id, mask) pair, a frame is accepted if
+# ``frame_id & mask == can_id`` for any of the filters. None stands for
+# "accept everything" (no filters installed).
+
+# PGN bits of a 29-bit CAN-ID: data page, pdu format and pdu specific,
+# the extended data page (reserved, 0) is not checked
+MASK_PGN = 0x01FFFF00
+# data page and pdu format only, for PDU1 PGNs (pdu specific is the destination)
+MASK_PDU1 = 0x01FF0000
+MASK_SA = 0x000000FF
+
+def pgn_filter(pgn, src_address=None):
+    """Returns the filter accepting a PGN, from one source address or all."""
+    if ((pgn >> 8) & 0xFF) < 240:
+        can_id, mask = (pgn & 0x1FF00) << 8, MASK_PDU1
+    else:
+        can_id, mask = (pgn & 0x1FFFF) << 8, MASK_PGN
+    if src_address is not None:
+        can_id |= src_address & 0xFF
+        mask |= MASK_SA
+    return (can_id, mask)
+
+def accepts(filters, can_id):
+    """True if a frame with the CAN-ID passes the filters."""
+    if filters is None:
+        return True
+    for filter_id, mask in filters:
+        if can_id & mask == filter_id:
+            return True
+    return False
+
+def _space(mask):
+    # number of 29-bit CAN-IDs a filter with this mask accepts
+    return 1 << (29 - bin(mask & 0x1FFFFFFF).count('1'))
+
+def _merge(a, b):
+    mask = a[1] & b[1] & ~(a[0] ^ b[0])
+    return (a[0] & mask, mask)
+
+def _covers(a, b):
+    # a accepts everything b accepts
+    return a[1] & b[1] == a[1] and b[0] & a[1] == a[0]
+
+def _reduce(filters):
+    # drops duplicates and filters covered by another one
+    result = []
+    for f in filters:
+        f = (f[0] & f[1], f[1])
+        if any(_covers(other, f) for other in result):
+            continue
+        result = [other for other in result if not _covers(f, other)]
+        result.append(f)
+    return result
+
+def _merge_cheapest(filters):
+    # merges the two filters which together accept the fewest additional frames
+    best = None
+    for i in range(len(filters)):
+        for j in range(i + 1, len(filters)):
+            merged = _merge(filters[i], filters[j])
+            cost = _space(merged[1]) - _space(filters[i][1]) - _space(filters[j][1])
+            if best is None or cost < best[0]:
+                best = (cost, i, j, merged)
+    _cost, i, j, merged = best
+    filters = [f for index, f in enumerate(filters) if index != i and index != j]
+    filters.append(merged)
+    return _reduce(filters)
+
+def _combinations(items, count):
+    if count == 0:
+        yield []
+        return
+    for index in range(len(items) - count + 1):
+        for rest in _combinations(items[index + 1:], count - 1):
+            yield [items[index]] + rest
+
+def _assign(filters, slots):
+    # splits the filters onto the masks, each mask has slots[i] filters,
+    # all filters of a mask share it. Returns the filters ordered by mask
+    # (with the shared mask applied) and the accepted space, None if they do not fit.
+    best = None
+    indices = list(range(len(filters)))
+    candidates = []
+    for count in range(1, min(slots[0], len(filters)) + 1):
+        candidates.extend(_combinations(indices, count))
+    for first in candidates:
+        groups = [[filters[i] for i in first], [f for i, f in enumerate(filters) if i not in first]]
+        if len(groups[1]) > (slots[1] if len(slots) > 1 else 0):
+            continue
+        masks = []
+        result = []
+        space = 0
+        for group in groups:
+            if not group:
+                continue
+            mask = 0x1FFFFFFF
+            for f in group:
+                mask &= f[1]
+            masks.append(mask)
+            for f in group:
+                result.append((f[0] & mask, mask))
+                space += _space(mask)
+        if best is None or space < best[1]:
+            best = (result, space)
+    return best
+
+def fit_filters(filters, slots=None):
+    """Reduces filters to what a controller can hold
+
+    Filters are merged pairwise, the pair adding the fewest accepted
+    CAN-IDs first, until they fit. The result accepts at least all frames
+    the given filters accept.
+
+    :param list filters:
+        (can_id, mask) pairs, None for "accept everything".
+    :param tuple slots:
+        Number of filters per mask of the controller, e.g. (2, 4) for the
+        MCP2515 (mask 0 with filters 0-1, mask 1 with filters 2-5).
+        None if the number of filters is not limited and each has its own mask.
+    :return:
+        The filters in the order of the masks, None for "accept everything".
+        The leading filters with the mask of the first one, at most slots[0],
+        belong to mask 0. Both masks may be the same.
+    """
+    if filters is None:
+        return None
+    filters = _reduce(filters)
+    if not filters:
+        return None
+    if slots is not None:
+        while True:
+            if len(filters) <= sum(slots):
+                assigned = _assign(filters, slots)
+                if assigned is not None:
+                    filters = assigned[0]
+                    break
+            if len(filters) == 1:
+                return None
+            filters = _merge_cheapest(filters)
+    for _can_id, mask in filters:
+        if mask == 0:
+            return None
+    return filters
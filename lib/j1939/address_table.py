@@ -0,0 +1,184 @@
+import adafruit_logging as logging
+
+logger = logging.getLogger(__name__)
+
+class AddressEvent:
+    """Changes of the address table, passed to the subscribers"""
+    CLAIMED = 1     # a NAME holds an address (new one, or another address than before)
+    CONFLICT = 2    # a NAME claimed an address held by another NAME, the NAME passed lost
+    DEPARTED = 3    # a NAME gave up its address (cannot claim, moved, lost or expired)
+
+# addresses 254 (NULL, cannot claim) and 255 (GLOBAL) are never held
+_ADDRESS_COUNT = 254
+_NULL = 254
+
+def _name_value(data):
+    # NAME of an address claimed PGN, 8 bytes little endian
+    value = 0
+    for index in range(7, -1, -1):
+        value = (value << 8) | data[index]
+    return value
+
+class AddressTable:
+    """Which NAME holds which address on the bus
+
+    Fed by every address claimed PGN seen by the ECU (see the
+    ``address_table`` parameter of :class:`j1939.ElectronicControlUnit`),
+    including the claims of the ECU's own CAs. Source address to NAME and
+    NAME to source address are O(1) lookups, NAMEs are the integer values
+    (:attr:`j1939.Name.value`).
+
+    A claim of an address held by another NAME is a conflict, the lower
+    NAME wins the address as in SAE J1939-81. A NAME departs from its
+    address when it claims another one, sends cannot claim, loses a
+    conflict or when :meth:`expire` finds no claim since a given time,
+    e.g. the time of a global request for address claimed.
+
+    Example usage:
+
+    .. code-block:: python
+
+        table = AddressTable()
+        ecu = j1939.ElectronicControlUnit(address_table=table)
+        table.subscribe(on_address_event)
+        ...
+        sent = time.monotonic()
+        ca.send_request(0, j1939.ParameterGroupNumber.PGN.ADDRESSCLAIM, 0xFF)
+        # 1.25 s later
+        table.expire(sent)
+    """
+
+    def __init__(self):
+        # address -> NAME value, None if free
+        self._names = [None] * _ADDRESS_COUNT
+        # address -> timestamp of the last claim
+        self._claimed_at = [0.0] * _ADDRESS_COUNT
+        # NAME value -> address
+        self._addresses = {}
+        self._subscribers = []
+        self._claims = 0
+        self._conflicts = 0
+        self._departures = 0
+
+    def __len__(self):
+        return len(self._addresses)
+
+    def __contains__(self, address):
+        return 0 <= address < _ADDRESS_COUNT and self._names[address] is not None
+
+    @property
+    def stats(self):
+        """Address table statistics.
+
+        :rtype: dict: 'addresses' (held), 'claims' (address claimed PGNs seen),
+            'conflicts', 'departures'
+        """
+        return {
+            'addresses': len(self._addresses),
+            'claims': self._claims,
+            'conflicts': self._conflicts,
+            'departures': self._departures,
+        }
+
+    def subscribe(self, callback):
+        """Calls ``callback(event, address, name, timestamp)`` for every
+        :class:`AddressEvent`"""
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self._subscribers.remove(callback)
+
+    def name(self, address):
+        """Returns the NAME value holding the address, None if it is free"""
+        if 0 <= address < _ADDRESS_COUNT:
+            return self._names[address]
+        return None
+
+    def address(self, name):
+        """Returns the address held by the NAME (value or :class:`j1939.Name`), None if none"""
+        if not isinstance(name, int):
+            name = name.value
+        return self._addresses.get(name)
+
+    def claimed_at(self, address):
+        """Returns the timestamp of the last claim of the address, None if it is free"""
+        if address in self:
+            return self._claimed_at[address]
+        return None
+
+    def items(self):
+        """Returns the (address, NAME value) pairs, ordered by address"""
+        return [(address, name) for address, name in enumerate(self._names) if name is not None]
+
+    def process_claim(self, src_address, data, timestamp):
+        """Feeds an address claimed PGN
+
+        :param int src_address: source address of the claim, 254 for cannot claim
+        :param data: the 8 bytes NAME
+        :param float timestamp: time the claim was received
+        """
+        if len(data) < 8:
+            return
+        self._claims += 1
+        name = _name_value(data)
+        if src_address == _NULL:
+            old = self._addresses.get(name)
+            if old is not None:
+                self._release(old, timestamp)
+            return
+        if src_address >= _ADDRESS_COUNT:
+            return
+
+        holder = self._names[src_address]
+        if holder == name:
+            self._claimed_at[src_address] = timestamp
+            return
+        if holder is not None:
+            self._conflicts += 1
+            if name > holder:
+                # the contender loses, it has to claim another address
+                logger.info("address {} claimed by NAME {:016X}, held by {:016X}".format(src_address, name, holder))
+                self._notify(AddressEvent.CONFLICT, src_address, name, timestamp)
+                return
+            logger.info("address {} taken over by NAME {:016X} from {:016X}".format(src_address, name, holder))
+            self._notify(AddressEvent.CONFLICT, src_address, holder, timestamp)
+            self._release(src_address, timestamp)
+
+        old = self._addresses.get(name)
+        if old is not None:
+            self._release(old, timestamp)
+        self._names[src_address] = name
+        self._claimed_at[src_address] = timestamp
+        self._addresses[name] = src_address
+        self._notify(AddressEvent.CLAIMED, src_address, name, timestamp)
+
+    def _release(self, address, timestamp):
+        name = self._names[address]
+        self._names[address] = None
+        del self._addresses[name]
+        self._departures += 1
+        self._notify(AddressEvent.DEPARTED, address, name, timestamp)
+
+    def expire(self, before, timestamp=None):
+        """Releases the addresses without a claim since ``before``
+
+        :param float before: e.g. the time a global request for address claimed was sent
+        :param float timestamp: passed to the subscribers, ``before`` by default
+        :return: the addresses released
+        """
+        if timestamp is None:
+            timestamp = before
+        expired = [address for address, name in enumerate(self._names)
+                   if name is not None and self._claimed_at[address] < before]
+        for address in expired:
+            self._release(address, timestamp)
+        return expired
+
+    def clear(self):
+        """Forgets all addresses, without events"""
+        self._names = [None] * _ADDRESS_COUNT
+        self._addresses = {}
+
+    def _notify(self, event, address, name, timestamp):
+        for callback in self._subscribers:
+            callback(event, address, name, timestamp)
@@ -1,65 +1,512 @@
-import adafruit_logging as logging
-import board
-import busio
 import time
-from digitalio import DigitalInOut
-from adafruit_mcp2515.canio import Message, RemoteTransmissionRequest
-from adafruit_mcp2515 import MCP2515 as CAN
+from array import array
+from .acceptance_filter import accepts, fit_filters
+from . import log
+
+_log = log.get("can")
+
+class CanRxRing:
+    """Preallocated ring of received CAN frames.
+
+    Each slot holds the CAN-ID, the data length, the data and the
+    monotonic time the frame was taken from the controller. Frames are
+    written by the receive side (:meth:`put`) and handed out in batches
+    (:meth:`deliver`). If the ring is full, new frames are dropped and
+    counted as overruns.
+    """
+
+    def __init__(self, size=64, data_size=8):
+        """
+        :param int size:
+            Number of slots.
+        :param int data_size:
+            Maximum payload of a frame, 8 for classic CAN, 64 for CAN FD.
+        """
+        self._size = size
+        self._data_size = data_size
+        self._ids = array('L', (0 for _ in range(size)))
+        self._timestamps = array('d', (0 for _ in range(size)))
+        self._dlcs = bytearray(size)
+        self._data = bytearray(size * data_size)
+        self._data_view = memoryview(self._data)
+        self._head = 0
+        self._tail = 0
+        self._count = 0
+        self.overruns = 0
+        self.high_water = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size(self):
+        """Number of slots."""
+        return self._size
+
+    def put(self, can_id, data, timestamp):
+        """Stores a frame
+
+        :return:
+            False if the ring was full and the frame was dropped.
+        """
+        if self._count >= self._size:
+            self.overruns += 1
+            return False
+        slot = self._head
+        length = len(data)
+        if length > self._data_size:
+            length = self._data_size
+        offset = slot * self._data_size
+        self._data_view[offset:offset + length] = data[:length]
+        self._ids[slot] = can_id
+        self._dlcs[slot] = length
+        self._timestamps[slot] = timestamp
+        self._head = (slot + 1) % self._size
+        self._count += 1
+        if self._count > self.high_water:
+            self.high_water = self._count
+        return True
+
+    def deliver(self, callback):
+        """Hands all stored frames to ``callback(can_id, data, timestamp)``, oldest first.
+
+        The data is passed as a bytearray of its own, so the callback may keep it.
+
+        :return:
+            The number of frames delivered.
+        """
+        count = self._count
+        slot = self._tail
+        size = self._size
+        data_size = self._data_size
+        ids = self._ids
+        dlcs = self._dlcs
+        timestamps = self._timestamps
+        data = self._data
+        for _ in range(count):
+            offset = slot * data_size
+            # free the slot before the callback, it may poll the bus again
+            self._tail = (slot + 1) % size
+            self._count -= 1
+            callback(ids[slot], data[offset:offset + dlcs[slot]], timestamps[slot])
+            slot = self._tail
+        return count
+
+    def clear(self):
+        """Drops all stored frames."""
+        self._head = 0
+        self._tail = 0
+        self._count = 0
+
+
+class Mcp2515Backend:
+    """MCP2515 CAN controller on SPI, using the adafruit_mcp2515 driver.
+
+    The listener is opened once and kept for the lifetime of the backend.
+    """
+
+    # error flag register and its receive buffer overflow bits
+    _EFLG = 0x2D
+    _EFLG_RXOVR = 0xC0
+
+    # filters per mask: mask 0 with filters 0-1 (RXB0), mask 1 with filters 2-5 (RXB1)
+    filter_slots = (2, 4)
+    # mask registers RXM0, RXM1 and filter registers RXF0-1, RXF2-5
+    _RXM = (0x20, 0x24)
+    _RXF = ((0x00, 0x04), (0x08, 0x10, 0x14, 0x18))
+
+    def __init__(self, **kwargs):
+        # imported here, so the stack can be used without the driver (e.g. on a host)
+        import busio
+        from digitalio import DigitalInOut
+        from adafruit_mcp2515 import MCP2515
+        from adafruit_mcp2515.canio import Message
+        self._message_class = Message
+        self._cs = DigitalInOut(kwargs.get('cs'))
+        self._cs.switch_to_output()
+        self._spi = busio.SPI(kwargs.get('sck'), kwargs.get('mosi'), kwargs.get('miso'))
+        self._can = MCP2515(self._spi, self._cs, baudrate=kwargs.get('bitrate', 250000), debug=True)
+        self._listener = self._can.listen(timeout=0)
+
+    def drain(self, ring):
+        """Moves all frames waiting in the controller to the ring
+
+        :return:
+            The number of frames read.
+        """
+        listener = self._listener
+        monotonic = time.monotonic
+        received = 0
+        while True:
+            # in_waiting reads the hardware buffers into the driver queue
+            count = listener.in_waiting()
+            if count == 0:
+                return received
+            for _ in range(count):
+                msg = listener.receive()
+                if msg is None:
+                    break
+                if isinstance(msg, self._message_class):
+                    ring.put(msg.id, msg.data, monotonic())
+                    received += 1
+
+    def overflows(self):
+        """Returns the number of receive buffer overflows since the last call."""
+        # pylint: disable=protected-access
+        eflg = self._can._read_register(self._EFLG)
+        if not eflg & self._EFLG_RXOVR:
+            return 0
+        self._can._mod_register(self._EFLG, self._EFLG_RXOVR, 0)
+        return ((eflg >> 6) & 1) + ((eflg >> 7) & 1)
+
+    def set_filters(self, filters):
+        """Installs acceptance filters, as listed by :func:`j1939.acceptance_filter.fit_filters`
+        for :attr:`filter_slots`, None accepts everything."""
+        # pylint: disable=protected-access
+        # The mask and filter registers are written directly: listen(matches=...)
+        # of the driver takes a mask of its own for each match, and there are two.
+        if filters is None:
+            # masks of 0 accept all frames
+            groups = ([(0, 0)], [(0, 0)])
+            extended = False
+        else:
+            # fit_filters lists the filters of mask 0 first, mask 1 may be the same
+            count = 1
+            while count < len(filters) and count < len(self._RXF[0]) and filters[count][1] == filters[0][1]:
+                count += 1
+            groups = (filters[:count], filters[count:])
+            if not groups[1]:
+                # mask 1 with the filters of mask 0, RXB1 must not accept more
+                groups = (groups[0], groups[0])
+            extended = True
+        for mask_register, filter_registers, group in zip(self._RXM, self._RXF, groups):
+            self._can._write_id_to_register(mask_register, group[0][1], extended)
+            for index, filter_register in enumerate(filter_registers):
+                # unused filters repeat one of the group
+                self._can._write_id_to_register(filter_register, group[index % len(group)][0], extended)
+
+    def send(self, can_id, data, extended_id):
+        self._can.send(self._message_class(can_id, data, extended_id))
+
+    def deinit(self):
+        self._listener.deinit()
+        self._can.deinit()
+
+
+class SoftwareCanBackend:
+    """CAN controller emulated in software, to run the stack on a host without CAN hardware.
+
+    Frames given to :meth:`inject` wait in ``rx_buffers`` receive buffers,
+    like the two buffers of a MCP2515. Frames injected while all buffers
+    are occupied are lost and counted as overflows. Sent frames are kept
+    in :attr:`sent` and, with ``loopback``, received again. Frames not
+    passing the acceptance filters are discarded before the receive
+    buffers, like in a controller.
+
+    :param tuple filter_slots:
+        Filters per mask to emulate, e.g. (2, 4) for a MCP2515, None for no limit.
+    """
+
+    def __init__(self, rx_buffers=2, loopback=False, filter_slots=None, **kwargs):
+        self._rx_buffers = rx_buffers
+        self._loopback = loopback
+        self.filter_slots = filter_slots
+        self._filters = None
+        self._rx = []
+        self._overflows = 0
+        self.filtered = 0
+        self.sent = []
+
+    def inject(self, can_id, data, extended_id=True):
+        """Puts a frame into the receive buffers, as if it was received from the bus
+
+        :return:
+            False if the frame was lost because all buffers were occupied
+            or discarded by the acceptance filters.
+        """
+        if self._filters is not None and not accepts(self._filters, can_id):
+            self.filtered += 1
+            return False
+        if len(self._rx) >= self._rx_buffers:
+            self._overflows += 1
+            return False
+        self._rx.append((can_id, bytes(data), time.monotonic()))
+        return True
+
+    def drain(self, ring):
+        received = len(self._rx)
+        for can_id, data, timestamp in self._rx:
+            ring.put(can_id, data, timestamp)
+        self._rx = []
+        return received
+
+    def overflows(self):
+        count = self._overflows
+        self._overflows = 0
+        return count
+
+    def set_filters(self, filters):
+        self._filters = filters
+
+    def send(self, can_id, data, extended_id):
+        self.sent.append((can_id, bytes(data), extended_id))
+        if self._loopback:
+            self.inject(can_id, data, extended_id)
+
+    def deinit(self):
+        self._rx = []
+
+
+class SocketCanBackend:
+    """Linux SocketCAN interface (e.g. ``vcan0``) as CanBus backend.
+
+    Needs CPython on Linux. A virtual interface is set up with::
+
+        sudo ip link add dev vcan0 type vcan
+        sudo ip link set up vcan0
+
+    :param str channel:
+        Name of the interface.
+    :param bool fd:
+        Enable CAN FD frames (j1939-22), the interface must support them.
+    """
+
+    _CAN_EFF_FLAG = 0x80000000
+    _CAN_RTR_FLAG = 0x40000000
+    _CAN_ERR_FLAG = 0x20000000
+    _CAN_EFF_MASK = 0x1FFFFFFF
+    _CAN_FRAME = "=IB3x8s"
+    _CAN_FILTER = "=II"
+    # SOL_CAN_RAW options, not exported by all Python versions
+    _CAN_RAW_FILTER = 1
+    _CANFD_FRAME = "=IBB2x64s"
+
+    def __init__(self, channel='vcan0', fd=False, **kwargs):
+        import socket
+        import struct
+        self._struct = struct
+        self._fd = fd
+        self._socket = socket.socket(socket.AF_CAN, socket.SOCK_RAW, socket.CAN_RAW)
+        if fd:
+            self._socket.setsockopt(socket.SOL_CAN_RAW, socket.CAN_RAW_FD_FRAMES, 1)
+        self._socket_module = socket
+        self._socket.bind((channel,))
+        self._socket.setblocking(False)
+        self._overflows = 0
+
+    def drain(self, ring):
+        unpack_from = self._struct.unpack_from
+        monotonic = time.monotonic
+        received = 0
+        while True:
+            try:
+                frame = self._socket.recv(72)
+            except BlockingIOError:
+                return received
+            if len(frame) == 72:
+                can_id, length, _flags, data = unpack_from(self._CANFD_FRAME, frame)
+            else:
+                can_id, length, data = unpack_from(self._CAN_FRAME, frame)
+            # J1939 uses extended frames only, standard (11 bit) frames are skipped
+            if can_id & (self._CAN_RTR_FLAG | self._CAN_ERR_FLAG) or not can_id & self._CAN_EFF_FLAG:
+                continue
+            ring.put(can_id & self._CAN_EFF_MASK, data[:length], monotonic())
+            received += 1
+
+    def overflows(self):
+        # the kernel queue overflows silently unless SO_RXQ_OVFL is used
+        return 0
+
+    def set_filters(self, filters):
+        if filters is None:
+            # the default filter of the kernel, everything passes
+            data = self._struct.pack(self._CAN_FILTER, 0, 0)
+        else:
+            # the EFF flag in id and mask lets extended frames pass only
+            flag = self._CAN_EFF_FLAG
+            data = b''.join(self._struct.pack(self._CAN_FILTER, can_id | flag, mask | flag) for can_id, mask in filters)
+        self._socket.setsockopt(self._socket_module.SOL_CAN_RAW, self._CAN_RAW_FILTER, data)
+
+    def send(self, can_id, data, extended_id):
+        if extended_id:
+            can_id = (can_id & self._CAN_EFF_MASK) | self._CAN_EFF_FLAG
+        if len(data) > 8:
+            frame = self._struct.pack(self._CANFD_FRAME, can_id, len(data), 0, bytes(data))
+        else:
+            frame = self._struct.pack(self._CAN_FRAME, can_id, len(data), bytes(data))
+        self._socket.send(frame)
+
+    def deinit(self):
+        self._socket.close()
 
-logger = logging.getLogger("can")
 
 class CanBus:
     """
+    CAN bus interface of the ECU.
+
+    Received frames are moved from the controller to a :class:`CanRxRing`
+    as soon as possible (:meth:`poll`) and handed to ``on_receive`` in
+    batches (:meth:`loop`).
     """
 
     def __init__(self, **kwargs):
         """
+        :param str bus_type:
+            'mcp2515', 'software' (:class:`SoftwareCanBackend`, for tests on a host),
+            'virtual' (a node on the :class:`j1939.virtual_bus.VirtualBus` given as 'bus')
+            or 'socketcan' (:class:`SocketCanBackend`, Linux interface given as 'channel', e.g. 'vcan0')
+        :param backend:
+            Alternative to bus_type, an already created backend object.
+        :param int ring_size:
+            Number of frames the receive ring holds (default 64).
+        :param on_receive:
+            Called as ``on_receive(can_id, data, timestamp)`` for each received frame.
+
+        Further arguments are passed to the backend (e.g. 'bitrate', 'cs',
+        'sck', 'mosi', 'miso' for 'mcp2515').
         """
-        print(kwargs);
+        _log.refresh()
         self._bus_type = kwargs.get('bus_type')
-        logger.info("bus_type {0}".format(self._bus_type))
-        if self._bus_type == "native":
-            # ToDo
-            pass
+        _log.info("bus_type {0}", self._bus_type)
+        backend = kwargs.get('backend')
+        if backend is not None:
+            self._bus = backend
         elif self._bus_type == "mcp2515":
-            self._cs = DigitalInOut(kwargs.get('cs'))
-            self._cs.switch_to_output()
-            self._spi = busio.SPI(kwargs.get('sck'), kwargs.get('mosi'), kwargs.get('miso'))
-            self._bus = CAN(self._spi, self._cs, debug = True)
+            self._bus = Mcp2515Backend(**kwargs)
+        elif self._bus_type == "software":
+            self._bus = SoftwareCanBackend(**kwargs)
+        elif self._bus_type == "virtual":
+            self._bus = kwargs['bus'].attach(**kwargs)
+        elif self._bus_type == "socketcan":
+            self._bus = SocketCanBackend(**kwargs)
+        else:
+            raise ValueError("unsupported bus_type '{0}'".format(self._bus_type))
+        self._ring = CanRxRing(kwargs.get('ring_size', 64), kwargs.get('data_size', 8))
         self._on_receive = kwargs.get('on_receive')
+        self._received = 0
+        self._delivered = 0
+        self._hw_overruns = 0
+        self._filters = None
+
+    @property
+    def backend(self):
+        """The backend object (e.g. :class:`SoftwareCanBackend`)."""
+        return self._bus
+
+    @property
+    def stats(self):
+        """Receive statistics.
+
+        :rtype: dict: 'received', 'delivered', 'queued', 'high_water',
+            'ring_overruns' (frames dropped because the ring was full),
+            'hw_overruns' (frames lost in the controller),
+            'filters' (acceptance filters installed, None if all frames are accepted)
+        """
+        return {
+            'received': self._received,
+            'delivered': self._delivered,
+            'queued': len(self._ring),
+            'high_water': self._ring.high_water,
+            'ring_overruns': self._ring.overruns,
+            'hw_overruns': self._hw_overruns,
+            'filters': len(self._filters) if self._filters is not None else None,
+        }
+
+    @property
+    def clock(self):
+        """Callable returning the current time of the clock the received frames
+        are stamped with, the one of the backend (e.g. a :class:`j1939.virtual_bus.VirtualBus`),
+        ``time.monotonic`` by default."""
+        return getattr(self._bus, 'clock', time.monotonic)
+
+    @property
+    def filters(self):
+        """The acceptance filters installed, (can_id, mask) pairs, None if all frames are accepted."""
+        return self._filters
+
+    def set_filters(self, filters):
+        """Installs acceptance filters in the controller
+
+        The filters are merged down to the number the controller can hold
+        (the frames let through in addition are dropped by the stack).
+
+        :param list filters:
+            (can_id, mask) pairs for extended frames, a frame passes if
+            ``can_id & mask`` equals the filter's can_id. None accepts everything.
+        :return:
+            False if the backend has no acceptance filters.
+        """
+        set_filters = getattr(self._bus, 'set_filters', None)
+        if set_filters is None:
+            return False
+        filters = fit_filters(filters, getattr(self._bus, 'filter_slots', None))
+        if filters == self._filters:
+            return True
+        # frames waiting in the controller were accepted with the old filters
+        self.poll()
+        set_filters(filters)
+        self._filters = filters
+        _log.info("acceptance filters {0}", filters)
+        return True
 
     def shutdown(self):
         """Shutdown the CAN bus.
         """
-        logger.info("shutdown | bus_type {0}".format(self._bus_type))
-        if self._bus_type == "native":
-            # ToDo
-            pass
-        elif self._bus_type == "mcp2515":        
-            self._bus.deinit();
+        _log.info("shutdown | bus_type {0}", self._bus_type)
+        self._bus.deinit()
         self._bus = None
-        self._notify = None
+        self._on_receive = None
 
     def send(self, can_id, data, extended_id):
         """Send a raw CAN message to the bus.
         """
-        logger.debug("send | bus_type {0} | can_id {1} | extended_id {2} | data {3}".format(self._bus_type, can_id, extended_id, data))
+        if _log.trace:
+            _log.frame("TX", can_id, data)
         if not self._bus:
             raise RuntimeError("Not connected to CAN bus")
-        if self._bus_type == "native":
-            # ToDo
-            pass
-        elif self._bus_type == "mcp2515":
-            message = Message(can_id, data, extended_id)
-            self._bus.send(message)
+        self._bus.send(can_id, data, extended_id)
+
+    def poll(self):
+        """Moves the frames waiting in the controller to the receive ring
+
+        Cheap enough to be called between other work, to keep the
+        controller buffers from overflowing.
+
+        :return:
+            The number of frames read.
+        """
+        received = self._bus.drain(self._ring)
+        self._received += received
+        overflows = self._bus.overflows()
+        if overflows:
+            self._hw_overruns += overflows
+            _log.warning("receive buffer overflow, {0} frame(s) lost", overflows)
+        return received
 
     def loop(self, timeout=0.1):
-        timestamp = time.time()
-        with self._bus.listen(timeout = timeout) as listener:
-            message_count = listener.in_waiting()
-            while message_count > 0: 
-                for _i in range(message_count):
-                    msg = listener.receive()
-                    if self._on_receive:
-                        self._on_receive(msg.id, msg.data, timestamp)
-                message_count -= 1
\ No newline at end of file
+        """Reads the controller and delivers the received frames to on_receive
+
+        :param timeout:
+            Unused, the controller is read without waiting.
+        """
+        on_receive = self._on_receive
+        if _log.trace and on_receive:
+            on_receive = self._trace_receive
+        ring = self._ring
+        self.poll()
+        # frames received while the batch is processed are delivered in the
+        # same call, bounded to keep a busy bus from starving the caller
+        limit = ring.size
+        while len(ring) and limit > 0:
+            if on_receive:
+                delivered = ring.deliver(on_receive)
+            else:
+                delivered = len(ring)
+                ring.clear()
+            self._delivered += delivered
+            limit -= delivered
+            self.poll()
+
+    def _trace_receive(self, can_id, data, timestamp):
+        _log.frame("RX", can_id, data)
+        self._on_receive(can_id, data, timestamp)
@@ -1,4 +1,5 @@
 import adafruit_logging as logging
+import time
 import j1939
 from .message_id import FrameFormat
 
@@ -17,6 +18,13 @@ class ControllerApplication:
         VETO = 0.250
         REQUEST_FOR_CLAIM = 1.250
 
+    class Acknowledgement:
+        """Control byte of the acknowledgement PGN"""
+        ACK = 0
+        NACK = 1
+        AccessDenied = 2
+        CannotRespond = 3
+
     class FieldValue:
         # The following values are in "Little Endian First" Byteorder
 
@@ -33,7 +41,7 @@ class ControllerApplication:
         MAX_16 = 0xFAFF
         MAX_16_ARR = [0xFA, 0xFF]
 
-    def __init__(self, name, device_address_preferred=None, bypass_address_claim=False):
+    def __init__(self, name, device_address_preferred=None, bypass_address_claim=False, nack_unknown_requests=False):
         """
         :param name:
             A j1939 :class:`j1939.Name` instance
@@ -41,6 +49,10 @@ class ControllerApplication:
             The device_address this CA should claim on the bus.
         :param bypass_address_claim:
             Flag to bypass address claim procedure
+        :param nack_unknown_requests:
+            Answer destination specific requests with a NACK if the PGN has no
+            responder (see :meth:`add_responder`) and no request subscriber
+            returned True for it.
         """
         self._name = name
         self._device_address_preferred = device_address_preferred
@@ -53,8 +65,17 @@ class ControllerApplication:
             self._device_address = j1939.ParameterGroupNumber.Address.NULL
             self._device_address_state = ControllerApplication.State.NONE
         self._ecu = None
+        # handle of the address claim timer event, None while not running
+        self._claim_timer = None
         self._subscribers_request = []
         self._subscribers_acknowledge = []
+        # answers of requests: pgn -> [payload, generator, priority, max_age, expiry of the payload]
+        self._responders = {}
+        self.nack_unknown_requests = nack_unknown_requests
+        self._requests = 0
+        self._answered = 0
+        self._generated = 0
+        self._nacked = 0
 
     def associate_ecu(self, ecu):
         """Binds this CA to the ECU given
@@ -68,12 +89,16 @@ class ControllerApplication:
     def remove_ecu(self):
         self._ecu = None
 
-    def subscribe(self, callback):
+    def subscribe(self, callback, pgn=None, src_address=None):
         """Add the given callback to the message notification stream.
         :param callback:
             Function to call when message is received.
+        :param int pgn:
+            Only deliver messages with this Parameter Group Number, None delivers all.
+        :param int src_address:
+            Only deliver messages from this source address, None delivers all.
         """
-        self._ecu.subscribe(callback, self.message_acceptable)
+        self._ecu.subscribe(callback, self.message_acceptable, pgn, src_address)
 
     def unsubscribe(self, callback):
         """Stop listening for message.
@@ -84,7 +109,10 @@ class ControllerApplication:
 
     def subscribe_request(self, callback):
         """Add the given callback to the request notification stream.
-        :param callback: Function to call when a request is received.
+        :param callback: Function to call when a request is received,
+            ``callback(src_address, dest_address, pgn)``. Returns True if it
+            answers the request (no NACK, see nack_unknown_requests).
+            Not called for the PGNs with a responder.
         """
         self._subscribers_request.append(callback)
 
@@ -106,19 +134,69 @@ class ControllerApplication:
         """
         pass
 
+    def add_responder(self, pgn, payload=None, generator=None, priority=6, max_age=None):
+        """Answers the requests of a PGN
+
+        The answer is the fixed ``payload`` or the one returned by
+        ``generator(pgn)``. A generated answer is kept and sent for the
+        following requests until :meth:`invalidate_responder` is called or
+        ``max_age`` seconds passed. Answers longer than a frame are sent
+        with the transport protocol, BAM for global requests and RTS/CTS
+        to the requester for destination specific ones.
+
+        :param int pgn: requested Parameter Group Number
+        :param payload: the answer, bytes or list of int
+        :param generator: callable returning the answer, called at the first
+            request and at the first one after the answer was invalidated
+        :param int priority: priority of the answer
+        :param float max_age: seconds a generated answer is kept, None until invalidated
+        """
+        if (payload is None) == (generator is None):
+            raise ValueError("either payload or generator must be given")
+        if payload is not None:
+            payload = bytearray(payload)
+        self._responders[pgn] = [payload, generator, priority, max_age, 0]
+
+    def remove_responder(self, pgn):
+        """Stops answering the requests of a PGN, False if it had no responder"""
+        return self._responders.pop(pgn, None) is not None
+
+    def invalidate_responder(self, pgn=None):
+        """Drops the generated answer of a PGN (of all PGNs if None), the next request generates it again"""
+        for key, responder in self._responders.items():
+            if responder[1] is not None and (pgn is None or key == pgn):
+                responder[0] = None
+
+    @property
+    def request_stats(self):
+        """Statistics of the requests received.
+
+        :rtype: dict: 'requests' (for us, address claim excluded), 'answered' (by a responder),
+            'generated' (answers built by a generator), 'nacked'
+        """
+        return {
+            'requests': self._requests,
+            'answered': self._answered,
+            'generated': self._generated,
+            'nacked': self._nacked,
+        }
+
     def add_timer(self, delta_time, callback, cookie=None):
         """Adds a callback to the list of timer events
         :param delta_time:
             The time in seconds after which the event is to be triggered.
         :param callback:
             The callback function to call
+        :return:
+            A handle which can be passed to :meth:`remove_timer`.
         """
-        self._ecu.add_timer(delta_time, callback, cookie)
+        return self._ecu.add_timer(delta_time, callback, cookie)
 
     def remove_timer(self, callback):
         """Removes ALL entries from the timer event list for the given callback
         :param callback:
-            The callback to be removed from the timer event list
+            The callback to be removed from the timer event list,
+            or the handle returned by :meth:`add_timer` to remove only this entry.
         """
         self._ecu.remove_timer(callback)
 
@@ -127,12 +205,19 @@ class ControllerApplication:
         """
         # TODO: how to determine if the CA is already started?
         # raise RuntimeError("Can't start CA. Seems to be already running.")
-        self._ecu.add_timer(0.500, self._process_claim_async)
+        self._start_claim_timer(0.500)
 
     def stop(self):
         """Stops the CA
         """
-        self._ecu.remove_timer(self._process_claim_async)
+        if self._claim_timer is not None:
+            self._ecu.remove_timer(self._claim_timer)
+            self._claim_timer = None
+
+    def _start_claim_timer(self, delta_time):
+        if self._claim_timer is not None:
+            self._ecu.remove_timer(self._claim_timer)
+        self._claim_timer = self._ecu.add_timer(delta_time, self._process_claim_async)
 
     def _process_claim_async(self, cookie):
         time_to_sleep = 0.500
@@ -157,21 +242,22 @@ class ControllerApplication:
         elif self._device_address_state == ControllerApplication.State.CANNOT_CLAIM:
             # do nothing
             pass
-        # add new event with (possibly) new timeout value
-        self._ecu.add_timer(time_to_sleep, self._process_claim_async)
+        self._claim_timer = None
+        if self._device_address_state in (ControllerApplication.State.NONE, ControllerApplication.State.WAIT_VETO):
+            # add new event with (possibly) new timeout value
+            self._start_claim_timer(time_to_sleep)
         # returning false deletes the event from the list
         return False
 
-    def _process_addressclaim(self, mid, data, timestamp):
+    def _process_addressclaim(self, src_address, data, timestamp):
         """Processes an address claim message
-        :param j1939.MessageId mid:
-            A MessageId object holding the information extracted from the can_id.
+        :param int src_address:
+            The source address of the message
         :param bytearray data:
             The data contained in the can-message.
         :param float timestamp:
             The timestamp the message was received (mostly) in fractions of Epoch-Seconds.
         """
-        src_address = mid.source_address
         logger.debug("Received ADDRESS CLAIMED message from source '%d'", src_address)
 
         # are we awaiting this address claimed message?
@@ -201,8 +287,8 @@ class ControllerApplication:
                     self._device_address_announced += 1
                     logger.info("Try the next address '%d'", self._device_address_announced)
                     self._send_address_claimed(self._device_address_announced)
-                    # TODO: it's not possible to set the VETO-Timeout from here
                     self._device_address_state = ControllerApplication.State.WAIT_VETO
+                    self._start_claim_timer(ControllerApplication.ClaimTimeout.VETO)
 
             else:
                 # we have higher prio - repeat our claim message
@@ -214,10 +300,10 @@ class ControllerApplication:
                     # we are in the middle of the claim-process
                     self._send_address_claimed(self._device_address_announced)
 
-    def _process_request(self, mid, dest_address, data, timestamp):
+    def _process_request(self, src_address, dest_address, data, timestamp):
         """Processes a REQUEST message
-        :param j1939.MessageId mid:
-            A MessageId object holding the information extracted from the can_id.
+        :param int src_address:
+            The source address of the message
         :param int dest_address:
             The destination address of the message
         :param bytearray data:
@@ -226,7 +312,6 @@ class ControllerApplication:
             The timestamp the message was received (mostly) in fractions of Epoch-Seconds.
         """
         pgn = data[0] | (data[1] << 8) | (data[2] << 16)
-        src_address = mid.source_address
 
         if (self.state != ControllerApplication.State.NORMAL) or ((self._device_address != dest_address) and (dest_address != j1939.ParameterGroupNumber.Address.GLOBAL)):
             # only answer if
@@ -238,18 +323,59 @@ class ControllerApplication:
         if pgn==j1939.ParameterGroupNumber.PGN.ADDRESSCLAIM:
             # answer the request with our name...
             self._send_address_claimed(self._device_address)
+            return
+
+        self._requests += 1
+        responder = self._responders.get(pgn)
+        if responder is not None:
+            self._answer_request(responder, pgn, src_address, dest_address)
+            return
+
+        answered = False
+        for subscriber in self._subscribers_request:
+            if subscriber(src_address, dest_address, pgn):
+                answered = True
+        if not answered and self.nack_unknown_requests and dest_address != j1939.ParameterGroupNumber.Address.GLOBAL:
+            self._nacked += 1
+            self._send_acknowledgement(ControllerApplication.Acknowledgement.NACK, pgn, src_address)
+
+    def _answer_request(self, responder, pgn, src_address, dest_address):
+        payload, generator, priority, max_age, expiry = responder
+        if generator is not None and (payload is None or (max_age is not None and time.monotonic() >= expiry)):
+            payload = responder[0] = bytearray(generator(pgn))
+            if max_age is not None:
+                responder[4] = time.monotonic() + max_age
+            self._generated += 1
+
+        # answers to global requests are global, others go to the requester
+        if dest_address == j1939.ParameterGroupNumber.Address.GLOBAL:
+            destination = j1939.ParameterGroupNumber.Address.GLOBAL
         else:
-            for subscriber in self._subscribers_request:
-                subscriber(src_address, dest_address, pgn)
+            destination = src_address
+        pdu_format = (pgn >> 8) & 0xFF
+        if pdu_format < 240:
+            pdu_specific = destination
+        else:
+            # PDU2, the transport protocol takes the destination
+            pdu_specific = pgn & 0xFF
+        if self._ecu.send_pgn((pgn >> 16) & 0x1, pdu_format, pdu_specific, priority, self._device_address, payload, dest_address=destination):
+            self._answered += 1
+        elif destination != j1939.ParameterGroupNumber.Address.GLOBAL:
+            # a transfer to the requester is still running
+            self._send_acknowledgement(ControllerApplication.Acknowledgement.CannotRespond, pgn, src_address)
+
+    def _send_acknowledgement(self, control_byte, pgn, address):
+        data = [control_byte, 0xFF, 0xFF, 0xFF, address, (pgn & 0xFF), ((pgn >> 8) & 0xFF), ((pgn >> 16) & 0xFF)]
+        self._ecu.send_pgn(0, (j1939.ParameterGroupNumber.PGN.ACKNOWLEDGEMENT >> 8) & 0xFF, j1939.ParameterGroupNumber.Address.GLOBAL, 6, self._device_address, data)
 
     def send_message(self, priority, parameter_group_number, data):
         if self.state != ControllerApplication.State.NORMAL:
             raise RuntimeError("Could not send message unless address claiming has finished")
 
         mid = j1939.MessageId(priority=priority, parameter_group_number=parameter_group_number, source_address=self._device_address)
-        self._ecu.send_message(mid.can_id, True, data)
+        self._ecu._send_message(mid.can_id, True, data)
 
-    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, data, time_limit=0, frame_format=FrameFormat.FEFF):
+    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, data, time_limit=0, frame_format=FrameFormat.FEFF, on_complete=None):
         """send a pgn
         :param int data_page: data page
         :param int pdu_format: pdu format
@@ -259,11 +385,13 @@ class ControllerApplication:
         :param time_limit: option j1939-22 multi-pg: specify a time limit in s (e.g. 0.1 == 100ms),
         after this time, the multi-pg will be sent. several pgs can thus be combined in one multi-pg.
         0 or no time-limit means immediate sending.
+        :param on_complete: called as ``on_complete(reason)`` when the PGN is sent, see
+        :meth:`j1939.ElectronicControlUnit.send_pgn`
         """
         if self.state != ControllerApplication.State.NORMAL:
             raise RuntimeError("Could not send message unless address claiming has finished")
 
-        return self._ecu.send_pgn(data_page, pdu_format, pdu_specific, priority, self._device_address, data, time_limit, frame_format)
+        return self._ecu.send_pgn(data_page, pdu_format, pdu_specific, priority, self._device_address, data, time_limit, frame_format, on_complete)
 
     def send_request(self, data_page, pgn, destination):
         """send a request message
@@ -281,6 +409,13 @@ class ControllerApplication:
         data = [(pgn & 0xFF), ((pgn >> 8) & 0xFF), ((pgn >> 16) & 0xFF)]
         self._ecu.send_pgn(data_page, (j1939.ParameterGroupNumber.PGN.REQUEST >> 8) & 0xFF, destination & 0xFF, 6, source_address, data)
 
+        if pgn == j1939.ParameterGroupNumber.PGN.ADDRESSCLAIM and destination == j1939.ParameterGroupNumber.Address.GLOBAL:
+            # the CAs of this ECU do not receive the request, they answer it
+            # like all others (also the requester, see SAE J1939-81)
+            for ca in self._ecu.j1939_dll._cas:
+                if ca.state == ControllerApplication.State.NORMAL:
+                    ca._send_address_claimed(ca._device_address)
+
     def _send_address_claimed(self, address):
         # TODO: Normally the (initial) address claimed message must not be an auto repeat message.
         #       We have to use a single-shot message instead!
@@ -288,7 +423,7 @@ class ControllerApplication:
         pgn = j1939.ParameterGroupNumber(0, 238, j1939.ParameterGroupNumber.Address.GLOBAL)
         mid = j1939.MessageId(priority=6, parameter_group_number=pgn.value, source_address=address)
         data = self._name.bytes
-        self._ecu.send_message(mid.can_id, True, data)
+        self._ecu._send_message(mid.can_id, True, data)
 
     def on_request(self, src_address, dest_address, pgn):
         """Callback for PGN requests
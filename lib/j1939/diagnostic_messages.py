@@ -136,6 +136,8 @@ class Dm1:
         self._dtc_dic_list = []
         self._data = []
         self._subscribers = []
+        # timer handles of start_send, by callback
+        self._send_timers = {}
         self._ca = ca
 
     def subscribe(self, callback):
@@ -145,7 +147,7 @@ class Dm1:
             Function to call when Dm1 message is received.
         """
         if self._msg_subscriber_added == False:
-            self._ca.subscribe(self._receive)
+            self._ca.subscribe(self._receive, self._pgn)
             self._msg_subscriber_added = True
 
         self._subscribers.append(callback)
@@ -170,10 +172,18 @@ class Dm1:
             priority of Dm1 message
         """
         cookie = {'cb': callback,}
-        self._ca.add_timer(delta_time=cycletime, callback=self._send, cookie=cookie)
+        self.stop_send(callback)
+        self._send_timers[callback] = self._ca.add_timer(delta_time=cycletime, callback=self._send, cookie=cookie)
 
     def stop_send(self, callback):
-        self._ca.remove_timer(callback)
+        """Stop cyclic sending of Dm1 message
+
+        :param callback:
+            Function given to start_send
+        """
+        handle = self._send_timers.pop(callback, None)
+        if handle is not None:
+            self._ca.remove_timer(handle)
 
     @property
     def dtc_dic_list(self):
@@ -206,14 +216,29 @@ class Dm1:
         return self._data
 
     def _receive(self, priority, pgn, sa, timestamp, data):
-        if pgn == self._pgn:
-            self._data = data
-            self._parse_dm1_receive_data()
-            self._notify_subscribers(sa, timestamp)
+        # subscribed to DM1 only
+        self._data = data
+        self._parse_dm1_receive_data()
+        self._notify_subscribers(sa, timestamp)
 
     def _send(self, cookie):
+        self.send(cookie['cb'])
+        # returning true keeps the timer event active
+        return True
+
+    def send(self, callback, on_complete=None):
+        """Send one Dm1 message
+
+        :param callback:
+            Function returning the lamp status and the DTC list to send, see :meth:`start_send`
+        :param on_complete:
+            Called as ``on_complete(reason)`` when the message is sent,
+            see :meth:`j1939.ElectronicControlUnit.send_pgn`
+        :return:
+            False if the message could not be sent
+        """
         # get dm1 data
-        self._lamp_status, self._dtc_dic_list = cookie['cb']()
+        self._lamp_status, self._dtc_dic_list = callback()
 
         # create payload - lamp status
         self._data = DtcLamp().get_data(self._lamp_status)
@@ -242,10 +267,7 @@ class Dm1:
         else:
             priority = 6
         # send pgn
-        self._ca.send_pgn(0, (self._pgn >> 8) & 0xFF, self._pgn & 0xFF, priority, self._data )
-
-        # returning true keeps the timer event active
-        return True
+        return self._ca.send_pgn(0, (self._pgn >> 8) & 0xFF, self._pgn & 0xFF, priority, self._data, on_complete=on_complete)
 
     def _parse_dm1_receive_data(self):
         length = len(self._data)
@@ -310,6 +332,7 @@ class Dm11:
         for subscriber in self._subscribers_req_clear:
             subscriber(src_address, dest_address, pgn)
             # TODO: send acknowledge
+        return pgn == self._pgn and len(self._subscribers_req_clear) > 0
 
     def _on_acknowledge(self, src_address, dest_address, pgn):
         for subscriber in self._subscribers_ack_clear:
@@ -0,0 +1,192 @@
+import adafruit_logging as logging
+import asyncio
+import time
+
+from .controller_application import ControllerApplication
+from .message_id import FrameFormat
+
+logger = logging.getLogger(__name__)
+
+
+class SendError(Exception):
+    """A PGN could not be sent
+
+    :attr:`reason` is 'busy' (a transfer to the destination is running, or
+    the frame was refused by the controller or the transmit queue),
+    'timeout' or 'aborted' (transport protocol).
+    """
+
+    def __init__(self, reason):
+        super().__init__("send failed: {}".format(reason))
+        self.reason = reason
+
+
+class _Completion:
+    # on_complete callback of the data link layer, awaitable
+
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.reason = None
+
+    def __call__(self, reason):
+        self.reason = reason
+        self.event.set()
+
+
+class EcuRunner:
+    """Runs an :class:`j1939.ElectronicControlUnit` as an asyncio task
+
+    Instead of calling ``ecu.loop`` in a busy loop, the runner sleeps until
+    the next timer or transport protocol deadline returned by ``loop``.
+    While it sleeps, it reads the CAN controller every ``poll_interval``
+    seconds into the receive ring (see :meth:`j1939.can.CanBus.poll`) and
+    runs the ECU as soon as frames arrived. Timers added from other tasks
+    are seen after ``max_sleep`` seconds at the latest, or at once after
+    :meth:`wakeup`. The other tasks (MQTT, Modbus, ...) get the processor
+    in between.
+
+    The ECU has to be connected before the runner is started.
+
+    :param ecu: the ElectronicControlUnit
+    :param float poll_interval: seconds between two reads of the CAN controller,
+        short enough for its receive buffers not to overflow
+    :param float max_sleep: longest sleep without running the ECU
+
+    Example usage:
+
+    .. code-block:: python
+
+        runner = EcuRunner(ecu)
+        runner.start()
+        if await runner.claim(ca):
+            dm1_task = asyncio.create_task(runner.send_dm1(j1939.Dm1(ca), dm1_data))
+            await runner.send_pgn(ca, 0, 0xEF, 0x90, 7, data)  # returns when the transfer completed
+    """
+
+    def __init__(self, ecu, poll_interval=0.005, max_sleep=0.1):
+        self._ecu = ecu
+        self.poll_interval = poll_interval
+        self.max_sleep = max_sleep
+        self._task = None
+        self._wakeup = False
+        self._loops = 0
+        self._polls = 0
+
+    @property
+    def ecu(self):
+        """The ElectronicControlUnit run."""
+        return self._ecu
+
+    @property
+    def stats(self):
+        """Runner statistics.
+
+        :rtype: dict: 'loops' (ECU loop calls), 'polls' (reads of the CAN controller in between)
+        """
+        return {
+            'loops': self._loops,
+            'polls': self._polls,
+        }
+
+    def start(self):
+        """Starts the runner task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    def stop(self):
+        """Cancels the runner task."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def wakeup(self):
+        """Runs the ECU at the next poll, e.g. after a timer was added."""
+        self._wakeup = True
+
+    async def run(self):
+        """Runs the ECU until cancelled."""
+        ecu = self._ecu
+        while True:
+            self._loops += 1
+            self._wakeup = False
+            sleep = ecu.loop(time.time())
+            if sleep > self.max_sleep:
+                sleep = self.max_sleep
+            deadline = time.monotonic() + sleep
+            bus = ecu.bus
+            while True:
+                # yields at least once, also when the next deadline has passed
+                await asyncio.sleep(min(max(sleep, 0), self.poll_interval))
+                if self._wakeup:
+                    break
+                self._polls += 1
+                if bus is not None and bus.poll():
+                    break
+                sleep = deadline - time.monotonic()
+                if sleep <= 0:
+                    break
+
+    async def claim(self, ca):
+        """Starts the address claiming of the CA and waits for its end
+
+        :return: True if the CA claimed its address, False if it cannot claim
+        """
+        if ca.state == ControllerApplication.State.NORMAL:
+            return True
+        ca.start()
+        self.wakeup()
+        while ca.state not in (ControllerApplication.State.NORMAL, ControllerApplication.State.CANNOT_CLAIM):
+            await asyncio.sleep(0.05)
+        return ca.state == ControllerApplication.State.NORMAL
+
+    async def _send(self, send):
+        # send(on_complete) starts the transfer, False if it could not
+        completion = _Completion()
+        try:
+            started = send(completion)
+        except RuntimeError as e:
+            # the frame was not taken by the controller or the transmit queue
+            logger.info("send refused: {}".format(e))
+            started = False
+        if not started:
+            raise SendError('busy')
+        self.wakeup()
+        await completion.event.wait()
+        if completion.reason != 'completed':
+            raise SendError(completion.reason)
+
+    async def send_pgn(self, ca, data_page, pdu_format, pdu_specific, priority, data, time_limit=0, frame_format=FrameFormat.FEFF):
+        """Sends a PGN from the CA and waits until it is sent
+
+        Longer PGNs are sent with the transport protocol, the call returns
+        when the last packet was sent (BAM) or the receiver acknowledged
+        the message (RTS/CTS). Arguments as for
+        :meth:`j1939.ControllerApplication.send_pgn`.
+
+        :raises SendError: the PGN could not be sent
+        """
+        await self._send(lambda on_complete: ca.send_pgn(data_page, pdu_format, pdu_specific, priority, data,
+                                                          time_limit, frame_format, on_complete))
+
+    async def send_dm1(self, dm1, callback, cycletime=1):
+        """Sends a Dm1 every cycletime seconds, until the task is cancelled
+
+        Replaces :meth:`j1939.Dm1.start_send` when the ECU is run by the
+        runner. A Dm1 sent with the transport protocol is finished before
+        the next one is started. Cycles while the CA has no address are
+        skipped.
+
+        :param dm1: :class:`j1939.Dm1` of the sending CA
+        :param callback: returns the lamp status and the DTC list, as for start_send
+        :param float cycletime: seconds between the starts of two Dm1
+        """
+        while True:
+            started = time.monotonic()
+            try:
+                await self._send(lambda on_complete: dm1.send(callback, on_complete))
+            except SendError as e:
+                logger.info("Dm1 not sent: {}".format(e.reason))
+            except RuntimeError:
+                # address claiming not finished
+                pass
+            await asyncio.sleep(max(0, cycletime - (time.monotonic() - started)))
@@ -1,4 +1,3 @@
-import adafruit_logging as logging
 import time
 from .controller_application import ControllerApplication
 from .parameter_group_number import ParameterGroupNumber
@@ -6,17 +5,32 @@ from .j1939_21 import J1939_21
 from .j1939_22 import J1939_22
 from .message_id import FrameFormat
 from .can import CanBus
+from .timer_heap import TimerHeap, TimerHandle
+from .acceptance_filter import pgn_filter
+from . import log
 
-logger = logging.getLogger(__name__)
+_log = log.get(__name__)
 
 class ElectronicControlUnit:
     """ElectronicControlUnit (ECU) holding one or more ControllerApplications (CAs)."""
 
-    def __init__(self, data_link_layer='j1939-21', max_cmdt_packets=1, minimum_tp_rts_cts_dt_interval=None, minimum_tp_bam_dt_interval=None, send_message=None):
+    def __init__(self, data_link_layer='j1939-21', max_cmdt_packets=1, minimum_tp_rts_cts_dt_interval=None, minimum_tp_bam_dt_interval=None, send_message=None, rx_sessions=None, tx_scheduler=None, address_table=None):
         """
         :param data_link_layer:
             specify data-link-layer, 'j1939-21' or 'j1939-22'
+        :param rx_sessions:
+            j1939-21 only: a :class:`j1939.transport.RxSessionManager` limiting the
+            concurrent TP receive sessions, defaults to 16 sessions in 16 kB.
+        :param tx_scheduler:
+            A :class:`j1939.tx_scheduler.TxScheduler` queueing the frames sent to the
+            CAN bus by priority, None sends them straight away.
+        :param address_table:
+            A :class:`j1939.address_table.AddressTable` fed with all address claims
+            on the bus (received and sent by the CAs of this ECU), None to keep none.
         """
+        # levels set on the loggers before the ECU was created
+        _log.refresh()
+
         if send_message:
             self.send_message = send_message
 
@@ -25,18 +39,40 @@ class ElectronicControlUnit:
         if max_cmdt_packets > 0xFF:
             raise ValueError("max number of segments that can be sent is 0xFF")
 
+        # network wide map of addresses and NAMEs
+        self._address_table = address_table
+        address_claimed = address_table.process_claim if address_table is not None else None
+
         # set data link layer
         if data_link_layer == 'j1939-21':
-            self.j1939_dll = J1939_21(self.send_message, self._notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, self._is_message_acceptable)
+            self.j1939_dll = J1939_21(self._send_message, self._notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, self._is_message_acceptable, rx_sessions, address_claimed)
         elif data_link_layer == 'j1939-22':
-            self.j1939_dll = J1939_22(self.send_message, self._notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, self._is_message_acceptable)
+            self.j1939_dll = J1939_22(self._send_message, self._notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, self._is_message_acceptable, address_claimed)
         else:
             raise ValueError("either 'j1939-21' or 'j1939-22' must be provided for data link layer")
 
+        # all subscribers, in order of subscription
         self._subscribers = []
+        # subscribers with a PGN, indexed by (pgn << 9) | source address,
+        # source address 0x100 stands for "any source"
+        self._subscribers_pgn = {}
+        # subscribers without a PGN (wildcard), checked for every message
+        self._subscribers_any = []
+
+        # timer events the loop should care of
+        self._timers = TimerHeap()
+
+        # optional recorder of all received and sent frames, see set_tracer
+        self._tracer = None
 
-        # List of timer events the loop should care of
-        self._timer_events = []
+        # optional transmit queue in front of the CAN bus
+        self._tx_scheduler = tx_scheduler
+
+        # program the acceptance filters of the controller from the subscriptions,
+        # changes are applied by the next loop, so unsubscribe/subscribe pairs
+        # do not reprogram the controller twice
+        self._acceptance_filters = False
+        self._acceptance_filters_changed = False
 
     def stop(self):
         """Stops the ECU background handling
@@ -50,51 +86,58 @@ class ElectronicControlUnit:
 
         :param delta_time:
             The time in seconds after which the event is to be triggered.
+            If the callback returns True it is called again every delta_time seconds.
         :param callback:
             The callback function to call
+        :param cookie:
+            Passed to the callback.
+        :return:
+            A :class:`j1939.timer_heap.TimerHandle` which can be passed to :meth:`remove_timer`.
         """
-
-        d = {
-            'delta_time': delta_time,
-            'callback': callback,
-            'deadline': (time.time() + delta_time),
-            'cookie': cookie,
-            }
-
-        self._timer_events.append( d )
+        return self._timers.add(time.time(), delta_time, callback, cookie)
 
     def remove_timer(self, callback):
         """Removes ALL entries from the timer event list for the given callback
 
         :param callback:
-            The callback to be removed from the timer event list
+            The callback to be removed from the timer event list,
+            or the handle returned by :meth:`add_timer` to remove only this entry.
         """
-        for event in self._timer_events:
-            if event['callback'] == callback:
-                self._timer_events.remove( event )
+        if isinstance(callback, TimerHandle):
+            self._timers.cancel(callback)
+        else:
+            self._timers.cancel_callback(callback)
+
+    def next_timer_deadline(self):
+        """Returns the time of the next timer event, None if there is none."""
+        return self._timers.next_deadline()
 
     def connect(self, **kwargs):
-        """Connect to CAN bus using python-can.
+        """Connect to the CAN bus.
 
-        Arguments are passed directly to :class:`can.BusABC`. Typically these
+        Arguments are passed directly to :class:`j1939.can.CanBus`. Typically these
         may include:
 
-        :param channel:
-            Backend specific channel for the CAN interface.
-        :param str bustype:
-            Name of the interface. See
-            `python-can manual <https://python-can.readthedocs.io/en/latest/configuration.html#interface-names>`__
-            for full list of supported interfaces.
+        :param str bus_type:
+            'mcp2515', or to run without CAN hardware 'software', 'virtual'
+            (with 'bus', a :class:`j1939.virtual_bus.VirtualBus`) or 'socketcan' (with 'channel').
         :param int bitrate:
             Bitrate in bit/s.
+        :param int ring_size:
+            Number of received frames buffered between two calls of :meth:`loop`.
+        :param bool acceptance_filters:
+            Let the controller drop the frames nobody subscribed to (default False),
+            see :meth:`acceptance_filters`.
 
-        :raises can.CanError:
-            When connection fails.
+        The 'mcp2515' bus additionally needs the pins 'cs', 'sck', 'mosi' and 'miso'.
         """
-        logger.info("connect")
+        _log.info("connect")
+        self._acceptance_filters = kwargs.pop('acceptance_filters', False)
+        # j1939-22 runs on CAN FD with up to 64 bytes per frame
+        kwargs.setdefault('data_size', 64 if isinstance(self.j1939_dll, J1939_22) else 8)
         self._bus = CanBus(**kwargs, on_receive = self.notify)
-        #logger.info("Connected to '%s'", self._bus.channel_info)
-        #self._notifier = can.Notifier(self._bus, self._listeners, 1)
+        self._update_acceptance_filters()
+        self._apply_acceptance_filters()
         return self._bus
 
     def disconnect(self):
@@ -105,7 +148,7 @@ class ElectronicControlUnit:
         self._bus.shutdown()
         self._bus = None
 
-    def subscribe(self, callback, device_address=None):
+    def subscribe(self, callback, device_address=None, pgn=None, src_address=None):
         """Add the given callback to the message notification stream.
 
         :param callback:
@@ -115,8 +158,21 @@ class ElectronicControlUnit:
             This is a simple way for peer-to-peer reception without adding a controller-application.
             Only one device address can be entered. Multiple device addresses are only possible with controller applications.
             Note: TP.CMDT will only be received if the destination address is bound to a controller application.
+        :param int pgn:
+            Only deliver messages with this Parameter Group Number (PDU1 PGNs
+            with a pdu specific of 0). None delivers all PGNs.
+        :param int src_address:
+            Only deliver messages from this source address. None delivers all sources.
         """
-        self._subscribers.append({'cb': callback, 'dev_adr':device_address})
+        dic = {'cb': callback, 'dev_adr': device_address, 'pgn': pgn, 'sa': src_address}
+        # lists are replaced, not modified, so a callback may (un)subscribe during dispatch
+        self._subscribers = self._subscribers + [dic]
+        if pgn is None:
+            self._subscribers_any = self._subscribers_any + [dic]
+        else:
+            key = self._subscriber_key(pgn, src_address)
+            self._subscribers_pgn[key] = self._subscribers_pgn.get(key, []) + [dic]
+        self._update_acceptance_filters()
 
     def unsubscribe(self, callback):
         """Stop listening for message.
@@ -124,9 +180,21 @@ class ElectronicControlUnit:
         :param callback:
             Function to call when message is received.
         """
-        for dic in self._subscribers:
-            if dic['cb'] == callback:
-                self._subscribers.remove(dic)
+        self._subscribers = [dic for dic in self._subscribers if dic['cb'] != callback]
+        self._subscribers_any = [dic for dic in self._subscribers_any if dic['cb'] != callback]
+        for key in list(self._subscribers_pgn):
+            subscribers = [dic for dic in self._subscribers_pgn[key] if dic['cb'] != callback]
+            if subscribers:
+                self._subscribers_pgn[key] = subscribers
+            else:
+                del self._subscribers_pgn[key]
+        self._update_acceptance_filters()
+
+    @staticmethod
+    def _subscriber_key(pgn, src_address):
+        if src_address is None:
+            return (pgn << 9) | 0x100
+        return (pgn << 9) | (src_address & 0xFF)
 
 
     def add_ca(self, **kwargs):
@@ -157,7 +225,8 @@ class ElectronicControlUnit:
 
         self.j1939_dll.add_ca(ca)
         ca.associate_ecu(self)
-        
+        self._update_acceptance_filters()
+
         return ca
 
     def remove_ca(self, device_address):
@@ -169,9 +238,46 @@ class ElectronicControlUnit:
         :return:
             True if the ControllerApplication was successfully removed, otherwise False is returned.
         """
-        return self.j1939_dll.remove_ca(device_address)
+        removed = self.j1939_dll.remove_ca(device_address)
+        self._update_acceptance_filters()
+        return removed
+
+    def acceptance_filters(self):
+        """Returns the acceptance filters the frames of interest for this ECU pass
+
+        These are the PGNs subscribed to (by PGN and source address), the
+        transport protocol (any subscribed PGN may arrive in a TP session)
+        and, with ControllerApplications, address claims and requests
+        (address claims also for the address table).
+        Peer-to-peer frames for other nodes are still dropped by the stack.
 
-    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit=0, frame_format=FrameFormat.FEFF):
+        :return:
+            List of (can_id, mask) pairs, None if all frames are of interest
+            (a subscriber without PGN, no subscribers at all or j1939-22,
+            where PGs are packed into multi-PG frames).
+        """
+        cas = self.j1939_dll._cas
+        if isinstance(self.j1939_dll, J1939_22) or self._subscribers_any or not (self._subscribers or cas):
+            return None
+        filters = [pgn_filter(dic['pgn'], dic['sa']) for dic in self._subscribers]
+        filters.append(pgn_filter(ParameterGroupNumber.PGN.TP_CM))
+        filters.append(pgn_filter(ParameterGroupNumber.PGN.DATATRANSFER))
+        if cas or self._address_table is not None:
+            filters.append(pgn_filter(ParameterGroupNumber.PGN.ADDRESSCLAIM))
+        if cas:
+            filters.append(pgn_filter(ParameterGroupNumber.PGN.REQUEST))
+        return filters
+
+    def _update_acceptance_filters(self):
+        self._acceptance_filters_changed = True
+
+    def _apply_acceptance_filters(self):
+        self._acceptance_filters_changed = False
+        if self._bus is None or not self._acceptance_filters:
+            return
+        self._bus.set_filters(self.acceptance_filters())
+
+    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit=0, frame_format=FrameFormat.FEFF, on_complete=None, dest_address=None):
         """send a pgn
         :param int data_page: data page
         :param int pdu_format: pdu format
@@ -182,8 +288,16 @@ class ElectronicControlUnit:
         :param time_limit: option j1939-22 multi-pg: specify a time limit in s (e.g. 0.1 == 100ms),
         after this time, the multi-pg will be sent. several pgs can thus be combined in one multi-pg.
         0 or no time-limit means immediate sending.
+        :param on_complete: called as ``on_complete(reason)`` when the PGN is sent,
+        reason 'completed', or when a transport protocol transfer failed, 'timeout' or 'aborted'
+        ('aborted' also for a j1939-22 multi-PG frame the bus refused).
+        Not called if the PGN could not be sent (False returned).
+        :param int dest_address: destination of a transport protocol transfer of a PDU2 PGN
+        (RTS/CTS instead of BAM), e.g. the requester of a destination specific request.
+        None: pdu_specific of a PDU1 PGN, global for PDU2.
+        :return: False if the PGN could not be sent, e.g. a transfer to the destination is running
         """
-        return self.j1939_dll.send_pgn(data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format)
+        return self.j1939_dll.send_pgn(data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format, on_complete=on_complete, dest_address=dest_address)
 
     def send_message(self, can_id, extended_id, data, fd_format=False):
         """Send a raw CAN message to the bus.
@@ -195,19 +309,72 @@ class ElectronicControlUnit:
         :param int can_id:
             CAN-ID of the message (always 29-bit)
         :param data:
-            Data to be transmitted (anything that can be converted to bytes)
+            Data to be transmitted (anything that can be converted to bytes).
+            Bytes-like data is passed on unconverted, the transport protocols
+            reuse their frame buffer, so it is only valid during the call.
         :param fd_format:
             fd format means bitrate switching and payload of max 64Bytes is active
 
         :raises can.CanError:
             When the message fails to be transmitted
+        :raises RuntimeError:
+            When the frame could not be handed to the controller, or the
+            transmit queue of the tx_scheduler rejected it
         """
-        logger.debug("send_message | can_id {0} | extended_id {1}".format(can_id, extended_id))
+        # the frames are traced by the CAN bus, when handed to the controller
         if not self._bus:
             raise RuntimeError("Not connected to CAN bus")
-        self._bus.send(can_id, bytes(data), extended_id)
+        if self._tx_scheduler is not None:
+            if not self._tx_scheduler.enqueue(can_id, extended_id, data, fd_format):
+                # the sender learns of the lost frame, the data link layer aborts a TP session
+                raise RuntimeError("transmit queue full")
+            self._tx_scheduler.flush(self._bus.send)
+            return
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytes(data)
+        self._bus.send(can_id, data, extended_id)
         # TODO: check error receivement
 
+    def _send_message(self, can_id, extended_id, data, fd_format=False):
+        # all frames of the stack are sent through here
+        if self._tracer is not None or self._address_table is not None:
+            # stamped with the clock of the received frames
+            now = self._bus.clock() if self._bus else time.monotonic()
+        if self._address_table is not None and (can_id >> 8) & 0x3FF00 == ParameterGroupNumber.PGN.ADDRESSCLAIM:
+            # the claims of our own CAs are not received back
+            self._address_table.process_claim(can_id & 0xFF, data, now)
+        self.send_message(can_id, extended_id, data, fd_format)
+        # only frames taken by the bus or the transmit queue, send_message raises otherwise
+        if self._tracer is not None:
+            self._tracer.on_send(can_id, extended_id, data, fd_format, now)
+
+    @property
+    def bus(self):
+        """The :class:`j1939.can.CanBus` of the ECU, None if not connected."""
+        return self._bus
+
+    @property
+    def address_table(self):
+        """The :class:`j1939.address_table.AddressTable` of the ECU, None if it keeps none."""
+        return self._address_table
+
+    @property
+    def tx_scheduler(self):
+        """The :class:`j1939.tx_scheduler.TxScheduler` of the ECU, None if frames are sent straight away."""
+        return self._tx_scheduler
+
+    def set_tracer(self, tracer):
+        """Records all received frames and the frames sent by the stack
+        (send_pgn, ControllerApplications, transport protocols)
+
+        :param tracer:
+            A :class:`j1939.trace.TraceRecorder` (or any object with
+            ``on_receive(can_id, data, timestamp)`` and
+            ``on_send(can_id, extended_id, data, fd_format, timestamp)``), None to stop.
+            The timestamps of both are from the clock of the bus.
+        """
+        self._tracer = tracer
+
     def notify(self, can_id, data, timestamp):
         """Feed incoming CAN message into this ecu.
 
@@ -219,41 +386,38 @@ class ElectronicControlUnit:
         :param bytearray data:
             Data part of the message (0 - 8 bytes)
         :param float timestamp:
-            The timestamp field in a CAN message is a floating point number
-            representing when the message was received since the epoch in
-            seconds.
-            Where possible this will be timestamped in hardware.
+            The time the message was received, in seconds. :class:`j1939.can.CanBus`
+            takes it from ``time.monotonic()`` when the frame is read from the controller.
         """
         # ToDo
         #if msg.is_error_frame or msg.is_remote_frame or (msg.is_extended_id == False):
         #    return
+        if self._tracer is not None:
+            self._tracer.on_receive(can_id, data, timestamp)
         self.j1939_dll.notify(can_id, data, timestamp)
 
     def loop(self, now):
-        
+
+        if self._acceptance_filters_changed:
+            self._apply_acceptance_filters()
+
         self._bus.loop()
 
         next_wakeup = self.j1939_dll.loop(now)
 
-        # check timer events
-        for event in self._timer_events:
-            if event['deadline'] > now:
-                if next_wakeup > event['deadline']:
-                    next_wakeup = event['deadline']
-            else:
-                # deadline reached
-                logger.debug("Deadline for event reached")
-                if event['callback']( event['cookie'] ) == True:
-                    # "true" means the callback wants to be called again
-                    while event['deadline'] < now:
-                        # just to take care of overruns
-                        event['deadline'] += event['delta_time']
-                    # recalc next wakeup
-                    if next_wakeup > event['deadline']:
-                        next_wakeup = event['deadline']
-                else:
-                    # remove from list
-                    self._timer_events.remove( event )
+        # run expired timer events
+        deadline = self._timers.run(now)
+        if deadline is not None and deadline < next_wakeup:
+            next_wakeup = deadline
+
+        # send queued frames, frames held back by a PGN interval wake the loop up in time
+        if self._tx_scheduler is not None and self._bus:
+            self._tx_scheduler.flush(self._bus.send)
+            release = self._tx_scheduler.next_release()
+            if release is not None:
+                release = now + release - self._tx_scheduler.clock()
+                if release < next_wakeup:
+                    next_wakeup = release
 
         time_to_sleep = next_wakeup - time.time()
         return time_to_sleep
@@ -274,11 +438,25 @@ class ElectronicControlUnit:
         :param bytearray data:
             Data of the PDU
         """
-        logger.debug("notify subscribers for PGN {}".format(pgn))
+        if _log.trace:
+            _log.message("RX", priority, pgn, sa, dest, data)
+        # O(1) lookup of the subscribers for this PGN (any source / this source)
+        subscribers = self._subscribers_pgn.get((pgn << 9) | 0x100)
+        if subscribers:
+            self.__notify_list(subscribers, priority, pgn, sa, dest, timestamp, data)
+        subscribers = self._subscribers_pgn.get((pgn << 9) | sa)
+        if subscribers:
+            self.__notify_list(subscribers, priority, pgn, sa, dest, timestamp, data)
+        # wildcard subscribers
+        if self._subscribers_any:
+            self.__notify_list(self._subscribers_any, priority, pgn, sa, dest, timestamp, data)
+
+    def __notify_list(self, subscribers, priority, pgn, sa, dest, timestamp, data):
         # notify only the CA for which the message is intended
         # each CA receives all broadcast messages
-        for dic in self._subscribers:
-            if (dic['dev_adr'] == None) or (dest == ParameterGroupNumber.Address.GLOBAL) or (callable(dic['dev_adr']) and dic['dev_adr'](dest)) or (dest == dic['dev_adr']):
+        for dic in subscribers:
+            dev_adr = dic['dev_adr']
+            if (dic['sa'] is None or dic['sa'] == sa) and ((dev_adr is None) or (dest == ParameterGroupNumber.Address.GLOBAL) or (dest == dev_adr) or (callable(dev_adr) and dev_adr(dest))):
                 dic['cb'](priority, pgn, sa, timestamp, data)
 
     def _is_message_acceptable(self, dest):
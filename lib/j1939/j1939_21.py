@@ -1,5 +1,6 @@
 from .parameter_group_number import ParameterGroupNumber
 from .message_id import MessageId
+from .transport import RxSessionManager, TxSegmenter
 import adafruit_logging as logging
 import time
 
@@ -38,9 +39,9 @@ class J1939_21:
         SENDING_BM              = 2 # sending broadcast packages
         TRANSMISSION_FINISHED   = 3 # finished, remove buffer
 
-    def __init__(self, send_message, notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, ecu_is_message_acceptable):
-        # Receive buffers
-        self._rcv_buffer = {}
+    def __init__(self, send_message, notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, ecu_is_message_acceptable, rx_sessions=None, address_claimed=None):
+        # Receive sessions (TP.CM RTS/BAM reassembly), bounded in number and memory
+        self.rx_sessions = rx_sessions if rx_sessions is not None else RxSessionManager()
         # Send buffers
         self._snd_buffer = {}
 
@@ -53,6 +54,8 @@ class J1939_21:
         # set minimum time between two tp-bam messages
         if minimum_tp_bam_dt_interval == None:
             self._minimum_tp_bam_dt_interval = self.Timeout.Tb
+        else:
+            self._minimum_tp_bam_dt_interval = minimum_tp_bam_dt_interval
 
         # number of packets that can be sent/received with CMDT (Connection Mode Data Transfer)
         self._max_cmdt_packets = max_cmdt_packets
@@ -60,6 +63,8 @@ class J1939_21:
         self.__send_message = send_message
         self.__notify_subscribers = notify_subscribers
         self.__ecu_is_message_acceptable = ecu_is_message_acceptable
+        # called with every address claimed PGN received, e.g. to keep an address table
+        self.__address_claimed = address_claimed
 
     def add_ca(self, ca):
         self._cas.append(ca)
@@ -71,6 +76,38 @@ class J1939_21:
                 return True
         return False
 
+    def _open_rx_session(self, key, pgn, message_size, num_packages, src_address, dest_address, deadline, priority):
+        """Opens a receive session, expiring or evicting other sessions if the limits are reached
+
+        :return:
+            The new session, None if the message can not be received.
+        """
+        sessions = self.rx_sessions
+        if message_size <= sessions.max_session_bytes and not sessions.can_open(message_size):
+            now = time.time()
+            # timeouts are otherwise only checked in loop
+            for expired_key in sessions.expired(now):
+                self._close_rx_session(expired_key, 'timeout')
+            while not sessions.can_open(message_size):
+                victim_key = sessions.victim()
+                if victim_key is None:
+                    break
+                self._close_rx_session(victim_key, 'evicted')
+        session = sessions.open(key, pgn, message_size, num_packages, src_address, dest_address, deadline, priority, time.time())
+        if session is None:
+            logger.warning("No receive session available for PGN {} from 0x{:02X} ({} bytes)".format(pgn, src_address, message_size))
+        return session
+
+    def _close_rx_session(self, key, reason=None):
+        """Closes a receive session, peer-to-peer sessions closed for timeout or eviction are aborted"""
+        session = self.rx_sessions.close(key, reason)
+        if session is None or session.dest_address == ParameterGroupNumber.Address.GLOBAL:
+            return
+        if reason == 'timeout':
+            self.__send_tp_abort(session.dest_address, session.src_address, self.ConnectionAbortReason.TIMEOUT, session.pgn)
+        elif reason == 'evicted':
+            self.__send_tp_abort(session.dest_address, session.src_address, self.ConnectionAbortReason.RESOURCES, session.pgn)
+
     def _buffer_hash(self, src_address, dest_address):
         """Calcluates a hash value for the given address pair
 
@@ -86,16 +123,21 @@ class J1939_21:
         """
         return ((src_address & 0xFF) << 8) | (dest_address & 0xFF)
 
-    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format):
+    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format, on_complete=None, dest_address=None):
         pgn = ParameterGroupNumber(data_page, pdu_format, pdu_specific)
         if len(data) <= 8:
             # send normal message
             mid = MessageId(priority=priority, parameter_group_number=pgn.value, source_address=src_address)
             self.__send_message(mid.can_id, True, data)
+            if on_complete is not None:
+                on_complete('completed')
         else:
             # if the PF is between 0 and 239, the message is destination dependent when pdu_specific != 255
-            # if the PF is between 240 and 255, the message can only be broadcast
-            if (pdu_specific == ParameterGroupNumber.Address.GLOBAL) or ParameterGroupNumber(0, pdu_format, pdu_specific).is_pdu2_format:
+            # if the PF is between 240 and 255, the message is broadcast, unless a destination
+            # is given (e.g. the answer to a destination specific request)
+            if dest_address is not None:
+                pass
+            elif (pdu_specific == ParameterGroupNumber.Address.GLOBAL) or pgn.is_pdu2_format:
                 dest_address = ParameterGroupNumber.Address.GLOBAL
             else:
                 dest_address = pdu_specific
@@ -106,8 +148,9 @@ class J1939_21:
             if buffer_hash in self._snd_buffer:
                 # There is already a sequence active for this pair
                 return False
-            message_size = len(data)
-            num_packets = int(message_size / 7) if (message_size % 7 == 0) else int(message_size / 7) + 1
+            segmenter = TxSegmenter(data)
+            message_size = segmenter.message_size
+            num_packets = segmenter.num_packets
 
             # if the PF is between 240 and 255, the message can only be broadcast
             if dest_address == ParameterGroupNumber.Address.GLOBAL:
@@ -120,55 +163,78 @@ class J1939_21:
                         "priority": priority,
                         "message_size": message_size,
                         "num_packages": num_packets,
-                        "data": data,
+                        "segmenter": segmenter,
                         "state": self.SendBufferState.SENDING_BM,
                         "deadline": time.time() + self._minimum_tp_bam_dt_interval,
                         'src_address' : src_address,
                         'dest_address' : ParameterGroupNumber.Address.GLOBAL,
                         'next_packet_to_send' : 0,
+                        'on_complete': on_complete,
                     }
             else:
                 # send RTS/CTS
-                pgn.pdu_specific = 0  # this is 0 for peer-to-peer transfer
+                if pgn.is_pdu1_format:
+                    pgn.pdu_specific = 0  # this is 0 for peer-to-peer transfer
                 # init new buffer for this connection
                 self._snd_buffer[buffer_hash] = {
                         "pgn": pgn.value,
                         "priority": priority,
                         "message_size": message_size,
                         "num_packages": num_packets,
-                        "data": data,
+                        "segmenter": segmenter,
                         "state": self.SendBufferState.WAITING_CTS,
                         "deadline": time.time() + self.Timeout.T3,
                         'src_address' : src_address,
-                        'dest_address' : pdu_specific,
+                        'dest_address' : dest_address,
                         'next_packet_to_send' : 0,
                         'next_wait_on_cts': 0,
+                        'on_complete': on_complete,
                     }
-                self.__send_tp_rts(src_address, pdu_specific, priority, pgn.value, message_size, num_packets, min(self._max_cmdt_packets, num_packets))
+                self.__send_tp_rts(src_address, dest_address, priority, pgn.value, message_size, num_packets, min(self._max_cmdt_packets, num_packets))
 
         return True
 
+    def _send_completed(self, buf, reason):
+        """Calls the on_complete callback of a finished send buffer
+
+        :param str reason: 'completed', 'timeout' (no CTS) or 'aborted' (by the receiver
+            or a packet which could not be sent)
+        """
+        on_complete = buf['on_complete']
+        if on_complete is not None:
+            on_complete(reason)
+
+    def _abort_send(self, bufid, buf, error):
+        """Ends a send buffer whose packet could not be sent (e.g. no free
+        transmit buffer in the controller), the transfer would have a gap"""
+        logger.warning("TP send of PGN {} to 0x{:02X} aborted: {}".format(buf['pgn'], buf['dest_address'], error))
+        self._snd_buffer.pop(bufid, None)
+        if buf['dest_address'] != ParameterGroupNumber.Address.GLOBAL:
+            try:
+                self.__send_tp_abort(buf['src_address'], buf['dest_address'], self.ConnectionAbortReason.RESOURCES, buf['pgn'])
+            except RuntimeError:
+                # the receiver times out instead
+                pass
+        self._send_completed(buf, 'aborted')
 
     def loop(self, now):
 
         next_wakeup = now + 5.0 # wakeup in 5 seconds
 
-        # check receive buffers for timeout
-        # using "list(x)" to prevent "RuntimeError: dictionary changed size during iteration"
-        for bufid in list(self._rcv_buffer):
-            buf = self._rcv_buffer[bufid]
-            if buf['deadline'] != 0:
-                if buf['deadline'] > now:
-                    if next_wakeup > buf['deadline']:
-                        next_wakeup = buf['deadline']
+        # check receive sessions for timeout
+        sessions = self.rx_sessions
+        for key in sessions.keys():
+            session = sessions.get(key)
+            if session.deadline != 0:
+                if session.deadline > now:
+                    if next_wakeup > session.deadline:
+                        next_wakeup = session.deadline
                 else:
                     # deadline reached
-                    logger.info("Deadline reached for rcv_buffer src 0x%02X dst 0x%02X", buf['src_address'], buf['dest_address'] )
-                    if buf['dest_address'] != ParameterGroupNumber.Address.GLOBAL:
-                        # TODO: should we handle retries?
-                        self.__send_tp_abort(buf['dest_address'], buf['src_address'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
+                    logger.info("Deadline reached for rcv_buffer src 0x%02X dst 0x%02X", session.src_address, session.dest_address )
+                    # TODO: should we handle retries?
                     # TODO: should we notify our CAs about the cancelled transfer?
-                    del self._rcv_buffer[bufid]
+                    self._close_rx_session(key, 'timeout')
 
         # check send buffers
         # using "list(x)" to prevent "RuntimeError: dictionary changed size during iteration"
@@ -183,19 +249,13 @@ class J1939_21:
                     if buf['state'] == self.SendBufferState.WAITING_CTS:
                         logger.info("Deadline WAITING_CTS reached for snd_buffer src 0x%02X dst 0x%02X", buf['src_address'], buf['dest_address'] )
                         self.__send_tp_abort(buf['src_address'], buf['dest_address'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
-                        # TODO: should we notify our CAs about the cancelled transfer?
                         del self._snd_buffer[bufid]
+                        self._send_completed(buf, 'timeout')
                     elif buf['state'] == self.SendBufferState.SENDING_IN_CTS:
                         while buf['next_packet_to_send'] < buf['num_packages']:
                             package = buf['next_packet_to_send']
-                            offset = package * 7
-                            data = buf['data'][offset:]
-                            if len(data)>7:
-                                data = data[:7]
-                            else:
-                                while len(data)<7:
-                                    data.append(255)
-                            data.insert(0, package+1)
+                            data = buf['segmenter'].packet(package)
+                            data[0] = package + 1
 
                             # modify the snd_buffer state in anticipation
                             # of the message we are about to transmit
@@ -213,7 +273,11 @@ class J1939_21:
                                 should_break = True
 
                             # state is ready for recv - Now send the message
-                            self.__send_tp_dt(buf['src_address'], buf['dest_address'], data)
+                            try:
+                                self.__send_tp_dt(buf['src_address'], buf['dest_address'], data)
+                            except RuntimeError as e:
+                                self._abort_send(bufid, buf, e)
+                                break
                             if should_break:
                                 break
 
@@ -223,45 +287,49 @@ class J1939_21:
 
                     elif buf['state'] == self.SendBufferState.SENDING_BM:
                         # send next broadcast message...
-                        offset = buf['next_packet_to_send'] * 7
-                        data = buf['data'][offset:]
-                        if len(data)>7:
-                            data = data[:7]
-                        else:
-                            while len(data)<7:
-                                data.append(255)
-                        data.insert(0, buf['next_packet_to_send']+1)
+                        data = buf['segmenter'].packet(buf['next_packet_to_send'])
+                        data[0] = buf['next_packet_to_send'] + 1
 
                         # modify the snd_buffer state in anticipation
                         # of the message we are about to transmit
 
                         buf['next_packet_to_send'] += 1
 
-                        if buf['next_packet_to_send'] < buf['num_packages']:
+                        done = buf['next_packet_to_send'] >= buf['num_packages']
+                        if not done:
                             buf['deadline'] = time.time() + self._minimum_tp_bam_dt_interval
                             # recalc next wakeup
                             if next_wakeup > buf['deadline']:
                                 next_wakeup = buf['deadline']
                         else:
-                            # done
                             del self._snd_buffer[bufid]
 
                         # state is updated and ready for recv - now send data
-                        self.__send_tp_dt(buf['src_address'], buf['dest_address'], data)
+                        try:
+                            self.__send_tp_dt(buf['src_address'], buf['dest_address'], data)
+                        except RuntimeError as e:
+                            self._abort_send(bufid, buf, e)
+                            continue
+                        if done:
+                            self._send_completed(buf, 'completed')
                     elif buf['state'] == self.SendBufferState.TRANSMISSION_FINISHED:
                         del self._snd_buffer[bufid]
+                        self._send_completed(buf, buf.get('result', 'completed'))
                     else:
                         logger.critical("unknown SendBufferState %d", buf['state'])
                         del self._snd_buffer[bufid]
+                        self._send_completed(buf, 'aborted')
 
         return next_wakeup
 
 
-    def _process_tp_cm(self, mid, dest_address, data, timestamp):
+    def _process_tp_cm(self, priority, src_address, dest_address, data, timestamp):
         """Processes a Transport Protocol Connection Management (TP.CM) message
 
-        :param j1939.MessageId mid:
-            A MessageId object holding the information extracted from the can_id.
+        :param int priority:
+            Priority of the message
+        :param int src_address:
+            The source address of the message
         :param int dest_address:
             The destination address of the message
         :param bytearray data:
@@ -272,14 +340,12 @@ class J1939_21:
         control_byte = data[0]
         pgn = data[5] | (data[6] << 8) | (data[7] << 16)
 
-        src_address = mid.source_address
-
         if control_byte == self.ConnectionMode.RTS:
             message_size = data[1] | (data[2] << 8)
             num_packages = data[3]
             max_num_packages = data[4] # Maximum number of segments that can be sent in response to one CTS.
             buffer_hash = self._buffer_hash(src_address, dest_address)
-            if buffer_hash in self._rcv_buffer:
+            if buffer_hash in self.rx_sessions:
                 # according SAE J1939-21 we have to send an ABORT if an active
                 # transmission is already established
                 self.__send_tp_abort(dest_address, src_address, self.ConnectionAbortReason.BUSY, pgn)
@@ -288,21 +354,15 @@ class J1939_21:
             # limit max number segments
             max_num_packages = min(max_num_packages, num_packages)
 
-            # open new buffer for this connection
-            self._rcv_buffer[buffer_hash] = {
-                    'pgn': pgn,
-                    'message_size': message_size,
-                    'num_packages': num_packages,
-                    'next_packet': min(self._max_cmdt_packets, max_num_packages),
-                    'max_cmdt_packages': self._max_cmdt_packets,
-                    'num_packages_max_rec': min(self._max_cmdt_packets, max_num_packages),
-                    'data': [],
-                    'deadline': time.time() + self.Timeout.T2,
-                    'src_address' : src_address,
-                    'dest_address' : dest_address,
-                }
-
-            self.__send_tp_cts(dest_address, src_address, self._rcv_buffer[buffer_hash]['num_packages_max_rec'], 1, pgn)
+            # open new session for this connection, the payload buffer is taken from the pool here once
+            session = self._open_rx_session(buffer_hash, pgn, message_size, num_packages, src_address, dest_address, time.time() + self.Timeout.T2, priority)
+            if session is None:
+                self.__send_tp_abort(dest_address, src_address, self.ConnectionAbortReason.RESOURCES, pgn)
+                return
+            session.next_packet = min(self._max_cmdt_packets, max_num_packages)
+            session.num_packages_max_rec = min(self._max_cmdt_packets, max_num_packages)
+
+            self.__send_tp_cts(dest_address, src_address, session.num_packages_max_rec, 1, pgn)
         elif control_byte == self.ConnectionMode.CTS:
             num_packages = data[1]
             next_package_number = data[2] - 1
@@ -335,81 +395,70 @@ class J1939_21:
             if buffer_hash not in self._snd_buffer:
                 self.__send_tp_abort(dest_address, src_address, self.ConnectionAbortReason.RESOURCES, pgn)
                 return
-            # TODO: should we inform the application about the successful transmission?
             self._snd_buffer[buffer_hash]['state'] = self.SendBufferState.TRANSMISSION_FINISHED
             self._snd_buffer[buffer_hash]['deadline'] = time.time()
         elif control_byte == self.ConnectionMode.BAM:
             message_size = data[1] | (data[2] << 8)
             num_packages = data[3]
             buffer_hash = self._buffer_hash(src_address, dest_address)
-            if buffer_hash in self._rcv_buffer:
-                # TODO: should we deliver the partly received message to our CAs?
-                del self._rcv_buffer[buffer_hash]
-
-            # init new buffer for this connection
-            self._rcv_buffer[buffer_hash] = {
-                    "pgn": pgn,
-                    "message_size": message_size,
-                    "num_packages": num_packages,
-                    "next_packet": 1,
-                    "max_cmdt_packages": self._max_cmdt_packets,
-                    "data": [],
-                    "deadline": time.time() + self.Timeout.T1,
-                    'src_address' : src_address,
-                    'dest_address' : dest_address,
-                }
+            # TODO: should we deliver the partly received message to our CAs?
+            self._close_rx_session(buffer_hash)
+
+            # init new session for this connection
+            self._open_rx_session(buffer_hash, pgn, message_size, num_packages, src_address, dest_address, time.time() + self.Timeout.T1, priority)
         elif control_byte == self.ConnectionMode.ABORT:
-            # if abort received before transmission established -> cancel transmission
+            # the receiver cancels the transmission, before or while sending the packets
             buffer_hash = self._buffer_hash(dest_address, src_address)
-            if buffer_hash in self._snd_buffer and self._snd_buffer[buffer_hash]['state'] == self.SendBufferState.WAITING_CTS:
-                self._snd_buffer[buffer_hash]['state'] = self.SendBufferState.TRANSMISSION_FINISHED
-                self._snd_buffer[buffer_hash]['deadline'] = time.time()
-            # TODO: any more abort responses?
-            pass
+            buf = self._snd_buffer.get(buffer_hash)
+            if buf is not None and buf['state'] in (self.SendBufferState.WAITING_CTS, self.SendBufferState.SENDING_IN_CTS):
+                buf['state'] = self.SendBufferState.TRANSMISSION_FINISHED
+                buf['result'] = 'aborted'
+                buf['deadline'] = time.time()
         else:
             raise RuntimeError("Received TP.CM with unknown control_byte %d", control_byte)
 
-    def _process_tp_dt(self, mid, dest_address, data, timestamp):
+    def _process_tp_dt(self, priority, src_address, dest_address, data, timestamp):
         sequence_number = data[0]
 
-        src_address = mid.source_address
-
-        buffer_hash = self._buffer_hash(src_address, dest_address)
-        if buffer_hash not in self._rcv_buffer:
+        key = self._buffer_hash(src_address, dest_address)
+        session = self.rx_sessions.get(key)
+        if session is None:
             # TODO: LOG/TRACE/EXCEPTION?
             return
 
-        # get data
-        self._rcv_buffer[buffer_hash]['data'].extend(data[1:])
+        # store the packet at the position of its sequence number
+        session.write(data)
+        now = time.time()
+        session.last_activity = now
 
         # message is complete with sending an acknowledge
-        if len(self._rcv_buffer[buffer_hash]['data']) >= self._rcv_buffer[buffer_hash]['message_size']:
-            logger.info("finished RCV of PGN {} with size {}".format(self._rcv_buffer[buffer_hash]['pgn'], self._rcv_buffer[buffer_hash]['message_size']))
-            # shorten data to message_size
-            self._rcv_buffer[buffer_hash]['data'] = self._rcv_buffer[buffer_hash]['data'][:self._rcv_buffer[buffer_hash]['message_size']]
+        if session.complete:
+            logger.info("finished RCV of PGN {} with size {}".format(session.pgn, session.message_size))
             # finished reassembly
             if dest_address != ParameterGroupNumber.Address.GLOBAL:
-                self.__send_tp_eom_ack(dest_address, src_address, self._rcv_buffer[buffer_hash]['message_size'], self._rcv_buffer[buffer_hash]['num_packages'], self._rcv_buffer[buffer_hash]['pgn'])
-            self.__notify_subscribers(mid.priority, self._rcv_buffer[buffer_hash]['pgn'], src_address, dest_address, timestamp, self._rcv_buffer[buffer_hash]['data'])
-            del self._rcv_buffer[buffer_hash]
+                self.__send_tp_eom_ack(dest_address, src_address, session.message_size, session.num_packages, session.pgn)
+            # the session buffer is handed over as it is, no copy
+            try:
+                self.__notify_subscribers(priority, session.pgn, src_address, dest_address, timestamp, session.data)
+            finally:
+                self.rx_sessions.close(key, 'completed')
             return
 
         # clear to send
-        if (dest_address != ParameterGroupNumber.Address.GLOBAL) and (sequence_number >= self._rcv_buffer[buffer_hash]['next_packet']):
+        if (dest_address != ParameterGroupNumber.Address.GLOBAL) and (sequence_number >= session.next_packet):
 
             # send cts
-            number_of_packets_that_can_be_sent = min( self._rcv_buffer[buffer_hash]['num_packages_max_rec'], self._rcv_buffer[buffer_hash]['num_packages'] - self._rcv_buffer[buffer_hash]['next_packet'] )
-            next_packet_to_be_sent = self._rcv_buffer[buffer_hash]['next_packet'] + 1
-            self.__send_tp_cts(dest_address, src_address, number_of_packets_that_can_be_sent, next_packet_to_be_sent, self._rcv_buffer[buffer_hash]['pgn'])
+            number_of_packets_that_can_be_sent = min( session.num_packages_max_rec, session.num_packages - session.next_packet )
+            next_packet_to_be_sent = session.next_packet + 1
+            self.__send_tp_cts(dest_address, src_address, number_of_packets_that_can_be_sent, next_packet_to_be_sent, session.pgn)
 
             # calculate next packet number at which a CTS is to be sent
-            self._rcv_buffer[buffer_hash]['next_packet'] = min(self._rcv_buffer[buffer_hash]['next_packet'] + self._rcv_buffer[buffer_hash]['num_packages_max_rec'],
-                                                               self._rcv_buffer[buffer_hash]['num_packages'])
+            session.next_packet = min(session.next_packet + session.num_packages_max_rec, session.num_packages)
 
-            self._rcv_buffer[buffer_hash]['deadline'] = time.time() + self.Timeout.T2
+            session.deadline = now + self.Timeout.T2
             return
 
-        self._rcv_buffer[buffer_hash]['deadline'] = time.time() + self.Timeout.T1
+        session.deadline = now + self.Timeout.T1
 
     def __send_tp_dt(self, src_address, dest_address, data):
         pgn = ParameterGroupNumber(0, 235, dest_address)
@@ -468,19 +517,19 @@ class J1939_21:
             Where possible this will be timestamped in hardware.
         """
 
-        mid = MessageId(can_id=can_id)
-        pgn = ParameterGroupNumber()
-        pgn.from_message_id(mid)
+        # decode the 29-bit id with plain integer ops (hot path, no MessageId/PGN objects)
+        priority = (can_id >> 26) & 0x7
+        src_address = can_id & 0xFF
 
-        if pgn.is_pdu2_format:
-            # direct broadcast
-            self.__notify_subscribers(mid.priority, pgn.value, mid.source_address, ParameterGroupNumber.Address.GLOBAL, timestamp, data)
+        if ((can_id >> 16) & 0xFF) >= 240:
+            # PDU2 format: direct broadcast
+            self.__notify_subscribers(priority, (can_id >> 8) & 0x1FFFF, src_address, ParameterGroupNumber.Address.GLOBAL, timestamp, data)
             return
 
         # peer to peer
         # pdu_specific is destination Address
-        pgn_value = pgn.value & 0x1FF00
-        dest_address = pgn.pdu_specific # may be Address.GLOBAL
+        pgn_value = (can_id >> 8) & 0x1FF00
+        dest_address = (can_id >> 8) & 0xFF # may be Address.GLOBAL
 
         # iterate all CAs to check if we have to handle this destination address
         if dest_address != ParameterGroupNumber.Address.GLOBAL:
@@ -494,17 +543,19 @@ class J1939_21:
                     return
 
         if pgn_value == ParameterGroupNumber.PGN.ADDRESSCLAIM:
+            if self.__address_claimed is not None:
+                self.__address_claimed(src_address, data, timestamp)
             for ca in self._cas:
-                ca._process_addressclaim(mid, data, timestamp)
+                ca._process_addressclaim(src_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.REQUEST:
             for ca in self._cas:
                 if ca.message_acceptable(dest_address):
-                    ca._process_request(mid, dest_address, data, timestamp)
+                    ca._process_request(src_address, dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.TP_CM:
-            self._process_tp_cm(mid, dest_address, data, timestamp)
+            self._process_tp_cm(priority, src_address, dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.DATATRANSFER:
-            self._process_tp_dt(mid, dest_address, data, timestamp)
+            self._process_tp_dt(priority, src_address, dest_address, data, timestamp)
         else:
-            self.__notify_subscribers(mid.priority, pgn_value, mid.source_address, dest_address, timestamp, data)
+            self.__notify_subscribers(priority, pgn_value, src_address, dest_address, timestamp, data)
             return
 
@@ -1,8 +1,9 @@
 from .parameter_group_number import ParameterGroupNumber
 from .message_id import MessageId, FrameFormat
+from .transport import TxSegmenter
+from .multi_pg import MultiPgPacker
 import adafruit_logging as logging
 import time
-import ulab.numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -58,13 +59,11 @@ class J1939_22:
         AccessDenied = 2
         CannotRespond = 3
 
-    def __init__(self, send_message, notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, ecu_is_message_acceptable):
+    def __init__(self, send_message, notify_subscribers, max_cmdt_packets, minimum_tp_rts_cts_dt_interval, minimum_tp_bam_dt_interval, ecu_is_message_acceptable, address_claimed=None):
         # Receive buffers
         self._rcv_buffer = {}
         # Send buffers
         self._snd_buffer = {}
-        # Multi-PG Send buffers
-        self._multi_pg_snd_buffer = {}
 
         # List of ControllerApplication
         self._cas = []
@@ -79,6 +78,9 @@ class J1939_22:
         for _ in range(16): self._LUT_FD_DLC.append(48)
         for _ in range(16): self._LUT_FD_DLC.append(64)
 
+        # C-PGs waiting to be sent in a multi-PG, packed best-fit at their deadline
+        self._multi_pg = MultiPgPacker(self._LUT_FD_DLC.__getitem__)
+
         # minimum time between two tp rts/cts dt frames, not necessary for standard conforming applications,
         # (they would use RTS/CTS flow control), but helps to talk to others without patching the library
         self._minimum_tp_rts_cts_dt_interval = minimum_tp_rts_cts_dt_interval
@@ -102,6 +104,8 @@ class J1939_22:
         self.__send_message = send_message
         self.__notify_subscribers = notify_subscribers
         self.__ecu_is_message_acceptable = ecu_is_message_acceptable
+        # called with every address claimed PGN received, e.g. to keep an address table
+        self.__address_claimed = address_claimed
 
     def add_ca(self, ca):
         self._cas.append(ca)
@@ -189,7 +193,7 @@ class J1939_22:
     def __put_rts_cts_session(self, session):
         self.__rts_cts_session_list[session] = True
 
-    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format, tos=2, trailer_format=0):
+    def send_pgn(self, data_page, pdu_format, pdu_specific, priority, src_address, data, time_limit, frame_format, tos=2, trailer_format=0, on_complete=None, dest_address=None):
         pgn = ParameterGroupNumber(data_page, pdu_format, pdu_specific)
         data_length = len(data)
 
@@ -211,45 +215,30 @@ class J1939_22:
                     return False
 
             # create header dict
-            cpg = {'priority': (priority & 0x7), 'tos': (tos & 0x7), 'tf': (trailer_format & 0x7), 'cpgn': (cpgn & 0x3FFFF), 'data_length': data_length, 'data': data.copy()}
+            cpg = {'priority': (priority & 0x7), 'tos': (tos & 0x7), 'tf': (trailer_format & 0x7), 'cpgn': (cpgn & 0x3FFFF), 'data_length': data_length, 'data': data.copy(), 'on_complete': on_complete}
 
-            # send immediately
+            # C-PGs for the same addresses share multi-PG frames, one sent
+            # immediately takes C-PGs waiting for their time limit along
+            channel = self._buffer_hash_mpg(frame_format, 0, src_address, dst_address)
+            now = time.time()
+            self._multi_pg.add(channel, cpg, now + time_limit)
             if time_limit == 0:
-                self.__send_multi_pg(frame_format, [cpg], src_address, dst_address)
-            else:
-                session = 0
-                deadline = time.time() + time_limit
-                while True:
-                    hash = self._buffer_hash_mpg(frame_format, session, src_address, dst_address)
-                    #hash = self._buffer_hash(session, src_address, dst_address)
-                    if hash not in self._multi_pg_snd_buffer:
-                        self._multi_pg_snd_buffer[hash] = {'deadline': deadline, 'cpg': [cpg], 'fill_level': 4 + data_length}
-                        break
-                    elif (self._multi_pg_snd_buffer[hash]['fill_level'] <= (self.DataLength.TP - data_length)):
-                        # update fill level
-                        self._multi_pg_snd_buffer[hash]['fill_level'] += 4 + data_length
-                        # update deadline
-                        if self._multi_pg_snd_buffer[hash]['deadline'] > deadline:
-                            self._multi_pg_snd_buffer[hash]['deadline'] = deadline
-                        # append c-pg
-                        self._multi_pg_snd_buffer[hash]['cpg'].append(cpg)
-                        break
-                    else:
-                        # trigger sending
-                        self._multi_pg_snd_buffer[hash]['deadline'] = time.time()
-                        # get next buffer
-                        session += 1
+                self.__send_multi_pg_frames(now, channel)
         else:
             # if the PF is between 0 and 239, the message is destination dependent when pdu_specific != 255
-            # if the PF is between 240 and 255, the message can only be broadcast
-            if (pdu_specific == ParameterGroupNumber.Address.GLOBAL) or ParameterGroupNumber(0, pdu_format, pdu_specific).is_pdu2_format:
-                dest_address = ParameterGroupNumber.Address.GLOBAL
+            # if the PF is between 240 and 255, the message is broadcast, unless a destination
+            # is given (e.g. the answer to a destination specific request)
+            if dest_address is None:
+                if (pdu_specific == ParameterGroupNumber.Address.GLOBAL) or pgn.is_pdu2_format:
+                    dest_address = ParameterGroupNumber.Address.GLOBAL
+                else:
+                    dest_address = pdu_specific
+            if dest_address == ParameterGroupNumber.Address.GLOBAL:
                 session_num = self.__get_bam_session()
                 if session_num == None:
                     #print('bam session not available')
                     return False
             else:
-                dest_address = pdu_specific
                 session_num = self.__get_rts_cts_session()
                 if session_num == None:
                     #print('rts/cts session not available')
@@ -258,21 +247,14 @@ class J1939_22:
             # init sequence
             buffer_hash = self._buffer_hash(session_num, src_address, dest_address)
 
-            message_size = data_length
-            num_segments = int(message_size / self.DataLength.TP ) + ((message_size % self.DataLength.TP ) != 0)
+            # segments of 4 header bytes and 60 data bytes, the last one padded to a valid FD length
+            segmenter = TxSegmenter(data, self.DataLength.TP, 4, self._LUT_FD_DLC.__getitem__)
+            message_size = segmenter.message_size
+            num_segments = segmenter.num_packets
 
             # set default priority
             if priority == None: priority = 7
 
-            # get chunks from data
-            full_tp_size_packages = int(data_length/self.DataLength.TP)
-            arr = np.array(data)
-            list_of_arr = np.split(arr, [full_tp_size_packages*self.DataLength.TP])
-            arr = np.reshape(list_of_arr[0], (-1,self.DataLength.TP))
-            data_list = arr.tolist()
-            if len(list_of_arr) > 1:
-                data_list.append(list_of_arr[1].tolist())
-
             # if the PF is between 240 and 255, the message can only be broadcast
             if dest_address == ParameterGroupNumber.Address.GLOBAL:
 
@@ -286,16 +268,18 @@ class J1939_22:
                         'session': session_num,
                         'message_size': message_size,
                         'num_segments': num_segments,
-                        'data': data_list,
+                        'segmenter': segmenter,
                         'state': self.SendBufferState.SENDING_BAM,
                         'deadline': time.time() + self._minimum_tp_bam_dt_interval,
                         'src_address' : src_address,
                         'dest_address' : ParameterGroupNumber.Address.GLOBAL,
                         'next_packet_to_send' : 0,
+                        'on_complete': on_complete,
                     }
             else:
                 # send RTS/CTS
-                pgn.pdu_specific = 0  # this is 0 for peer-to-peer transfer
+                if pgn.is_pdu1_format:
+                    pgn.pdu_specific = 0  # this is 0 for peer-to-peer transfer
                 # init new buffer for this connection
                 self._snd_buffer[buffer_hash] = {
                         'pgn': pgn.value,
@@ -303,43 +287,78 @@ class J1939_22:
                         'session': session_num,
                         'message_size': message_size,
                         'num_segments': num_segments,
-                        'data': data_list,
+                        'segmenter': segmenter,
                         'state': self.SendBufferState.WAITING_CTS,
                         'deadline': time.time() + self.Timeout.T3,
                         'src_address' : src_address,
-                        'dest_address' : pdu_specific,
+                        'dest_address' : dest_address,
                         'next_packet_to_send' : 0,
                         'next_wait_on_cts': 0,
+                        'on_complete': on_complete,
                     }
-                self.__send_tp_rts(priority, src_address, pdu_specific, session_num, pgn.value, message_size, num_segments, min(self._max_cmdt_packets, num_segments))
+                self.__send_tp_rts(priority, src_address, dest_address, session_num, pgn.value, message_size, num_segments, min(self._max_cmdt_packets, num_segments))
 
         return True
 
+    def __send_multi_pg_frames(self, now, channel=None):
+        for hash, _priority, cpg_list in self._multi_pg.take(now, channel):
+            frame_format, _msg_counter, src_address, dst_address = self._buffer_unhash_mpg(hash)
+            try:
+                self.__send_multi_pg(frame_format, cpg_list, src_address, dst_address)
+                reason = 'completed'
+            except RuntimeError as e:
+                # e.g. no free transmit buffer in the controller, the C-PGs of the frame are lost
+                logger.warning("multi-PG from 0x{:02X} to 0x{:02X} with {} C-PG(s) aborted: {}".format(src_address, dst_address, len(cpg_list), e))
+                reason = 'aborted'
+            for cpg in cpg_list:
+                if cpg['on_complete'] is not None:
+                    cpg['on_complete'](reason)
+
+    def _send_completed(self, buf, reason):
+        """Calls the on_complete callback of a finished send buffer
+
+        :param str reason: 'completed', 'timeout' (no CTS or EOM acknowledge) or 'aborted' (by the receiver
+            or a segment which could not be sent)
+        """
+        on_complete = buf['on_complete']
+        if on_complete is not None:
+            on_complete(reason)
+
+    def _abort_send(self, bufid, buf, error):
+        """Ends a send buffer whose segment could not be sent (e.g. no free
+        transmit buffer in the controller), the transfer would have a gap"""
+        logger.warning("TP send of PGN {} to 0x{:02X} aborted: {}".format(buf['pgn'], buf['dest_address'], error))
+        self._snd_buffer.pop(bufid, None)
+        if buf['dest_address'] == ParameterGroupNumber.Address.GLOBAL:
+            self.__put_bam_session(buf['session'])
+        else:
+            self.__put_rts_cts_session(buf['session'])
+            try:
+                self.__send_tp_abort(buf['src_address'], buf['dest_address'], buf['session'], self.ConnectionAbortReason.RESOURCES, buf['pgn'])
+            except RuntimeError:
+                # the receiver times out instead
+                pass
+        self._send_completed(buf, 'aborted')
+
     def __send_multi_pg(self, frame_format, cpg_list, src_address, dst_address):
-        # deadline reached
         priority = 7
-        data = []
+        length = 0
+        for cpg in cpg_list:
+            length += 4 + cpg['data_length']
+        data = bytearray(self._LUT_FD_DLC[length])
+        offset = 0
         for cpg in cpg_list:
             priority = min(cpg['priority'], priority)
-            data.append( (cpg['tos'] << 5) | (cpg['tf'] << 2) | ((cpg['cpgn'] >> 16) & 0x3) )
-            data.append( ((cpg['cpgn'] >> 8) & 0xFF) )
-            data.append( (cpg['cpgn'] & 0xFF) )
-            data.append( cpg['data_length'] )
-            data.extend( cpg['data'])
-
-        # padding
-        next_valid_fd_length = self._LUT_FD_DLC[len(data)]
-        if next_valid_fd_length < 0:
-            next_valid_fd_length = 0
-
-        # padding with service header 0
-        padding_cnt = 0
-        while len(data)<next_valid_fd_length:
-            if padding_cnt < 3:
-                data.append(0)
-                padding_cnt += 1
-            else:
-                data.append(0xAA)
+            data[offset] = (cpg['tos'] << 5) | (cpg['tf'] << 2) | ((cpg['cpgn'] >> 16) & 0x3)
+            data[offset + 1] = (cpg['cpgn'] >> 8) & 0xFF
+            data[offset + 2] = cpg['cpgn'] & 0xFF
+            data[offset + 3] = cpg['data_length']
+            data[offset + 4:offset + 4 + cpg['data_length']] = bytes(cpg['data'])
+            offset += 4 + cpg['data_length']
+
+        # padding: a service header of 0 (already there), followed by 0xAA
+        if len(data) > offset + 3:
+            data[offset + 3:] = b'\xaa' * (len(data) - offset - 3)
 
         if frame_format == FrameFormat.FBFF:
             self.__send_message(src_address, False, data, fd_format=True)
@@ -374,21 +393,11 @@ class J1939_22:
                         self.__put_bam_session(buf['session'])
                     # TODO: should we notify our CAs about the cancelled transfer?
 
-        # check multi-pg send buffers for timeout
-        # using 'list(x)' to prevent 'RuntimeError: dictionary changed size during iteration'
-        for bufid in list(self._multi_pg_snd_buffer):
-            buf = self._multi_pg_snd_buffer[bufid]
-            if buf['deadline'] > now:
-                if next_wakeup > buf['deadline']:
-                    next_wakeup = buf['deadline']
-            else:
-                # deadline reached
-                frame_format, session_num, src_address, dst_address = self._buffer_unhash_mpg(bufid)
-
-                self.__send_multi_pg(frame_format, buf['cpg'], src_address, dst_address)
-
-                del self._multi_pg_snd_buffer[bufid]
-
+        # send the multi-pg frames due
+        self.__send_multi_pg_frames(now)
+        deadline = self._multi_pg.next_deadline()
+        if deadline is not None and next_wakeup > deadline:
+            next_wakeup = deadline
 
         # check send buffers
         # using 'list(x)' to prevent 'RuntimeError: dictionary changed size during iteration'
@@ -405,17 +414,22 @@ class J1939_22:
                         self.__send_tp_abort(buf['src_address'], buf['dest_address'], buf['session'], self.ConnectionAbortReason.TIMEOUT, buf['pgn'])
                         del self._snd_buffer[bufid]
                         self.__put_rts_cts_session(buf['session'])
-                        # TODO: should we notify our CAs about the cancelled transfer?
+                        self._send_completed(buf, 'timeout')
 
                     elif buf['state'] == self.SendBufferState.SENDING_RTS_CTS:
                         while buf['next_packet_to_send'] < buf['num_segments']:
                             package = buf['next_packet_to_send']
-                            self.__send_tp_dt(buf['src_address'], buf['dest_address'], buf['session'], package+1, buf['data'][package])
+                            try:
+                                self.__send_tp_dt(buf['src_address'], buf['dest_address'], buf['session'], package+1, buf['segmenter'], package)
+                                # send end of message status
+                                if (package+1) == buf['num_segments']:
+                                    self.__send_tp_eom_status(buf['src_address'], buf['dest_address'], buf['session'], buf['message_size'], buf['num_segments'], buf['pgn'])
+                            except RuntimeError as e:
+                                self._abort_send(bufid, buf, e)
+                                break
 
                             buf['next_packet_to_send'] += 1
-                            # send end of message status
                             if (package+1) == buf['num_segments']:
-                                self.__send_tp_eom_status(buf['src_address'], buf['dest_address'], buf['session'], buf['message_size'], buf['num_segments'], buf['pgn'])
                                 buf['deadline'] = time.time() + self.Timeout.T5
                                 buf['state'] = self.SendBufferState.WAITING_EOM_ACK
                                 break
@@ -433,19 +447,23 @@ class J1939_22:
                             next_wakeup = buf['deadline']
 
                     elif buf['state'] == self.SendBufferState.WAITING_EOM_ACK:
-                        # TODO: should we inform the application about the eom ack timeout?
                         del self._snd_buffer[bufid]
                         self.__put_rts_cts_session(buf['session'])
+                        self._send_completed(buf, 'timeout')
 
                     elif buf['state'] == self.SendBufferState.EOM_ACK_RECEIVED:
-                        # TODO: should we inform the application about the successful transmission?
                         del self._snd_buffer[bufid]
                         self.__put_rts_cts_session(buf['session'])
+                        self._send_completed(buf, 'completed')
 
                     elif buf['state'] == self.SendBufferState.SENDING_BAM:
                         # send next broadcast message...
                         package = buf['next_packet_to_send']
-                        self.__send_tp_dt(buf['src_address'], buf['dest_address'], buf['session'], package+1, buf['data'][package])
+                        try:
+                            self.__send_tp_dt(buf['src_address'], buf['dest_address'], buf['session'], package+1, buf['segmenter'], package)
+                        except RuntimeError as e:
+                            self._abort_send(bufid, buf, e)
+                            continue
                         buf['next_packet_to_send'] += 1
 
                         if buf['next_packet_to_send'] < buf['num_segments']:
@@ -462,25 +480,35 @@ class J1939_22:
 
                     elif buf['state'] == self.SendBufferState.SENDING_EOM_STATUS:
                         # done
-                        self.__send_tp_eom_status(buf['src_address'], buf['dest_address'],
-                                                  buf['session'],
-                                                  buf['message_size'], buf['num_segments'], buf['pgn'])
+                        try:
+                            self.__send_tp_eom_status(buf['src_address'], buf['dest_address'],
+                                                      buf['session'],
+                                                      buf['message_size'], buf['num_segments'], buf['pgn'])
+                        except RuntimeError as e:
+                            self._abort_send(bufid, buf, e)
+                            continue
                         del self._snd_buffer[bufid]
                         self.__put_bam_session(buf['session'])
+                        self._send_completed(buf, 'completed')
                     elif buf['state'] == self.SendBufferState.TRANSMISSION_FINISHED:
                         del self._snd_buffer[bufid]
+                        self.__put_rts_cts_session(buf['session'])
+                        self._send_completed(buf, buf.get('result', 'completed'))
                     else:
                         logger.critical('unknown SendBufferState %d', buf['state'])
                         del self._snd_buffer[bufid]
+                        self._send_completed(buf, 'aborted')
 
         return next_wakeup
 
 
-    def _process_tp_cm(self, mid, dest_address, data, timestamp):
+    def _process_tp_cm(self, priority, src_address, dest_address, data, timestamp):
         """Processes a Transport Protocol Connection Management (TP.CM) message
 
-        :param j1939.MessageId mid:
-            A MessageId object holding the information extracted from the can_id.
+        :param int priority:
+            Priority of the message
+        :param int src_address:
+            The source address of the message
         :param int dest_address:
             The destination address of the message
         :param bytearray data:
@@ -491,10 +519,9 @@ class J1939_22:
 
         # check minimum tp-cm length
         if len(data) < 12:
-            logger.info('tp-cm with incorrect dlc received, id', mid )
+            logger.info('tp-cm with incorrect dlc received, src 0x%02X', src_address)
             return
 
-        src_address = mid.source_address
         control_byte  = data[0] & 0xF
         session_num   = (data[0] >> 4) & 0xF
         message_size  = (data[1]  & 0xFF) | ((data[2]  & 0xFF) << 8) | ((data[3] & 0xFF)  << 16)
@@ -569,7 +596,7 @@ class J1939_22:
                 return
             pgn = self._rcv_buffer[buffer_hash]['pgn']
             if (self._rcv_buffer[buffer_hash]['message_size'] == message_size) and (self._rcv_buffer[buffer_hash]['num_segments'] == segment_num):
-                self.__notify_subscribers(mid.priority, pgn, src_address, dest_address, timestamp, self._rcv_buffer[buffer_hash]['data'])
+                self.__notify_subscribers(priority, pgn, src_address, dest_address, timestamp, self._rcv_buffer[buffer_hash]['data'])
                 if dest_address != ParameterGroupNumber.Address.GLOBAL:
                     self.__send_tp_eom_ack(dest_address, src_address, session_num, message_size, segment_num, pgn)
             else:
@@ -583,7 +610,6 @@ class J1939_22:
                 self.__send_tp_abort(dest_address, src_address, session_num, self.ConnectionAbortReason.RESOURCES, pgn)
                 self.__put_rts_cts_session(session_num)
                 return
-            # TODO: should we inform the application about the successful transmission?
             self._snd_buffer[buffer_hash]['state'] = self.SendBufferState.EOM_ACK_RECEIVED
             self._snd_buffer[buffer_hash]['deadline'] = time.time() # wake up immediately
 
@@ -611,24 +637,23 @@ class J1939_22:
                 }
 
         elif control_byte == self.TpControlType.ABORT:
-            # if abort received before transmission established -> cancel transmission
+            # the receiver cancels the transmission, before or while sending the segments
             buffer_hash = self._buffer_hash(session_num, dest_address, src_address)
-            if buffer_hash in self._snd_buffer and self._snd_buffer[buffer_hash]['state'] == self.SendBufferState.WAITING_CTS:
-                # cancel transmission
-                self._snd_buffer[buffer_hash]['state'] = self.SendBufferState.TRANSMISSION_FINISHED
-                self._snd_buffer[buffer_hash]['deadline'] = time.time()
-            # TODO: any more abort responses?
+            buf = self._snd_buffer.get(buffer_hash)
+            if buf is not None and buf['state'] in (self.SendBufferState.WAITING_CTS, self.SendBufferState.SENDING_RTS_CTS, self.SendBufferState.WAITING_EOM_ACK):
+                buf['state'] = self.SendBufferState.TRANSMISSION_FINISHED
+                buf['result'] = 'aborted'
+                buf['deadline'] = time.time()
         else:
             raise RuntimeError('Received TP.CM with unknown control_byte %d', control_byte)
 
-    def _process_tp_dt(self, mid, dest_address, data, timestamp):
+    def _process_tp_dt(self, priority, src_address, dest_address, data, timestamp):
 
         # check minimum tp-dt length
         if len(data) <= 4:
-            logger.info('tp-dt with incorrect dlc received, id', mid )
+            logger.info('tp-dt with incorrect dlc received, src 0x%02X', src_address)
             return
 
-        src_address = mid.source_address
         dtfi        =  data[0] & 0xF # Data Transfer Format Indicator
         session_num = (data[0] >> 4) & 0xF
         segment_num = (data[1] & 0xFF) | ((data[2]  & 0xFF) << 8) | ((data[3] & 0xFF)  << 16)
@@ -678,9 +703,8 @@ class J1939_22:
 
         self._rcv_buffer[buffer_hash]['deadline'] = time.time() + self.Timeout.T1
 
-    def _process_multi_pg(self, mid : MessageId, dest_address, data, timestamp):
+    def _process_multi_pg(self, priority, src_address, dest_address, data, timestamp):
         # currently "SAE J1939 with no assurance data" trailer format supported only
-        src_address = mid.source_address
 
         while True:
             if len(data) <= 4:
@@ -695,7 +719,13 @@ class J1939_22:
             payload_length = (data[3] & 0xFF)
             if (tos == 2) and (trailer_format == 0):
                 # SAE J1939 with no assurance data
-                self.__notify_subscribers(mid.priority, cpgn, src_address, dest_address, timestamp, data[4:(4+payload_length)].copy())
+                if cpgn == ParameterGroupNumber.PGN.REQUEST:
+                    # requests are sent as C-PGs, the CAs answer them
+                    for ca in self._cas:
+                        if ca.message_acceptable(dest_address):
+                            ca._process_request(src_address, dest_address, data[4:(4+payload_length)], timestamp)
+                else:
+                    self.__notify_subscribers(priority, cpgn, src_address, dest_address, timestamp, data[4:(4+payload_length)].copy())
             else:
                 # TODO
                 print('other tos/tf formats currently not supported')
@@ -749,25 +779,16 @@ class J1939_22:
         # 13 up to 64 Assurance Data of full message calculated using AD Type. Total length = Size in byte 8.
         self.__send_message(mid.can_id, True, data, fd_format=True)
 
-    def __send_tp_dt(self, src_address, dest_address, session_num, segment_num, data, Dtfi=0):
+    def __send_tp_dt(self, src_address, dest_address, session_num, segment_num, segmenter, package, Dtfi=0):
         pgn = ParameterGroupNumber(0, (ParameterGroupNumber.PGN.FD_TP_DT>>8) & 0xFF, dest_address)
         mid = MessageId(priority=7, parameter_group_number=pgn.value, source_address=src_address)
 
-        data.insert(0, (Dtfi & 0xF) | ((session_num & 0xF) << 4))
-        data.insert(1,  segment_num & 0xFF)
-        data.insert(2, (segment_num >> 8) & 0xFF)
-        data.insert(3, (segment_num >> 16) & 0xFF)
-
-        next_valid_fd_length = 0
-        if len(data)>=(self.DataLength.TP+4):
-            data = data[:(self.DataLength.TP+4)]
-        else:
-            # padding
-            next_valid_fd_length = self._LUT_FD_DLC[len(data)]
-            if next_valid_fd_length < 0: next_valid_fd_length = 0
-
-            while len(data)<next_valid_fd_length:
-                data.append(255)
+        data = segmenter.packet(package)
+        frame = segmenter.frame
+        frame[0] = (Dtfi & 0xF) | ((session_num & 0xF) << 4)
+        frame[1] = segment_num & 0xFF
+        frame[2] = (segment_num >> 8) & 0xFF
+        frame[3] = (segment_num >> 16) & 0xFF
 
         self.__send_message(mid.can_id, True, data, fd_format=True)
 
@@ -788,14 +809,14 @@ class J1939_22:
             seconds.
             Where possible this will be timestamped in hardware.
         """
-        mid = MessageId(can_id=can_id)
-        pgn = ParameterGroupNumber()
-        pgn.from_message_id(mid)
+        # decode the 29-bit id with plain integer ops (hot path, no MessageId/PGN objects)
+        priority = (can_id >> 26) & 0x7
+        src_address = can_id & 0xFF
 
         # peer to peer
         # pdu_specific is destination Address
-        pgn_value = pgn.value & 0x1FF00
-        dest_address = pgn.pdu_specific # may be Address.GLOBAL
+        pgn_value = (can_id >> 8) & 0x1FF00
+        dest_address = (can_id >> 8) & 0xFF # may be Address.GLOBAL
 
         # iterate all CAs to check if we have to handle this destination address
         if dest_address != ParameterGroupNumber.Address.GLOBAL:
@@ -809,25 +830,27 @@ class J1939_22:
                     return
 
         if pgn_value == ParameterGroupNumber.PGN.FEFF_MULTI_PG:
-            self._process_multi_pg(mid, dest_address, data, timestamp)
+            self._process_multi_pg(priority, src_address, dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.ADDRESSCLAIM:
+            if self.__address_claimed is not None:
+                self.__address_claimed(src_address, data, timestamp)
             for ca in self._cas:
-                ca._process_addressclaim(mid, data, timestamp)
+                ca._process_addressclaim(src_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.REQUEST:
             for ca in self._cas:
                 if ca.message_acceptable(dest_address):
-                    ca._process_request(mid, dest_address, data, timestamp)
+                    ca._process_request(src_address, dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.FD_TP_CM:
-            self._process_tp_cm(mid, dest_address, data, timestamp)
+            self._process_tp_cm(priority, src_address, dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.FD_TP_DT:
-            self._process_tp_dt(mid, dest_address, data, timestamp)
+            self._process_tp_dt(priority, src_address, dest_address, data, timestamp)
         elif pgn_value == ParameterGroupNumber.PGN.TP_CM:
             logger.info('j1939-21 transport protocol cm not allowed in j1939-22 network')
         elif pgn_value == ParameterGroupNumber.PGN.DATATRANSFER:
             logger.info('j1939-21 transport protocol dt not allowed in j1939-22 network')
-        elif pgn.is_pdu2_format:
-            # direct broadcast
-            self.__notify_subscribers(mid.priority, pgn.value, mid.source_address, ParameterGroupNumber.Address.GLOBAL, timestamp, data)
+        elif ((can_id >> 16) & 0xFF) >= 240:
+            # PDU2 format: direct broadcast
+            self.__notify_subscribers(priority, (can_id >> 8) & 0x1FFFF, src_address, ParameterGroupNumber.Address.GLOBAL, timestamp, data)
         else:
-            self.__notify_subscribers(mid.priority, pgn_value, mid.source_address, dest_address, timestamp, data)
+            self.__notify_subscribers(priority, pgn_value, src_address, dest_address, timestamp, data)
 
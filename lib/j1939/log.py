@@ -0,0 +1,106 @@
+import adafruit_logging as logging
+
+# Level gated logging of the hot paths (CAN bus, ECU).
+#
+# The level of a module is read once, when the module's ECU or CAN bus is
+# created (or by set_level / refresh), and kept in plain attributes. Guard
+# the log calls of hot paths with them, so nothing is formatted while the
+# level is off:
+#
+#     if _log.debug_enabled:
+#         _log.debug("send_message | can_id {0}", can_id)
+#
+# Independent of the level, each module has a frame trace switch, printing
+# one line per frame when on and costing one attribute check when off:
+#
+#     if _log.trace:
+#         _log.frame("TX", can_id, data)
+
+_logs = {}
+
+
+class Log:
+    """Level gated front of an adafruit_logging logger
+
+    The messages are ``str.format`` templates, formatted only when the
+    level is enabled.
+
+    :param str name: name of the logger
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.logger = logging.getLogger(name)
+        # frame trace switch
+        self.trace = False
+        self.trace_output = print
+        self.debug_enabled = False
+        self.info_enabled = False
+        self.refresh()
+
+    def refresh(self):
+        """Reads the level of the logger again, after it was set on the logger itself"""
+        level = self.logger.getEffectiveLevel()
+        self.debug_enabled = level <= logging.DEBUG
+        self.info_enabled = level <= logging.INFO
+
+    def set_level(self, level):
+        """Sets the level of the logger, e.g. ``logging.DEBUG``"""
+        self.logger.setLevel(level)
+        self.refresh()
+
+    def debug(self, template, *args):
+        if self.debug_enabled:
+            self.logger.debug(template.format(*args))
+
+    def info(self, template, *args):
+        if self.info_enabled:
+            self.logger.info(template.format(*args))
+
+    def warning(self, template, *args):
+        self.logger.warning(template.format(*args))
+
+    def error(self, template, *args):
+        self.logger.error(template.format(*args))
+
+    def frame(self, direction, can_id, data):
+        """Traces a CAN frame, e.g. ``TX 0CF00400 [8] F07D7D001AFFFF7D``"""
+        self.trace_output("{} {} {:08X} [{}] {}".format(self.name, direction, can_id, len(data),
+                                                         "".join("{:02X}".format(b) for b in data)))
+
+    def message(self, direction, priority, pgn, sa, dest, data):
+        """Traces a J1939 message (after the transport protocols)"""
+        self.trace_output("{} {} pgn {} prio {} {:02X} -> {:02X} [{}] {}".format(
+            self.name, direction, pgn, priority, sa, dest, len(data),
+            "".join("{:02X}".format(b) for b in data)))
+
+
+def get(name):
+    """Returns the :class:`Log` of the logger name, one per name"""
+    log = _logs.get(name)
+    if log is None:
+        log = _logs[name] = Log(name)
+    return log
+
+
+def set_level(level, name=None):
+    """Sets the level of one logger (by name) or of all loggers of the stack imported so far"""
+    for log in _select(name):
+        log.set_level(level)
+
+
+def set_trace(enabled, name=None, output=None):
+    """Switches the frame trace of one logger (by name) or of all loggers of the stack imported so far
+
+    :param bool enabled: trace on or off
+    :param output: callable taking the trace line, ``print`` by default
+    """
+    for log in _select(name):
+        log.trace = enabled
+        log.trace_output = output or print
+
+
+def _select(name):
+    if name is None:
+        return list(_logs.values())
+    return [get(name)]
@@ -1,19 +1,18 @@
-from enum import Enum
-import queue
-import sys
-import time
+import adafruit_logging as logging
 
 import j1939
 
+logger = logging.getLogger(__name__)
 
-class QueryState(Enum):
+
+class QueryState:
     IDLE = 1
     WAIT_FOR_SEED = 2
     WAIT_FOR_DM16 = 3
     WAIT_FOR_OPER_COMPLETE = 4
 
 
-class Command(Enum):
+class Command:
     ERASE = 0
     READ = 1
     WRITE = 2
@@ -24,182 +23,502 @@ class Command(Enum):
     EDCP_GENERATION = 7
 
 
-class ReceiveState(Enum):
+class ReceiveState:
     IDLE = 1
     WAIT_FOR_KEY = 2
-    WAIT_FOR_CONFIRMATION = 3
+    WAIT_FOR_DM16 = 3
+    WAIT_FOR_CONFIRMATION = 4
 
 
-class Dm15Status(Enum):
+class Dm15Status:
     PROCEED = 0
     BUSY = 1
     OPERATION_COMPLETE = 4
     OPERATION_FAILED = 5
 
 
+class Dm15Error:
+    """Error indicators of the DM15, the ones used here"""
+    NONE = 0xFFFFFF
+    NO_ERROR = 0x000000
+    ADDRESS_OUT_OF_RANGE = 0x000100
+    KEY_INVALID = 0x001000
+    NOT_SUPPORTED = 0x000002
+
+
+# number of objects of a DM14/DM15, 11 bits
+MAX_OBJECT_COUNT = 0x7FF
+NO_SEED = 0xFFFF
+
+
+def _pack_dm14(command, direct, address, object_count, key_or_user_level):
+    return bytes((
+        object_count & 0xFF,
+        ((object_count >> 3) & 0xE0) | ((direct & 1) << 4) | ((command & 7) << 1) | 1,  # (SAE reserved = 1)
+        address & 0xFF, (address >> 8) & 0xFF, (address >> 16) & 0xFF, (address >> 24) & 0xFF,
+        key_or_user_level & 0xFF, (key_or_user_level >> 8) & 0xFF,
+    ))
+
+
+def _pack_dm15(status, object_count, error=Dm15Error.NONE, seed=NO_SEED):
+    return bytes((
+        object_count & 0xFF,
+        ((object_count >> 3) & 0xE0) | ((status & 7) << 1) | 1,
+        error & 0xFF, (error >> 8) & 0xFF, (error >> 16) & 0xFF,
+        0xFF,  # EDCP extension not used
+        seed & 0xFF, (seed >> 8) & 0xFF,
+    ))
+
+
+def _pack_dm16(raw_bytes):
+    data = bytearray(len(raw_bytes) + 1)
+    data[0] = 0xFF if len(raw_bytes) > 7 else len(raw_bytes)
+    data[1:] = raw_bytes
+    return data
+
+
+def _object_count(data):
+    return data[0] | ((data[1] & 0xE0) << 3)
+
+
+def _dm16_payload(data):
+    # 0xFF: the length is given by the transport protocol
+    if data[0] == 0xFF:
+        return data[1:]
+    return data[1:1 + min(data[0], len(data) - 1)]
+
+
+class Dm14Future:
+    """Result of a memory access query
+
+    Completed from :meth:`j1939.ElectronicControlUnit.loop`, either with
+    :attr:`result` or with :attr:`error` (a RuntimeError).
+    """
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+        self.error = None
+        self._callbacks = []
+
+    def add_done_callback(self, callback):
+        """Calls ``callback(future)`` when the query is done, right away if it already is."""
+        if self.done:
+            callback(self)
+        else:
+            self._callbacks.append(callback)
+
+    def _complete(self, result, error):
+        self.done = True
+        self.result = result
+        self.error = error
+        callbacks = self._callbacks
+        self._callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+
+class _Transfer:
+    # state of the query to one destination
+
+    def __init__(self, dest_address, command, direct, address, object_count, object_byte_size):
+        self.dest_address = dest_address
+        self.command = command
+        self.direct = direct
+        self.address = address
+        self.object_count = object_count
+        self.object_byte_size = object_byte_size
+        self.state = QueryState.IDLE
+        # objects done and objects of the current chunk
+        self.offset = 0
+        self.chunk = 0
+        # DM16 of the current chunk received, DM15 operation complete received before it
+        self.received = False
+        self.complete_pending = False
+        self.data = None
+        self.signed = False
+        self.return_raw_bytes = False
+        self.on_chunk = None
+        self.timer = None
+        self.future = Dm14Future()
+
+
 class Dm14Query:
-    def __init__(self, ca: j1939.ControllerApplication):
-        """
-        performs memory access queries using DM14-DM18 messaging.  Presently only read queries are supported
+    """Memory access queries (DM14 request, DM15 response, DM16 binary data transfer)
 
-        :param obj ca: j1939 controller application
-        """
+    The queries do not block, they are driven by the messages received and
+    the timers of the ECU, i.e. by :meth:`j1939.ElectronicControlUnit.loop`.
+    :meth:`read` and :meth:`write` return a :class:`Dm14Future`, optionally a
+    callback is called with it when the query is done. One query per
+    destination address can be outstanding, queries to different ECUs run
+    in parallel.
 
+    Queries larger than ``chunk_size`` bytes are split into several DM14
+    requests for consecutive addresses, the data of a read can be streamed
+    chunk by chunk with ``on_chunk``.
+
+    :param obj ca: j1939 controller application
+    :param float timeout:
+        Seconds to wait for each response of the destination.
+    :param int chunk_size:
+        Maximum number of bytes per DM14 request, each transferred with one DM16.
+    :param int user_level:
+        Sent in the key field of the DM14 as long as no key is requested.
+    """
+
+    def __init__(self, ca: j1939.ControllerApplication, timeout=1.0, chunk_size=255, user_level=7):
         self._ca = ca
-        self.state = QueryState.IDLE
+        self._timeout = timeout
+        self._chunk_size = chunk_size
+        self._user_level = user_level
         self._seed_from_key = None
-        self.data_queue = queue.Queue()
-        self.mem_data = None
-
-    def _wait_for_data(self):
-        assert self.state is QueryState.WAIT_FOR_SEED
-        if self.command is Command.WRITE:
-            self._send_dm16()
-            self.state = QueryState.WAIT_FOR_OPER_COMPLETE
-        else:
-            self.state = QueryState.WAIT_FOR_DM16
-            self._ca.unsubscribe(self._parse_dm15)
-            self._ca.subscribe(self._parse_dm16)
-
-    def _send_operation_complete(self):
-        self.object_count = 1
-        self.command = Command.OPERATION_COMPLETED
-        self._send_dm14(0xFFFF)
-
-    def _send_dm14(self, key_or_user_level):
-        self._pgn = j1939.ParameterGroupNumber.PGN.DM14
-        pointer = self.address.to_bytes(length=4, byteorder="little")
-        data = []
-        data.append(self.object_count)
-        data.append(
-            (self.direct << 4) + (self.command.value << 1) + 1
-        )  # (SAE reserved = 1)
-        for octet in pointer:
-            data.append(octet)
-        data.append(key_or_user_level & 0xFF)
-        data.append(key_or_user_level >> 8)
-        self._ca.send_pgn(
-            0, (self._pgn >> 8) & 0xFF, self._dest_address & 0xFF, 6, data
-        )
-
-    def _send_dm16(self):
-        self._pgn = j1939.ParameterGroupNumber.PGN.DM16
-        data = []
-        byte_count = len(self.bytes)
-        data.append(0xFF if byte_count > 7 else byte_count)
-        for i in range(byte_count):
-            data.append(self.bytes[i])
-        self._ca.send_pgn(
-            0, (self._pgn >> 8) & 0xFF, self._dest_address & 0xFF, 6, data
-        )
-
-    def _parse_dm15(self, priority, pgn, sa, timestamp, data):
-        if pgn != j1939.ParameterGroupNumber.PGN.DM15 or sa != self._dest_address:
+        self._transfers = {}
+        self._subscribed = False
+
+    def set_seed_key_algorithm(self, algorithm):
+        """Sets the callable calculating the key from the seed sent by the destination"""
+        self._seed_from_key = algorithm
+
+    def busy(self, dest_address):
+        """True if a query to the destination is outstanding"""
+        return dest_address in self._transfers
+
+    def read(self, dest_address, direct, address, object_count, object_byte_size=1,
+             signed=False, return_raw_bytes=False, callback=None, on_chunk=None):
+        """Reads memory of another ECU
+
+        :param int dest_address: address of the ECU
+        :param int direct: 1 for direct addressing, 0 for spatial
+        :param int address: pointer to the first object
+        :param int object_count: number of objects to read
+        :param int object_byte_size: bytes per object
+        :param bool signed: the objects are signed integers
+        :param bool return_raw_bytes: the result are the bytes read, not the values
+        :param callback: called with the :class:`Dm14Future` when the query is done
+        :param on_chunk: called as ``on_chunk(offset, data)`` with the bytes of each chunk
+            received, ``offset`` in bytes from the start of the query
+        :return: :class:`Dm14Future`, the result is the list of values or the bytes read
+        """
+        if object_count <= 0:
+            raise ValueError("object_count must be positive")
+        transfer = _Transfer(dest_address, Command.READ, direct, address, object_count, object_byte_size)
+        transfer.data = bytearray()
+        transfer.signed = signed
+        transfer.return_raw_bytes = return_raw_bytes
+        transfer.on_chunk = on_chunk
+        return self._start(transfer, callback)
+
+    def write(self, dest_address, direct, address, values, object_byte_size=1, callback=None):
+        """Writes memory of another ECU
+
+        :param int dest_address: address of the ECU
+        :param int direct: 1 for direct addressing, 0 for spatial
+        :param int address: pointer to the first object
+        :param list values: integer values of the objects
+        :param int object_byte_size: bytes per object
+        :param callback: called with the :class:`Dm14Future` when the query is done
+        :return: :class:`Dm14Future`, the result is the number of objects written
+        """
+        if not values:
+            raise ValueError("nothing to write")
+        transfer = _Transfer(dest_address, Command.WRITE, direct, address, len(values), object_byte_size)
+        transfer.data = self._values_to_bytes(values, object_byte_size)
+        return self._start(transfer, callback)
+
+    def cancel(self, dest_address):
+        """Aborts the query to the destination, its future fails"""
+        transfer = self._transfers.get(dest_address)
+        if transfer is not None:
+            self._finish(transfer, None, RuntimeError("Query to {} cancelled".format(dest_address)))
+
+    def _start(self, transfer, callback):
+        if transfer.dest_address in self._transfers:
+            raise RuntimeError("Query to {} already in progress".format(transfer.dest_address))
+        if not self._subscribed:
+            self._ca.subscribe(self._on_dm15, j1939.ParameterGroupNumber.PGN.DM15)
+            self._ca.subscribe(self._on_dm16, j1939.ParameterGroupNumber.PGN.DM16)
+            self._subscribed = True
+        if callback is not None:
+            transfer.future.add_done_callback(callback)
+        self._transfers[transfer.dest_address] = transfer
+        try:
+            self._start_chunk(transfer)
+        except RuntimeError:
+            del self._transfers[transfer.dest_address]
+            raise
+        return transfer.future
+
+    def _start_chunk(self, transfer):
+        objects = max(1, self._chunk_size // transfer.object_byte_size)
+        if objects > MAX_OBJECT_COUNT:
+            objects = MAX_OBJECT_COUNT
+        transfer.chunk = min(objects, transfer.object_count - transfer.offset)
+        transfer.received = False
+        transfer.state = QueryState.WAIT_FOR_SEED
+        self._send_dm14(transfer, transfer.command, transfer.chunk, self._user_level)
+
+    def _chunk_address(self, transfer):
+        return transfer.address + transfer.offset * transfer.object_byte_size
+
+    def _send_dm14(self, transfer, command, object_count, key_or_user_level):
+        data = _pack_dm14(command, transfer.direct, self._chunk_address(transfer), object_count, key_or_user_level)
+        self._send(transfer, j1939.ParameterGroupNumber.PGN.DM14, data)
+
+    def _send(self, transfer, pgn, data):
+        self._ca.send_pgn(0, (pgn >> 8) & 0xFF, transfer.dest_address & 0xFF, 6, data)
+        self._arm_timer(transfer)
+
+    def _arm_timer(self, transfer):
+        if transfer.timer is not None:
+            self._ca.remove_timer(transfer.timer)
+        transfer.timer = self._ca.add_timer(self._timeout, self._on_timeout, transfer)
+
+    def _on_timeout(self, transfer):
+        transfer.timer = None
+        if self._transfers.get(transfer.dest_address) is transfer:
+            self._finish(transfer, None, RuntimeError("Device {} did not respond".format(transfer.dest_address)))
+
+    def _finish(self, transfer, result, error):
+        if transfer.timer is not None:
+            self._ca.remove_timer(transfer.timer)
+            transfer.timer = None
+        transfer.state = QueryState.IDLE
+        del self._transfers[transfer.dest_address]
+        transfer.future._complete(result, error)
+
+    def _on_dm15(self, priority, pgn, sa, timestamp, data):
+        transfer = self._transfers.get(sa)
+        if transfer is None or len(data) < 8:
             return
-        seed = (data[7] << 8) + data[6]
         status = (data[1] >> 1) & 7
-        if status is Dm15Status.BUSY.value or status is Dm15Status.OPERATION_FAILED:
-            error = int.from_bytes(data[2:4], byteorder="little", signed=False)
-            self.data_queue.put(None)
-            if error == 0x1000:
-                raise RuntimeError("Key authentication error")
-            else:  # TODO parse error codes more granularly
-                raise RuntimeError(f"Device {sa} busy")
-        length = data[0]
-        if seed == 0xFFFF and length == self.object_count:
-            self._wait_for_data()
-        else:
-            if self.state is QueryState.WAIT_FOR_OPER_COMPLETE:
-                assert status is Command.OPERATION_COMPLETED.value
-                self._send_operation_complete()
-                self.state = QueryState.IDLE
-                self.data_queue.put(self.mem_data)
+        if status == Dm15Status.BUSY or status == Dm15Status.OPERATION_FAILED:
+            error = data[2] | (data[3] << 8) | (data[4] << 16)
+            if error == Dm15Error.KEY_INVALID:
+                message = "Key authentication error"
+            elif status == Dm15Status.BUSY:
+                message = "Device {} busy".format(sa)
             else:
-                assert self.state is QueryState.WAIT_FOR_SEED
-                if self._seed_from_key is not None:
-                    self._send_dm14(self._seed_from_key(seed))
+                message = "Operation failed on device {} (error 0x{:06X})".format(sa, error)
+            self._finish(transfer, None, RuntimeError(message))
+            return
+        try:
+            if transfer.state == QueryState.WAIT_FOR_SEED and status == Dm15Status.PROCEED:
+                seed = data[6] | (data[7] << 8)
+                if seed != NO_SEED:
+                    if self._seed_from_key is None:
+                        self._finish(transfer, None, RuntimeError(
+                            "Key requested from host but no seed-key algorithm has been provided"))
+                        return
+                    self._send_dm14(transfer, transfer.command, transfer.chunk, self._seed_from_key(seed))
+                elif transfer.command == Command.WRITE:
+                    start = transfer.offset * transfer.object_byte_size
+                    chunk = transfer.data[start:start + transfer.chunk * transfer.object_byte_size]
+                    transfer.state = QueryState.WAIT_FOR_OPER_COMPLETE
+                    self._send(transfer, j1939.ParameterGroupNumber.PGN.DM16, _pack_dm16(chunk))
                 else:
-                    self.data_queue.put(None)
-                    raise RuntimeError(
-                        "Key requested from host but no seed-key algorithm has been provided"
-                    )
+                    # the DM16 may have won the arbitration against the DM15
+                    transfer.state = QueryState.WAIT_FOR_OPER_COMPLETE if transfer.received else QueryState.WAIT_FOR_DM16
+                    self._arm_timer(transfer)
+            elif transfer.state == QueryState.WAIT_FOR_OPER_COMPLETE and status == Dm15Status.OPERATION_COMPLETE:
+                self._chunk_done(transfer)
+            elif transfer.state == QueryState.WAIT_FOR_DM16 and status == Dm15Status.OPERATION_COMPLETE:
+                # a single frame overtakes the DM16 still in the transport protocol
+                transfer.complete_pending = True
+        except RuntimeError as e:
+            # sending failed, e.g. the CA lost its address
+            self._finish(transfer, None, e)
+
+    def _chunk_done(self, transfer):
+        transfer.complete_pending = False
+        self._send_dm14(transfer, Command.OPERATION_COMPLETED, 1, NO_SEED)
+        transfer.offset += transfer.chunk
+        if transfer.offset < transfer.object_count:
+            self._start_chunk(transfer)
+        else:
+            self._finish(transfer, self._result(transfer), None)
 
-    def _parse_dm16(self, priority, pgn, sa, timestamp, data):
-        if pgn != j1939.ParameterGroupNumber.PGN.DM16 or sa != self._dest_address:
+    def _on_dm16(self, priority, pgn, sa, timestamp, data):
+        transfer = self._transfers.get(sa)
+        if (transfer is None or transfer.command != Command.READ or transfer.received or not data
+                or transfer.state not in (QueryState.WAIT_FOR_SEED, QueryState.WAIT_FOR_DM16)):
             return
-        length = min(data[0], len(data) - 1)
-        # assert object_count == self.object_count
-        self.mem_data = data[1 : length + 1]
-        self._ca.unsubscribe(self._parse_dm16)
-        self._ca.subscribe(self._parse_dm15)
-        self.state = QueryState.WAIT_FOR_OPER_COMPLETE
-
-    def _values_to_bytes(self, values):
-        bytes = []
-        for val in values:
-            bytes.extend(val.to_bytes(self.object_byte_size, byteorder="little"))
-        return bytes
-
-    def _bytes_to_values(self, raw_bytes):
+        payload = _dm16_payload(data)
+        offset = len(transfer.data)
+        transfer.data.extend(payload)
+        transfer.received = True
+        if transfer.state == QueryState.WAIT_FOR_DM16:
+            transfer.state = QueryState.WAIT_FOR_OPER_COMPLETE
+            self._arm_timer(transfer)
+        if transfer.on_chunk is not None:
+            transfer.on_chunk(offset, bytes(payload))
+        if transfer.complete_pending:
+            try:
+                self._chunk_done(transfer)
+            except RuntimeError as e:
+                self._finish(transfer, None, e)
+
+    def _result(self, transfer):
+        if transfer.command == Command.WRITE:
+            return transfer.object_count
+        if transfer.return_raw_bytes:
+            return bytes(transfer.data)
+        return self._bytes_to_values(transfer.data, transfer.object_byte_size, transfer.signed)
+
+    @staticmethod
+    def _values_to_bytes(values, object_byte_size):
+        raw_bytes = bytearray()
+        mask = (1 << (8 * object_byte_size)) - 1
+        for value in values:
+            value &= mask
+            for _ in range(object_byte_size):
+                raw_bytes.append(value & 0xFF)
+                value >>= 8
+        return raw_bytes
+
+    @staticmethod
+    def _bytes_to_values(raw_bytes, object_byte_size, signed=False):
         values = []
-        for i in range(len(raw_bytes) // self.object_byte_size):
-            values.append(
-                int.from_bytes(
-                    raw_bytes[i : self.object_byte_size],
-                    byteorder="little",
-                    signed=self.signed,
-                )
-            )
+        sign = 1 << (8 * object_byte_size - 1)
+        for i in range(len(raw_bytes) // object_byte_size):
+            value = int.from_bytes(raw_bytes[i * object_byte_size:(i + 1) * object_byte_size], "little")
+            if signed and value & sign:
+                value -= sign << 1
+            values.append(value)
         return values
 
-    def read(
-        self,
-        dest_address,
-        direct,
-        address,
-        object_count,
-        object_byte_size=1,
-        signed=False,
-        return_raw_bytes=False,
-    ):
-        assert object_count > 0
-        self._dest_address = dest_address
+
+class _Session:
+    # state of the requests of one requester
+
+    def __init__(self, command, direct, address, object_count):
+        self.command = command
         self.direct = direct
         self.address = address
         self.object_count = object_count
-        self.object_byte_size = object_byte_size
-        self.signed = signed
-        self.return_raw_bytes = return_raw_bytes
-        self.command = Command.READ
-        self._ca.subscribe(self._parse_dm15)
-        self._send_dm14(7)
-        self.state = QueryState.WAIT_FOR_SEED
-        # wait for operation completed DM15 message
-        raw_bytes = self.data_queue.get(block=True, timeout=1)
-        if self.return_raw_bytes:
-            return raw_bytes
-        else:
-            return self._bytes_to_values(raw_bytes)
+        self.state = ReceiveState.IDLE
+        self.timer = None
 
-    def write(self, dest_address, direct, address, values, object_byte_size=1):
-        self._dest_address = dest_address
-        self.direct = direct
-        self.address = address
-        self.object_byte_size = object_byte_size
-        self.command = Command.WRITE
-        self.bytes = self._values_to_bytes(values)
-        self.object_count = len(values)
-        self._ca.subscribe(self._parse_dm15)
-        self._send_dm14(7)
-        self.state = QueryState.WAIT_FOR_SEED
-        # wait for operation completed DM15 message
-        try:
-            self.data_queue.get(block=True, timeout=1)
-        except queue.Empty:
-            pass  # expect empty queue for write
 
-    def set_seed_key_algorithm(self, algorithm):
-        self._seed_from_key = algorithm
+class Dm14Responder:
+    """Answers memory access queries (DM14) with the content of a bytearray
 
-    def set_seed_key_algorithm(self, algorithm):
-        self._seed_from_key = algorithm
+    A simple server for tests and simulations, e.g. on a
+    :class:`j1939.virtual_bus.VirtualBus`. The pointer of the DM14 is the
+    byte offset into the memory. Reads answer
+    DM15 proceed, the DM16 with the data and DM15 operation complete,
+    writes wait for the DM16 between the two DM15. With a seed the
+    requester has to send the key calculated by ``key_from_seed`` first.
+
+    :param obj ca: j1939 controller application
+    :param bytearray memory: the memory read and written
+    :param int object_byte_size: bytes per object
+    :param int seed: seed sent to the requester, None if no key is needed
+    :param key_from_seed: callable returning the key expected for the seed
+    :param bool writable: False answers writes with operation failed
+    :param float timeout: seconds to wait for the next message of the requester
+    """
+
+    def __init__(self, ca: j1939.ControllerApplication, memory, object_byte_size=1, seed=None,
+                 key_from_seed=None, writable=True, timeout=1.0):
+        self._ca = ca
+        self.memory = memory
+        self._object_byte_size = object_byte_size
+        self._seed = seed
+        self._key_from_seed = key_from_seed
+        self._writable = writable
+        self._timeout = timeout
+        self._sessions = {}
+        ca.subscribe(self._on_dm14, j1939.ParameterGroupNumber.PGN.DM14)
+        ca.subscribe(self._on_dm16, j1939.ParameterGroupNumber.PGN.DM16)
+
+    def _send(self, dest_address, pgn, data):
+        self._ca.send_pgn(0, (pgn >> 8) & 0xFF, dest_address & 0xFF, 6, data)
+
+    def _send_dm15(self, dest_address, status, object_count, error=Dm15Error.NONE, seed=NO_SEED):
+        self._send(dest_address, j1939.ParameterGroupNumber.PGN.DM15,
+                   _pack_dm15(status, object_count, error, seed))
+
+    def _arm_timer(self, sa, session):
+        self._cancel_timer(session)
+        session.timer = self._ca.add_timer(self._timeout, self._on_timeout, sa)
+
+    def _cancel_timer(self, session):
+        if session.timer is not None:
+            self._ca.remove_timer(session.timer)
+            session.timer = None
+
+    def _on_timeout(self, sa):
+        session = self._sessions.pop(sa, None)
+        if session is not None:
+            session.timer = None
+            logger.info("DM14 session of {} timed out".format(sa))
+
+    def _close(self, sa):
+        session = self._sessions.pop(sa, None)
+        if session is not None:
+            self._cancel_timer(session)
+
+    def _on_dm14(self, priority, pgn, sa, timestamp, data):
+        if len(data) < 8:
+            return
+        command = (data[1] >> 1) & 7
+        object_count = _object_count(data)
+        direct = (data[1] >> 4) & 1
+        address = data[2] | (data[3] << 8) | (data[4] << 16) | (data[5] << 24)
+        key = data[6] | (data[7] << 8)
+        session = self._sessions.get(sa)
+
+        if command == Command.OPERATION_COMPLETED:
+            if session is not None and session.state == ReceiveState.WAIT_FOR_CONFIRMATION:
+                self._close(sa)
+            return
+
+        if session is not None and session.state == ReceiveState.WAIT_FOR_KEY:
+            if self._key_from_seed is None or key != self._key_from_seed(self._seed):
+                self._close(sa)
+                self._send_dm15(sa, Dm15Status.OPERATION_FAILED, object_count, Dm15Error.KEY_INVALID)
+                return
+            self._proceed(sa, session)
+            return
+
+        if command not in (Command.READ, Command.WRITE):
+            self._send_dm15(sa, Dm15Status.OPERATION_FAILED, object_count, Dm15Error.NOT_SUPPORTED)
+            return
+        if command == Command.WRITE and not self._writable:
+            self._send_dm15(sa, Dm15Status.OPERATION_FAILED, object_count, Dm15Error.NOT_SUPPORTED)
+            return
+        if address + object_count * self._object_byte_size > len(self.memory):
+            self._send_dm15(sa, Dm15Status.OPERATION_FAILED, object_count, Dm15Error.ADDRESS_OUT_OF_RANGE)
+            return
+
+        self._close(sa)
+        session = _Session(command, direct, address, object_count)
+        self._sessions[sa] = session
+        if self._seed is not None:
+            session.state = ReceiveState.WAIT_FOR_KEY
+            self._arm_timer(sa, session)
+            self._send_dm15(sa, Dm15Status.PROCEED, object_count, Dm15Error.NONE, self._seed)
+        else:
+            self._proceed(sa, session)
+
+    def _proceed(self, sa, session):
+        self._arm_timer(sa, session)
+        self._send_dm15(sa, Dm15Status.PROCEED, session.object_count)
+        if session.command == Command.READ:
+            data = self.memory[session.address:session.address + session.object_count * self._object_byte_size]
+            self._send(sa, j1939.ParameterGroupNumber.PGN.DM16, _pack_dm16(data))
+            session.state = ReceiveState.WAIT_FOR_CONFIRMATION
+            self._send_dm15(sa, Dm15Status.OPERATION_COMPLETE, session.object_count, Dm15Error.NO_ERROR)
+        else:
+            session.state = ReceiveState.WAIT_FOR_DM16
+
+    def _on_dm16(self, priority, pgn, sa, timestamp, data):
+        session = self._sessions.get(sa)
+        if session is None or session.state != ReceiveState.WAIT_FOR_DM16 or not data:
+            return
+        payload = _dm16_payload(data)
+        count = min(len(payload), session.object_count * self._object_byte_size)
+        self.memory[session.address:session.address + count] = payload[:count]
+        session.state = ReceiveState.WAIT_FOR_CONFIRMATION
+        self._arm_timer(sa, session)
+        self._send_dm15(sa, Dm15Status.OPERATION_COMPLETE, session.object_count, Dm15Error.NO_ERROR)
@@ -0,0 +1,199 @@
+import adafruit_logging as logging
+
+logger = logging.getLogger(__name__)
+
+class MultiPgPacker:
+    """Packs the C-PGs (contained parameter groups) waiting to be sent in a
+    j1939-22 multi-PG into as few CAN FD frames as possible.
+
+    C-PGs are collected per channel (frame format, source and destination
+    address), each with the deadline given by its time limit. Nothing is
+    sent before the first deadline of a channel is reached, unless enough
+    C-PGs are waiting to fill a frame. Then:
+
+    * the C-PGs due are packed best-fit decreasing, so they need as few
+      frames as possible,
+    * the space left in these frames is filled with C-PGs not yet due,
+      largest first, earlier deadline first among the same size,
+    * the remaining C-PGs are packed the same way, frames left without
+      room for another C-PG are sent early, the others keep waiting.
+
+    Frames are handed out most urgent first, a frame gets the highest
+    priority of its C-PGs.
+
+    :param frame_length:
+        Callable returning the CAN FD length (next valid DLC) of a frame
+        with the given number of used bytes, for the padding statistics.
+    """
+
+    # bytes of a multi-PG frame and of the header of each C-PG
+    CAPACITY = 64
+    HEADER_SIZE = 4
+
+    def __init__(self, frame_length=None):
+        self._frame_length = frame_length
+        # channel -> list of C-PG dicts with 'deadline' and 'seq'
+        self._pending = {}
+        self._seq = 0
+        self._frames = 0
+        self._frames_early = 0
+        self._cpgs = 0
+        self._payload_bytes = 0
+        self._frame_bytes = 0
+
+    def __len__(self):
+        return sum(len(cpgs) for cpgs in self._pending.values())
+
+    @property
+    def stats(self):
+        """Packing statistics.
+
+        :rtype: dict: 'pending', 'frames', 'frames_early' (sent full before
+            their deadline), 'cpgs', 'payload_bytes' (C-PG data bytes),
+            'frame_bytes' (bytes on the bus incl. headers and padding),
+            'efficiency' (payload_bytes / frame_bytes)
+        """
+        return {
+            'pending': len(self),
+            'frames': self._frames,
+            'frames_early': self._frames_early,
+            'cpgs': self._cpgs,
+            'payload_bytes': self._payload_bytes,
+            'frame_bytes': self._frame_bytes,
+            'efficiency': self._payload_bytes / self._frame_bytes if self._frame_bytes else 0.0,
+        }
+
+    def add(self, channel, cpg, deadline):
+        """Adds a C-PG
+
+        :param channel:
+            Key of the frames the C-PG may be sent in, e.g. (frame_format, src_address, dst_address).
+        :param dict cpg:
+            The C-PG, with at least 'priority' and 'data_length'.
+        :param float deadline:
+            Time at which the C-PG has to be sent.
+        """
+        cpg['deadline'] = deadline
+        cpg['seq'] = self._seq
+        self._seq += 1
+        self._pending.setdefault(channel, []).append(cpg)
+
+    def next_deadline(self):
+        """Returns the earliest deadline of all waiting C-PGs, None if there are none."""
+        deadline = None
+        for cpgs in self._pending.values():
+            for cpg in cpgs:
+                if deadline is None or cpg['deadline'] < deadline:
+                    deadline = cpg['deadline']
+        return deadline
+
+    def take(self, now, channel=None):
+        """Removes the frames to be sent by now
+
+        :param float now:
+            The current time.
+        :param channel:
+            Only look at this channel, None for all.
+        :return:
+            List of ``(channel, priority, cpgs)``, most urgent first.
+        """
+        frames = []
+        channels = [channel] if channel is not None else list(self._pending)
+        for key in channels:
+            cpgs = self._pending.get(key)
+            if not cpgs:
+                continue
+            due = []
+            later = []
+            used = 0
+            for cpg in cpgs:
+                used += self._size(cpg)
+                if cpg['deadline'] <= now:
+                    due.append(cpg)
+                else:
+                    later.append(cpg)
+            if not due and used < self.CAPACITY:
+                continue
+
+            # largest first, earlier deadline first among the same size
+            later.sort(key=self._order)
+            bins = self._pack(sorted(due, key=self._order), [])
+            self._fill(bins, later)
+            for fill, cpgs_bin in bins:
+                frames.append(self._frame(key, cpgs_bin, fill, False))
+
+            # frames which cannot take another C-PG need not wait
+            waiting = []
+            for fill, cpgs_bin in self._pack(later, []):
+                if self.CAPACITY - fill <= self.HEADER_SIZE:
+                    frames.append(self._frame(key, cpgs_bin, fill, True))
+                else:
+                    waiting.extend(cpgs_bin)
+            if waiting:
+                waiting.sort(key=self._seq_of)
+                self._pending[key] = waiting
+            else:
+                del self._pending[key]
+
+        frames.sort(key=self._urgency)
+        return [(key, priority, cpgs_bin) for key, priority, cpgs_bin, _deadline in frames]
+
+    def _size(self, cpg):
+        return self.HEADER_SIZE + cpg['data_length']
+
+    def _order(self, cpg):
+        return (-cpg['data_length'], cpg['deadline'], cpg['seq'])
+
+    @staticmethod
+    def _seq_of(cpg):
+        return cpg['seq']
+
+    @staticmethod
+    def _urgency(frame):
+        return (frame[1], frame[3])
+
+    def _pack(self, cpgs, bins):
+        # best fit: each C-PG goes to the frame it leaves the least room in
+        for cpg in cpgs:
+            size = self._size(cpg)
+            best = None
+            for index, (fill, _cpgs) in enumerate(bins):
+                room = self.CAPACITY - fill - size
+                if room >= 0 and (best is None or room < best[0]):
+                    best = (room, index)
+            if best is None:
+                bins.append([size, [cpg]])
+            else:
+                entry = bins[best[1]]
+                entry[0] += size
+                entry[1].append(cpg)
+        return bins
+
+    def _fill(self, bins, candidates):
+        # fills the gaps of the frames with C-PGs of the candidates (sorted
+        # largest first), the C-PGs taken are removed from the candidates
+        for entry in bins:
+            index = 0
+            while index < len(candidates) and self.CAPACITY - entry[0] > self.HEADER_SIZE:
+                size = self._size(candidates[index])
+                if size <= self.CAPACITY - entry[0]:
+                    entry[0] += size
+                    entry[1].append(candidates.pop(index))
+                else:
+                    index += 1
+
+    def _frame(self, key, cpgs, fill, early):
+        priority = 7
+        deadline = None
+        for cpg in cpgs:
+            if cpg['priority'] < priority:
+                priority = cpg['priority']
+            if deadline is None or cpg['deadline'] < deadline:
+                deadline = cpg['deadline']
+            self._payload_bytes += cpg['data_length']
+        self._frames += 1
+        if early:
+            self._frames_early += 1
+        self._cpgs += len(cpgs)
+        self._frame_bytes += self._frame_length(fill) if self._frame_length is not None else fill
+        return (key, priority, cpgs, deadline)
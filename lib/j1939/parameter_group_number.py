@@ -29,7 +29,7 @@ class ParameterGroupNumber:
         FD_TP_DT            = 19968  # 4E00
 
         REQUEST             = 59904  # EA00
-        #ACKNOWLEDGEMENT    = 59392
+        ACKNOWLEDGEMENT     = 59392  # E800
         ADDRESSCLAIM        = 60928  # EE00
         DATATRANSFER        = 60160  # EB00
         TP_CM               = 60416  # EC00
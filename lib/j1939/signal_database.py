@@ -0,0 +1,352 @@
+import adafruit_logging as logging
+import json
+import struct
+
+logger = logging.getLogger(__name__)
+
+# struct formats of byte aligned SPNs
+_STRUCT_FORMATS = {8: 'B', 16: 'H', 32: 'I'}
+
+
+class Signal:
+    """One SPN (Suspect Parameter Number) of a PGN
+
+    :param int spn: Suspect Parameter Number
+    :param str name: name of the signal, None if unknown
+    :param int start_bit: position of the least significant bit, counted from bit 0 of byte 0
+    :param int length: number of bits
+    :param scale: resolution, engineering value = raw * scale + offset
+    :param offset: offset of the engineering value
+    :param str unit: unit of the engineering value, None if unknown
+    """
+
+    def __init__(self, spn, name, start_bit, length, scale=1, offset=0, unit=None):
+        if length < 1 or length > 32:
+            raise ValueError("SPN {}: length must be 1 to 32 bits".format(spn))
+        self.spn = spn
+        self.name = name
+        self.start_bit = start_bit
+        self.length = length
+        self.scale = scale
+        self.offset = offset
+        self.unit = unit
+
+    def __repr__(self):
+        return "Signal(spn={}, name={!r}, start_bit={}, length={}, scale={}, offset={}, unit={!r})".format(
+            self.spn, self.name, self.start_bit, self.length, self.scale, self.offset, self.unit)
+
+    def available(self, raw):
+        """False if the raw value is 'not available' or 'error', see SAE J1939-71
+
+        Parameters of 8 bits and more are valid up to 0xFA (0xFAFF, ...),
+        above are indicators, 0xFE.. (error) and 0xFF.. (not available).
+        Shorter ones (status bits) use all ones for not available and all
+        ones minus one for error, single bits are always valid.
+        """
+        length = self.length
+        if length >= 8:
+            return (raw >> (length - 8)) <= 0xFA
+        if length == 1:
+            return True
+        return raw < (1 << length) - 2
+
+
+class _DecodePlan:
+    # the SPNs of a PGN, compiled for decoding: runs of adjacent byte aligned
+    # SPNs of 8, 16 and 32 bits are read with one struct.unpack_from each,
+    # the others by shifting
+
+    def __init__(self, signals):
+        self.signals = signals
+        # [byte, format, size, entries, fields for payloads too short]
+        self.runs = []
+        self.fields = []
+        run = None
+        for signal in sorted(signals, key=lambda s: s.start_bit):
+            code = _STRUCT_FORMATS.get(signal.length)
+            byte = signal.start_bit >> 3
+            if code is not None and signal.start_bit & 7 == 0:
+                if run is None or run[0] + run[2] != byte:
+                    run = [byte, '<', 0, [], []]
+                    self.runs.append(run)
+                run[1] += code
+                run[2] += signal.length >> 3
+                run[3].append(self._entry(signal))
+                run[4].append(self._field(signal))
+            else:
+                self.fields.append(self._field(signal))
+
+    @staticmethod
+    def _entry(signal):
+        # (spn, limit of valid raw values (inclusive), scale, offset),
+        # scale None if the raw value is the engineering value
+        length = signal.length
+        if length >= 8:
+            limit = (0xFB << (length - 8)) - 1
+        elif length == 1:
+            limit = 1
+        else:
+            limit = (1 << length) - 3
+        scale = signal.scale
+        if scale == 1 and signal.offset == 0:
+            scale = None
+        return (signal.spn, limit, scale, signal.offset)
+
+    def _field(self, signal):
+        # (byte, number of bytes, shift, mask) + entry
+        shift = signal.start_bit & 7
+        return (signal.start_bit >> 3, (shift + signal.length + 7) >> 3, shift,
+                (1 << signal.length) - 1) + self._entry(signal)
+
+    def decode(self, data, values):
+        length = len(data)
+        for byte, fmt, size, entries, fields in self.runs:
+            if byte + size > length:
+                # short payload, the SPNs beyond are not available
+                self._decode_fields(data, values, fields)
+                continue
+            raws = struct.unpack_from(fmt, data, byte)
+            for index in range(len(raws)):
+                spn, limit, scale, offset = entries[index]
+                raw = raws[index]
+                if raw > limit:
+                    values[spn] = None
+                elif scale is None:
+                    values[spn] = raw
+                else:
+                    values[spn] = raw * scale + offset
+        if self.fields:
+            self._decode_fields(data, values, self.fields)
+        return values
+
+    @staticmethod
+    def _decode_fields(data, values, fields):
+        length = len(data)
+        for byte, nbytes, shift, mask, spn, limit, scale, offset in fields:
+            if byte + nbytes > length:
+                values[spn] = None
+                continue
+            raw = data[byte]
+            for index in range(1, nbytes):
+                raw |= data[byte + index] << (8 * index)
+            raw = (raw >> shift) & mask
+            if raw > limit:
+                values[spn] = None
+            elif scale is None:
+                values[spn] = raw
+            else:
+                values[spn] = raw * scale + offset
+
+
+class SignalDatabase:
+    """Decodes the payload of PGNs into the engineering values of their SPNs
+
+    The signals come from :meth:`add`, a CSV or a JSON file. Each PGN is
+    compiled into a decode plan the first time it is decoded, only the
+    ``cache_size`` most recently compiled plans are kept. The lines of a
+    CSV file are only read when their PGN is needed, the database keeps an
+    index of the file offsets, so thousands of PGNs fit into the RAM of a
+    microcontroller.
+
+    CSV, one SPN per line, the lines of a PGN have to follow each other,
+    ``#`` starts a comment::
+
+        pgn,spn,name,start_bit,length,scale,offset,unit
+        61444,190,EngineSpeed,24,16,0.125,0,rpm
+
+    JSON, the SPNs of each PGN in the same column order::
+
+        {"61444": [[190, "EngineSpeed", 24, 16, 0.125, 0, "rpm"]]}
+
+    Values which are 'not available' or 'error' (see :meth:`Signal.available`)
+    or beyond the end of a short payload are decoded to None.
+
+    Example usage:
+
+    .. code-block:: python
+
+        db = SignalDatabase.load('j1939_signals.csv')
+
+        def on_values(priority, pgn, sa, timestamp, values):
+            print(values.get(190))  # engine speed in rpm
+
+        ecu.subscribe(db.decoder(on_values))
+
+    :param int cache_size: number of compiled decode plans kept
+    """
+
+    def __init__(self, cache_size=64):
+        self.cache_size = cache_size
+        # pgn -> list of Signal, or file offset of the first line of the pgn (CSV)
+        self._pgns = {}
+        self._file = None
+        self._plans = {}
+        self._plan_order = []
+        self._compiled = 0
+        self._evicted = 0
+
+    @classmethod
+    def load(cls, path, cache_size=64):
+        """Loads a '.json' file, any other as CSV"""
+        db = cls(cache_size)
+        if path.endswith('.json'):
+            with open(path, 'r') as f:
+                db.add_json(json.load(f))
+        else:
+            db.open_csv(open(path, 'rb'))
+        return db
+
+    def close(self):
+        """Closes the CSV file, the PGNs not read yet are dropped"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            for pgn in [pgn for pgn, entry in self._pgns.items() if isinstance(entry, int)]:
+                del self._pgns[pgn]
+
+    def __len__(self):
+        return len(self._pgns)
+
+    def __contains__(self, pgn):
+        return pgn in self._pgns
+
+    @property
+    def pgns(self):
+        """The PGNs known"""
+        return list(self._pgns)
+
+    @property
+    def stats(self):
+        """Decode plan statistics.
+
+        :rtype: dict: 'pgns', 'plans' (compiled plans cached), 'compiled', 'evicted'
+        """
+        return {
+            'pgns': len(self._pgns),
+            'plans': len(self._plans),
+            'compiled': self._compiled,
+            'evicted': self._evicted,
+        }
+
+    def add(self, pgn, signal):
+        """Adds the :class:`Signal` to the PGN"""
+        signals = self.signals(pgn)
+        if signals is None:
+            signals = self._pgns[pgn] = []
+        elif isinstance(self._pgns[pgn], int):
+            self._pgns[pgn] = signals
+        signals.append(signal)
+        self._drop_plan(pgn)
+
+    def add_json(self, database):
+        """Adds the PGNs of a decoded JSON database (dict of PGN -> list of SPN rows)"""
+        for pgn, rows in database.items():
+            pgn = int(pgn)
+            for row in rows:
+                self.add(pgn, Signal(*row))
+
+    def open_csv(self, stream):
+        """Indexes the PGNs of a CSV file, the SPNs are read when needed
+
+        :param stream: file opened in binary mode, seekable, kept open until :meth:`close`
+        """
+        self.close()
+        self._file = stream
+        last = None
+        while True:
+            position = stream.tell()
+            line = stream.readline()
+            if not line:
+                break
+            pgn = self._csv_pgn(line)
+            if pgn is None or pgn == last:
+                continue
+            if pgn in self._pgns:
+                raise ValueError("the lines of PGN {} do not follow each other".format(pgn))
+            self._pgns[pgn] = position
+            last = pgn
+
+    @staticmethod
+    def _csv_pgn(line):
+        # pgn of a data line, None for comments, empty lines and the header
+        field = line.split(b',', 1)[0].strip()
+        if not field or not 0x30 <= field[0] <= 0x39:
+            return None
+        return int(field)
+
+    def _read_csv(self, pgn, position):
+        signals = []
+        stream = self._file
+        stream.seek(position)
+        while True:
+            line = stream.readline()
+            if not line:
+                break
+            if self._csv_pgn(line) is None:
+                continue
+            fields = line.decode().strip().split(',')
+            if int(fields[0]) != pgn:
+                break
+            fields += [''] * (8 - len(fields))
+            signals.append(Signal(int(fields[1]), fields[2] or None, int(fields[3]), int(fields[4]),
+                                  self._number(fields[5], 1), self._number(fields[6], 0), fields[7] or None))
+        return signals
+
+    @staticmethod
+    def _number(text, default):
+        if not text:
+            return default
+        value = float(text)
+        if value == int(value):
+            return int(value)
+        return value
+
+    def signals(self, pgn):
+        """Returns the list of :class:`Signal` of the PGN, None if it is unknown"""
+        entry = self._pgns.get(pgn)
+        if isinstance(entry, int):
+            # not kept, the file is the storage
+            return self._read_csv(pgn, entry)
+        return entry
+
+    def _plan(self, pgn):
+        plan = self._plans.get(pgn)
+        if plan is None:
+            signals = self.signals(pgn)
+            if signals is None:
+                return None
+            plan = _DecodePlan(signals)
+            self._compiled += 1
+            if len(self._plan_order) >= self.cache_size:
+                del self._plans[self._plan_order.pop(0)]
+                self._evicted += 1
+            self._plans[pgn] = plan
+            self._plan_order.append(pgn)
+        return plan
+
+    def _drop_plan(self, pgn):
+        if self._plans.pop(pgn, None) is not None:
+            self._plan_order.remove(pgn)
+
+    def decode(self, pgn, data):
+        """Decodes the payload of a PGN
+
+        :return: dict of SPN -> engineering value (None if not available),
+            None if the PGN is unknown
+        """
+        plan = self._plan(pgn)
+        if plan is None:
+            return None
+        return plan.decode(data, {})
+
+    def decoder(self, callback):
+        """Returns a subscriber for :meth:`j1939.ElectronicControlUnit.subscribe`
+        (or of a CA) calling ``callback(priority, pgn, sa, timestamp, values)``
+        with the decoded values of the PGNs known to the database. Pass the
+        returned function to ``unsubscribe``.
+        """
+        def on_message(priority, pgn, sa, timestamp, data):
+            plan = self._plan(pgn)
+            if plan is not None:
+                callback(priority, pgn, sa, timestamp, plan.decode(data, {}))
+        return on_message
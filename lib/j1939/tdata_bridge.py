@@ -0,0 +1,287 @@
+import adafruit_logging as logging
+import time
+
+import j1939
+
+logger = logging.getLogger(__name__)
+
+# downsampling modes of a signal
+MODES = ('latest', 'min', 'max', 'avg')
+
+class TDataBridge:
+    """Publishes J1939 signals to TData, one child device per source address
+
+    The bridge subscribes through the CA to the PGNs of the selected SPNs,
+    decodes them with a :class:`j1939.signal_database.SignalDatabase` and
+    downsamples each signal over the publish interval: the latest value,
+    minimum, maximum and/or average of the window. Every interval the
+    windows of all devices are published as telemetry through a
+    :class:`tdata.tdata.TData_MQTT_Gateway` (or any object with its
+    ``device_connect``, ``device_disconnect`` and ``publish``), the device
+    of a source address is connected when its first message arrives.
+
+    Changes of the active DTCs (SPN and FMI) or lamps of a DM1 are
+    published as attributes of the device with the next telemetry, and
+    with the following ones as long as their publish fails.
+
+    Memory is bounded by ``max_devices`` times the number of selected
+    signals, frames of further source addresses are ignored. Devices not
+    heard of for ``device_timeout`` seconds are disconnected and dropped.
+    The work per frame is one decode and the update of the windows of the
+    selected SPNs of the PGN.
+
+    :param obj ca: j1939 controller application
+    :param gateway: TData gateway
+    :param database: :class:`j1939.signal_database.SignalDatabase`
+    :param float interval: seconds between two publishes
+    :param str device_name: format of the device name, with the source address as argument
+    :param int max_devices: maximum number of devices (source addresses)
+    :param float device_timeout: seconds without a message before a device is dropped, None keeps them
+    :param bool dm1: forward DM1 changes as attributes
+    :param int batch_size: maximum number of devices per publish
+    :param clock: callable returning the current time in seconds, the clock
+        of the timestamps of the messages, ``time.monotonic`` by default
+
+    Example usage:
+
+    .. code-block:: python
+
+        bridge = TDataBridge(ca, tdata_gateway, SignalDatabase.load('j1939_signals.csv'))
+        bridge.add_signal(61444, 190, modes=('latest', 'max'))  # engine speed
+        bridge.add_signal(65262, 110)                           # coolant temperature
+        bridge.start()
+    """
+
+    def __init__(self, ca: j1939.ControllerApplication, gateway, database, interval=10.0,
+                 device_name="J1939-{:02X}", max_devices=16, device_timeout=60.0, dm1=True, batch_size=8,
+                 clock=None):
+        self._ca = ca
+        self._gateway = gateway
+        self._database = database
+        self._interval = interval
+        self._device_name = device_name
+        self._max_devices = max_devices
+        self._device_timeout = device_timeout
+        self._dm1 = dm1
+        self._batch_size = batch_size
+        self._clock = clock or time.monotonic
+        # pgn -> list of (spn, key, modes) of the selected signals
+        self._signals = {}
+        # sa -> device dict, 'name', 'last' (timestamp), 'windows' (spn -> [count, sum, min, max, latest]),
+        # 'dtcs' and 'lamps' of the last DM1, 'attributes' waiting to be published
+        self._devices = {}
+        self._dm1_handler = None
+        self._timer = None
+        self._frames = 0
+        self._ignored = 0
+        self._publishes = 0
+        self._errors = 0
+
+    @property
+    def stats(self):
+        """Bridge statistics.
+
+        :rtype: dict: 'devices', 'frames' (decoded), 'ignored' (beyond max_devices),
+            'publishes', 'errors' (failed publishes)
+        """
+        return {
+            'devices': len(self._devices),
+            'frames': self._frames,
+            'ignored': self._ignored,
+            'publishes': self._publishes,
+            'errors': self._errors,
+        }
+
+    @property
+    def devices(self):
+        """Names of the devices, by source address"""
+        return {sa: device['name'] for sa, device in self._devices.items()}
+
+    def add_signal(self, pgn, spn, key=None, modes=('latest',)):
+        """Selects a signal to be published
+
+        :param int pgn: Parameter Group Number containing the SPN
+        :param int spn: Suspect Parameter Number
+        :param str key: telemetry key, the name of the signal in the database by default.
+            'latest' is published as the key, the other modes as key.min, key.max, key.avg
+        :param tuple modes: downsampling over the interval, any of 'latest', 'min', 'max', 'avg'
+        """
+        for mode in modes:
+            if mode not in MODES:
+                raise ValueError("unknown mode {}".format(mode))
+        signals = self._database.signals(pgn)
+        if signals is None:
+            raise ValueError("PGN {} not in the database".format(pgn))
+        if key is None:
+            for signal in signals:
+                if signal.spn == spn:
+                    key = signal.name
+                    break
+            else:
+                raise ValueError("SPN {} not in PGN {}".format(spn, pgn))
+        if key is None:
+            key = "spn{}".format(spn)
+        subscribe = pgn not in self._signals and self._timer is not None
+        self._signals.setdefault(pgn, []).append((spn, key, tuple(modes)))
+        for device in self._devices.values():
+            device['windows'][spn] = self._window()
+        if subscribe:
+            self._ca.subscribe(self._on_message, pgn)
+
+    def start(self):
+        """Subscribes to the selected PGNs and starts publishing"""
+        if self._timer is not None:
+            return
+        for pgn in self._signals:
+            self._ca.subscribe(self._on_message, pgn)
+        if self._dm1:
+            self._dm1_handler = j1939.Dm1(self._ca)
+            self._dm1_handler.subscribe(self._on_dm1)
+        self._timer = self._ca.add_timer(self._interval, self._on_timer)
+
+    def stop(self):
+        """Stops publishing, the devices are disconnected"""
+        if self._timer is None:
+            return
+        self._ca.remove_timer(self._timer)
+        self._timer = None
+        self._ca.unsubscribe(self._on_message)
+        if self._dm1_handler is not None:
+            self._ca.unsubscribe(self._dm1_handler._receive)
+            self._dm1_handler = None
+        for sa in list(self._devices):
+            self._drop(sa)
+
+    @staticmethod
+    def _window():
+        # count, sum, min, max, latest
+        return [0, 0, None, None, None]
+
+    def _device(self, sa, timestamp):
+        device = self._devices.get(sa)
+        if device is None:
+            if len(self._devices) >= self._max_devices:
+                self._ignored += 1
+                return None
+            windows = {}
+            for signals in self._signals.values():
+                for spn, _key, _modes in signals:
+                    windows[spn] = self._window()
+            device = {'name': self._device_name.format(sa), 'last': timestamp, 'windows': windows,
+                      'dtcs': None, 'lamps': None, 'attributes': None}
+            self._devices[sa] = device
+            try:
+                self._gateway.device_connect(device['name'])
+            except Exception as e:
+                self._errors += 1
+                logger.error("device connect of {} failed: {}".format(device['name'], e))
+        device['last'] = timestamp
+        return device
+
+    def _drop(self, sa):
+        device = self._devices.pop(sa)
+        try:
+            self._gateway.device_disconnect(device['name'])
+        except Exception as e:
+            self._errors += 1
+            logger.error("device disconnect of {} failed: {}".format(device['name'], e))
+
+    def _on_message(self, priority, pgn, sa, timestamp, data):
+        signals = self._signals.get(pgn)
+        if signals is None:
+            return
+        device = self._device(sa, timestamp)
+        if device is None:
+            return
+        values = self._database.decode(pgn, data)
+        self._frames += 1
+        windows = device['windows']
+        for spn, _key, _modes in signals:
+            value = values.get(spn)
+            if value is None:
+                continue
+            window = windows[spn]
+            window[0] += 1
+            window[1] += value
+            if window[2] is None or value < window[2]:
+                window[2] = value
+            if window[3] is None or value > window[3]:
+                window[3] = value
+            window[4] = value
+
+    def _on_dm1(self, sa, lamp_status, dtc_dic_list, timestamp):
+        device = self._device(sa, timestamp)
+        if device is None:
+            return
+        # SPN 0 / FMI 0 is the placeholder of a DM1 without DTCs
+        dtcs = sorted((dtc['spn'], dtc['fmi']) for dtc in dtc_dic_list if dtc['spn'] or dtc['fmi'])
+        if dtcs == device['dtcs'] and lamp_status == device['lamps']:
+            return
+        device['dtcs'] = dtcs
+        device['lamps'] = lamp_status
+        device['attributes'] = {
+            'dm1.active': ["{}:{}".format(spn, fmi) for spn, fmi in dtcs],
+            'dm1.lamps': lamp_status,
+        }
+
+    def _on_timer(self, cookie):
+        self.publish()
+        return True
+
+    def publish(self):
+        """Publishes the windows and pending attributes of all devices, then starts new windows"""
+        if self._device_timeout is not None:
+            limit = self._clock() - self._device_timeout
+            for sa in [sa for sa, device in self._devices.items() if device['last'] < limit]:
+                self._drop(sa)
+
+        telemetry = {}
+        attributes = {}
+        for device in self._devices.values():
+            values = {}
+            windows = device['windows']
+            for signals in self._signals.values():
+                for spn, key, modes in signals:
+                    window = windows[spn]
+                    if not window[0]:
+                        continue
+                    for mode in modes:
+                        if mode == 'latest':
+                            values[key] = window[4]
+                        elif mode == 'min':
+                            values[key + '.min'] = window[2]
+                        elif mode == 'max':
+                            values[key + '.max'] = window[3]
+                        else:
+                            values[key + '.avg'] = window[1] / window[0]
+                    window[0] = 0
+                    window[1] = 0
+                    window[2] = window[3] = window[4] = None
+            if values:
+                telemetry[device['name']] = [values]
+            if device['attributes'] is not None:
+                attributes[device['name']] = device['attributes']
+        # attributes are published only on a change, they stay pending until sent
+        published = self._publish('attributes', attributes)
+        for device in self._devices.values():
+            if device['name'] in published:
+                device['attributes'] = None
+        self._publish('telemetry', telemetry)
+
+    def _publish(self, publish_type, data):
+        # returns the names of the devices published
+        names = list(data)
+        published = set()
+        for start in range(0, len(names), self._batch_size):
+            batch = {}
+            for name in names[start:start + self._batch_size]:
+                batch[name] = data[name]
+            try:
+                self._gateway.publish(publish_type, batch)
+                self._publishes += 1
+                published.update(batch)
+            except Exception as e:
+                # the windows are lost, the next interval starts afresh
+                self._errors += 1
+                logger.error("publish of {} failed: {}".format(publish_type, e))
+        return published
@@ -0,0 +1,193 @@
+import adafruit_logging as logging
+
+logger = logging.getLogger(__name__)
+
+class TimerHandle:
+    """Handle of a timer event, returned by :meth:`TimerHeap.add`."""
+
+    def __init__(self, deadline, delta_time, callback, cookie, seq):
+        self.deadline = deadline
+        self.delta_time = delta_time
+        self.callback = callback
+        self.cookie = cookie
+        self._seq = seq
+        self._cancelled = False
+        # True while the handle is stored in the heap
+        self._queued = False
+
+    @property
+    def cancelled(self):
+        """True if the timer was cancelled or has expired for good."""
+        return self._cancelled
+
+    def _before(self, other):
+        # events with the same deadline run in the order they were added
+        if self.deadline == other.deadline:
+            return self._seq < other._seq
+        return self.deadline < other.deadline
+
+
+class TimerHeap:
+    """Timer events ordered by deadline in a binary heap.
+
+    Adding an event is O(log n), cancelling by handle is O(1) (the entry is
+    dropped lazily when it reaches the top) and the next deadline is known
+    without scanning the events.
+
+    A callback returning True is called again after ``delta_time``. The new
+    deadline is derived from the previous one, not from the time the
+    callback ran, so periodic events do not drift. Periods missed because
+    the loop was late are skipped.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+        self._cancelled = 0
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled
+
+    def add(self, now, delta_time, callback, cookie=None):
+        """Adds a timer event
+
+        :param float now:
+            The current time in seconds.
+        :param float delta_time:
+            The time in seconds after which the event is to be triggered.
+        :param callback:
+            The callback function to call, gets the cookie as only argument.
+        :param cookie:
+            Passed to the callback.
+        :return:
+            A :class:`TimerHandle` for :meth:`cancel`.
+        """
+        self._seq += 1
+        handle = TimerHandle(now + delta_time, delta_time, callback, cookie, self._seq)
+        self._push(handle)
+        return handle
+
+    def cancel(self, handle):
+        """Cancels the timer event of the given handle
+
+        :return:
+            False if the event was already cancelled or expired.
+        """
+        if handle._cancelled:
+            return False
+        handle._cancelled = True
+        if not handle._queued:
+            # cancelled while its callback runs
+            return True
+        self._cancelled += 1
+        # rebuild once the heap is mostly garbage
+        if self._cancelled > 16 and self._cancelled * 2 > len(self._heap):
+            self._compact()
+        return True
+
+    def cancel_callback(self, callback):
+        """Cancels ALL timer events of the given callback (O(n))
+
+        :return:
+            The number of cancelled events.
+        """
+        count = 0
+        for handle in self._heap:
+            if handle.callback == callback and self.cancel(handle):
+                count += 1
+        return count
+
+    def next_deadline(self):
+        """Returns the deadline of the next timer event, None if there is none."""
+        heap = self._heap
+        while heap and heap[0]._cancelled:
+            self._pop()
+            self._cancelled -= 1
+        if heap:
+            return heap[0].deadline
+        return None
+
+    def run(self, now):
+        """Calls the callbacks of all expired timer events
+
+        Events added or rescheduled by the callbacks are not run before the
+        next call, even if they are due already.
+
+        :param float now:
+            The current time in seconds.
+        :return:
+            The deadline of the next timer event, None if there is none.
+        """
+        heap = self._heap
+        due = []
+        while heap and heap[0].deadline <= now:
+            handle = self._pop()
+            if handle._cancelled:
+                self._cancelled -= 1
+            else:
+                due.append(handle)
+
+        for handle in due:
+            # an earlier callback may have cancelled this one
+            if handle._cancelled:
+                continue
+            if handle.callback(handle.cookie) == True and not handle._cancelled:
+                # "true" means the callback wants to be called again
+                delta_time = handle.delta_time
+                deadline = handle.deadline + delta_time
+                if deadline <= now:
+                    if delta_time > 0:
+                        # skip the missed periods
+                        logger.debug("Timer event overrun")
+                        deadline += delta_time * (int((now - deadline) / delta_time) + 1)
+                    else:
+                        deadline = now
+                handle.deadline = deadline
+                self._push(handle)
+            else:
+                handle._cancelled = True
+
+        return self.next_deadline()
+
+    def _compact(self):
+        heap = [handle for handle in self._heap if not handle._cancelled]
+        self._cancelled = 0
+        # a sorted list is a valid heap
+        heap.sort(key=lambda handle: (handle.deadline, handle._seq))
+        self._heap = heap
+
+    def _push(self, handle):
+        heap = self._heap
+        handle._queued = True
+        heap.append(handle)
+        pos = len(heap) - 1
+        while pos > 0:
+            parent = (pos - 1) >> 1
+            if not handle._before(heap[parent]):
+                break
+            heap[pos] = heap[parent]
+            pos = parent
+        heap[pos] = handle
+
+    def _pop(self):
+        heap = self._heap
+        last = heap.pop()
+        if not heap:
+            last._queued = False
+            return last
+        top = heap[0]
+        top._queued = False
+        size = len(heap)
+        pos = 0
+        child = 1
+        while child < size:
+            right = child + 1
+            if right < size and heap[right]._before(heap[child]):
+                child = right
+            if not heap[child]._before(last):
+                break
+            heap[pos] = heap[child]
+            pos = child
+            child = 2 * pos + 1
+        heap[pos] = last
+        return top
@@ -0,0 +1,285 @@
+import time
+import struct
+
+# CAN traces of an ECU: recording, text export and replay.
+#
+# File layout (little endian):
+#   header: 4s magic "J1TR" | u8 version | u8 data size (8 or 64) | u16 reserved
+#   record: f64 timestamp | u32 can_id | u8 flags | u8 length | data size bytes
+# Every record has the same size, unused data bytes are 0.
+
+MAGIC = b"J1TR"
+FORMAT_VERSION = 1
+
+_HEADER = "<4sBBH"
+_HEADER_SIZE = struct.calcsize(_HEADER)
+_RECORD = "<dIBB"
+_RECORD_SIZE = struct.calcsize(_RECORD)
+
+# CAN FD data length code of the valid lengths above 8
+_FD_DLC = {12: 9, 16: 10, 20: 11, 24: 12, 32: 13, 48: 14, 64: 15}
+
+class TraceFlag:
+    RX = 0x00
+    TX = 0x01
+    EXTENDED = 0x02
+    FD = 0x04
+
+
+class TraceRecorder:
+    """Writes the frames received and sent by an ECU to a binary trace.
+
+    Records are collected in a preallocated buffer and written to the
+    stream when it is full, on :meth:`flush` and on :meth:`close`.
+
+    :param stream:
+        Binary stream opened for writing, e.g. ``open("trace.bin", "wb")``.
+    :param int data_size:
+        Data bytes per record, 8 for j1939-21, 64 for j1939-22 (CAN FD).
+    :param int buffer_records:
+        Number of records buffered before writing to the stream.
+
+    Example usage:
+
+    .. code-block:: python
+
+        recorder = TraceRecorder(open("trace.bin", "wb"))
+        ecu.set_tracer(recorder)
+        ...
+        ecu.set_tracer(None)
+        recorder.close()
+    """
+
+    def __init__(self, stream, data_size=8, buffer_records=32):
+        self._stream = stream
+        self._data_size = data_size
+        self._record_size = _RECORD_SIZE + data_size
+        self._buffer = bytearray(self._record_size * buffer_records)
+        self._view = memoryview(self._buffer)
+        self._used = 0
+        self.records = 0
+        self.truncated = 0
+        stream.write(struct.pack(_HEADER, MAGIC, FORMAT_VERSION, data_size, 0))
+
+    def record(self, flags, can_id, data, timestamp):
+        """Adds a frame to the trace
+
+        :param int flags:
+            :class:`TraceFlag` bits (direction, extended id, CAN FD).
+        """
+        if self._used + self._record_size > len(self._buffer):
+            self.flush()
+        offset = self._used
+        length = len(data)
+        if length > self._data_size:
+            # the trace was opened for classic CAN
+            length = self._data_size
+            self.truncated += 1
+        struct.pack_into(_RECORD, self._buffer, offset, timestamp, can_id, flags, length)
+        start = offset + _RECORD_SIZE
+        view = self._view
+        view[start:start + length] = bytes(data[:length])
+        if length < self._data_size:
+            view[start + length:start + self._data_size] = bytes(self._data_size - length)
+        self._used = offset + self._record_size
+        self.records += 1
+
+    def on_receive(self, can_id, data, timestamp):
+        """Records a received frame (hook of :meth:`ElectronicControlUnit.notify`)."""
+        self.record(TraceFlag.RX | TraceFlag.EXTENDED, can_id, data, timestamp)
+
+    def on_send(self, can_id, extended_id, data, fd_format=False, timestamp=None):
+        """Records a sent frame (hook of :meth:`ElectronicControlUnit._send_message`,
+        called for the frames handed to the bus or queued for it)
+
+        :param float timestamp:
+            Time from the clock of the bus, ``time.monotonic()`` if None.
+        """
+        flags = TraceFlag.TX
+        if extended_id:
+            flags |= TraceFlag.EXTENDED
+        if fd_format:
+            flags |= TraceFlag.FD
+        self.record(flags, can_id, data, time.monotonic() if timestamp is None else timestamp)
+
+    def flush(self):
+        """Writes the buffered records to the stream."""
+        if self._used:
+            self._stream.write(self._view[:self._used])
+            self._used = 0
+
+    def close(self):
+        """Flushes and closes the stream."""
+        self.flush()
+        self._stream.close()
+
+
+class TraceReader:
+    """Reads a binary trace written by :class:`TraceRecorder`.
+
+    Iterating yields ``(timestamp, flags, can_id, data)`` tuples. The data
+    is a memoryview into a buffer reused for the next record, copy it if
+    it is kept.
+
+    :param stream:
+        Binary stream opened for reading, e.g. ``open("trace.bin", "rb")``.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        header = stream.read(_HEADER_SIZE)
+        if len(header) < _HEADER_SIZE:
+            raise ValueError("not a J1939 trace (too short)")
+        magic, version, data_size, _reserved = struct.unpack(_HEADER, header)
+        if magic != MAGIC:
+            raise ValueError("not a J1939 trace")
+        if version != FORMAT_VERSION:
+            raise ValueError("unsupported trace version {0}".format(version))
+        self.data_size = data_size
+        self._record_size = _RECORD_SIZE + data_size
+        self._buffer = bytearray(self._record_size)
+        self._view = memoryview(self._buffer)
+
+    def __iter__(self):
+        buffer = self._buffer
+        view = self._view
+        record_size = self._record_size
+        unpack_from = struct.unpack_from
+        readinto = self._stream.readinto
+        while readinto(buffer) == record_size:
+            timestamp, can_id, flags, length = unpack_from(_RECORD, buffer, 0)
+            yield timestamp, flags, can_id, view[_RECORD_SIZE:_RECORD_SIZE + length]
+
+    def close(self):
+        self._stream.close()
+
+
+def export_candump(reader, out, channel="can0"):
+    """Writes a trace in the candump log format (``candump -l``)
+
+    :param reader: :class:`TraceReader`
+    :param out: Text stream opened for writing.
+    :param str channel: Interface name written to each line.
+    :return: The number of exported records.
+    """
+    count = 0
+    for timestamp, flags, can_id, data in reader:
+        payload = "".join("{:02X}".format(b) for b in data)
+        if flags & TraceFlag.EXTENDED:
+            can_id_text = "{:08X}".format(can_id)
+        else:
+            can_id_text = "{:03X}".format(can_id)
+        separator = "##0" if flags & TraceFlag.FD else "#"
+        out.write("({:.6f}) {} {}{}{}\n".format(timestamp, channel, can_id_text, separator, payload))
+        count += 1
+    return count
+
+def export_asc(reader, out, channel=1):
+    """Writes a trace in the Vector ASC format
+
+    Timestamps are written relative to the first record.
+
+    :param reader: :class:`TraceReader`
+    :param out: Text stream opened for writing.
+    :param int channel: Channel number written to each line.
+    :return: The number of exported records.
+    """
+    out.write("base hex  timestamps absolute\n")
+    out.write("no internal events logged\n")
+    start = None
+    count = 0
+    for timestamp, flags, can_id, data in reader:
+        if start is None:
+            start = timestamp
+        payload = " ".join("{:02X}".format(b) for b in data)
+        if flags & TraceFlag.EXTENDED:
+            can_id_text = "{:X}x".format(can_id)
+        else:
+            can_id_text = "{:X}".format(can_id)
+        direction = "Tx" if flags & TraceFlag.TX else "Rx"
+        if flags & TraceFlag.FD:
+            dlc = _FD_DLC.get(len(data), len(data))
+            out.write("{:11.6f} CANFD {:3d} {:<4} {:>8} 0 0 {:x} {:2d} {}\n".format(timestamp - start, channel, direction, can_id_text, dlc, len(data), payload))
+        else:
+            out.write("{:11.6f} {} {:<15} {}   d {} {}\n".format(timestamp - start, channel, can_id_text, direction, len(data), payload))
+        count += 1
+    return count
+
+
+class TraceReplayer:
+    """Feeds the received frames of a trace into an ECU.
+
+    :param reader:
+        :class:`TraceReader`
+    :param ecu:
+        The :class:`j1939.ElectronicControlUnit` to feed.
+    :param float speed:
+        1 replays with the original timing, 2 twice as fast, 0 flat-out.
+    :param bool include_tx:
+        Replay the frames the recording ECU sent as well.
+
+    Example usage:
+
+    .. code-block:: python
+
+        replayer = TraceReplayer(TraceReader(open("trace.bin", "rb")), ecu, speed=0)
+        frames = replayer.run()
+    """
+
+    def __init__(self, reader, ecu, speed=1.0, include_tx=False):
+        self._ecu = ecu
+        self.speed = speed
+        self._include_tx = include_tx
+        self._records = iter(reader)
+        self._next = None
+        self._trace_start = None
+        self._replay_start = None
+        self.frames = 0
+
+    def _due(self, record, now):
+        if not self.speed:
+            return True
+        if self._trace_start is None:
+            self._trace_start = record[0]
+            self._replay_start = now
+        return (record[0] - self._trace_start) / self.speed <= now - self._replay_start
+
+    def step(self, now=None):
+        """Feeds all frames due by now, for use in the application loop next to
+        ``ecu.loop()``. Flat-out (speed 0) feeds the whole trace.
+
+        :param float now:
+            ``time.monotonic()`` if not given.
+        :return:
+            False once the trace is exhausted.
+        """
+        if now is None:
+            now = time.monotonic()
+        notify = self._ecu.notify
+        include_tx = self._include_tx
+        while True:
+            record = self._next
+            if record is None:
+                try:
+                    record = next(self._records)
+                except StopIteration:
+                    return False
+                if record[1] & TraceFlag.TX and not include_tx:
+                    continue
+                self._next = record
+            if not self._due(record, now):
+                return True
+            self._next = None
+            # the reader reuses its buffer, notify receives a copy
+            notify(record[2], bytearray(record[3]), record[0])
+            self.frames += 1
+
+    def run(self):
+        """Replays the whole trace, blocking.
+
+        :return:
+            The number of frames fed into the ECU.
+        """
+        while self.step():
+            time.sleep(0.001)
+        return self.frames
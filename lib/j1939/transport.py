@@ -0,0 +1,338 @@
+import adafruit_logging as logging
+
+logger = logging.getLogger(__name__)
+
+class RxSession:
+    """Reassembly of one transport protocol (TP.CM / TP.DT) receive session.
+
+    The payload buffer is allocated once, when the RTS or BAM arrives, and
+    the TP.DT packets are written into it at the offset given by their
+    sequence number. Packets may arrive out of order, duplicates are
+    ignored.
+    """
+
+    def __init__(self, pgn, message_size, num_packages, src_address, dest_address, deadline, buffer=None, priority=7):
+        """
+        :param int pgn:
+            Parameter Group Number of the transported message.
+        :param int message_size:
+            Size of the transported message in bytes.
+        :param int num_packages:
+            Number of TP.DT packets announced by the sender.
+        :param int src_address:
+            Source address of the sender.
+        :param int dest_address:
+            Destination address, GLOBAL for BAM.
+        :param float deadline:
+            Time at which the session times out.
+        :param bytearray buffer:
+            Payload buffer of message_size bytes (e.g. from a :class:`BufferPool`),
+            allocated if not given.
+        :param int priority:
+            Priority of the TP.CM frame which opened the session.
+        """
+        self.pgn = pgn
+        self.message_size = message_size
+        self.num_packages = num_packages
+        self.src_address = src_address
+        self.dest_address = dest_address
+        self.deadline = deadline
+        self.priority = priority
+        # time of the last packet, for LRU eviction
+        self.last_activity = 0
+        # RTS/CTS flow control, set by the data link layer
+        self.next_packet = 1
+        self.num_packages_max_rec = 1
+        # packets needed to fill message_size, the sender may announce more
+        self._required = (message_size + 6) // 7
+        self.data = buffer if buffer is not None else bytearray(message_size)
+        self._view = memoryview(self.data)
+        # one bit per packet, to detect duplicates
+        self._received = bytearray((num_packages + 7) >> 3)
+        self.received_count = 0
+        self.duplicates = 0
+
+    @property
+    def complete(self):
+        """True once all packets were received."""
+        return self.received_count >= self._required
+
+    def write(self, data):
+        """Stores a TP.DT packet
+
+        :param data:
+            The TP.DT frame data, sequence number followed by 7 data bytes.
+        :return:
+            False if the packet was a duplicate or out of range.
+        """
+        index = data[0] - 1
+        if index < 0 or index >= self.num_packages:
+            return False
+        mask = 1 << (index & 7)
+        if self._received[index >> 3] & mask:
+            self.duplicates += 1
+            return False
+        self._received[index >> 3] |= mask
+        offset = index * 7
+        if offset >= self.message_size:
+            # packet beyond the message size, nothing to store
+            return True
+        length = self.message_size - offset
+        if length > 7:
+            length = 7
+        if length > len(data) - 1:
+            # short frame
+            length = len(data) - 1
+        self._view[offset:offset + length] = data[1:1 + length]
+        self.received_count += 1
+        return True
+
+
+class BufferPool:
+    """Payload buffers shared by all receive sessions, bounded in bytes.
+
+    Buffers of sessions which end without delivery (timeout, abort,
+    eviction) are kept and reused for sessions of the same size, e.g. the
+    DM1 of an ECU repeated every second. Delivered buffers belong to the
+    subscribers and are not reused, unless ``recycle_delivered`` is set,
+    in which case subscribers must copy data they keep beyond the callback.
+
+    :param int max_bytes:
+        Upper bound of the bytes held by sessions and free buffers together.
+    :param bool recycle_delivered:
+        Reuse buffers after they were handed to the subscribers.
+    """
+
+    def __init__(self, max_bytes=16384, recycle_delivered=False):
+        self.max_bytes = max_bytes
+        self.recycle_delivered = recycle_delivered
+        # free buffers by size
+        self._free = {}
+        self._free_bytes = 0
+        self.in_use = 0
+        self.reused = 0
+
+    @property
+    def free_bytes(self):
+        """Bytes held in free buffers."""
+        return self._free_bytes
+
+    def acquire(self, size):
+        """Returns a buffer of size bytes, None if the byte budget is exhausted."""
+        free = self._free.get(size)
+        if free:
+            buffer = free.pop()
+            self._free_bytes -= size
+            self.in_use += size
+            self.reused += 1
+            return buffer
+        if self.in_use + size > self.max_bytes:
+            return None
+        # make room by dropping free buffers of other sizes
+        while self.in_use + self._free_bytes + size > self.max_bytes:
+            for other in self._free:
+                if self._free[other]:
+                    self._free[other].pop()
+                    self._free_bytes -= other
+                    break
+        self.in_use += size
+        return bytearray(size)
+
+    def release(self, buffer, delivered=False):
+        """Gives back the buffer of a finished session
+
+        :param bool delivered:
+            The buffer was handed to the subscribers.
+        """
+        size = len(buffer)
+        self.in_use -= size
+        if delivered and not self.recycle_delivered:
+            return
+        self._free.setdefault(size, []).append(buffer)
+        self._free_bytes += size
+
+
+class RxSessionManager:
+    """Receive sessions of a data link layer, bounded in number and memory.
+
+    :param int max_sessions:
+        Maximum number of concurrent sessions (BAM and RTS/CTS).
+    :param int max_session_bytes:
+        Largest message accepted, 1785 is the J1939-21 maximum.
+    :param BufferPool pool:
+        Shared payload buffers, a pool of 16 kB is created if not given.
+    :param str eviction:
+        Which session gives way when all are in use and a new one is opened:
+        'lru' (least recently active), 'priority' (lowest priority, then
+        least recently active) or None (the new session is rejected).
+    """
+
+    def __init__(self, max_sessions=16, max_session_bytes=1785, pool=None, eviction='lru'):
+        if eviction not in ('lru', 'priority', None):
+            raise ValueError("eviction must be 'lru', 'priority' or None")
+        self.max_sessions = max_sessions
+        self.max_session_bytes = max_session_bytes
+        self.pool = pool if pool is not None else BufferPool()
+        self.eviction = eviction
+        self._sessions = {}
+        self._opened = 0
+        self._completed = 0
+        self._evicted = 0
+        self._timeouts = 0
+        self._rejected = 0
+        self._max_open = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, key):
+        return key in self._sessions
+
+    def get(self, key):
+        """Returns the session for the key, None if there is none."""
+        return self._sessions.get(key)
+
+    def keys(self):
+        """The keys of the open sessions (a copy, sessions may be closed while iterating)."""
+        return list(self._sessions)
+
+    @property
+    def stats(self):
+        """Session statistics.
+
+        :rtype: dict: 'open', 'max_open', 'opened', 'completed', 'evicted',
+            'timeouts', 'rejected', 'bytes_in_use', 'bytes_free', 'buffers_reused'
+        """
+        return {
+            'open': len(self._sessions),
+            'max_open': self._max_open,
+            'opened': self._opened,
+            'completed': self._completed,
+            'evicted': self._evicted,
+            'timeouts': self._timeouts,
+            'rejected': self._rejected,
+            'bytes_in_use': self.pool.in_use,
+            'bytes_free': self.pool.free_bytes,
+            'buffers_reused': self.pool.reused,
+        }
+
+    def expired(self, now):
+        """Returns the keys of the sessions whose deadline has passed."""
+        return [key for key, session in self._sessions.items() if session.deadline != 0 and session.deadline <= now]
+
+    def victim(self):
+        """Returns the key of the session to evict according to the policy, None if eviction is off."""
+        if self.eviction is None or not self._sessions:
+            return None
+        victim_key = None
+        victim = None
+        for key, session in self._sessions.items():
+            if victim is None:
+                better = True
+            elif self.eviction == 'priority' and session.priority != victim.priority:
+                better = session.priority > victim.priority
+            else:
+                better = session.last_activity < victim.last_activity
+            if better:
+                victim_key = key
+                victim = session
+        return victim_key
+
+    def can_open(self, message_size):
+        """True if a session of this size fits without evicting another one."""
+        return len(self._sessions) < self.max_sessions and self.pool.in_use + message_size <= self.pool.max_bytes
+
+    def open(self, key, pgn, message_size, num_packages, src_address, dest_address, deadline, priority, now):
+        """Opens a session, there must be no session for the key and
+        :meth:`can_open` must be True (the caller evicts or expires first).
+
+        :return:
+            The new :class:`RxSession`, None if the message is too large
+            or no buffer is available.
+        """
+        if message_size > self.max_session_bytes or len(self._sessions) >= self.max_sessions:
+            self._rejected += 1
+            return None
+        buffer = self.pool.acquire(message_size)
+        if buffer is None:
+            self._rejected += 1
+            return None
+        session = RxSession(pgn, message_size, num_packages, src_address, dest_address, deadline, buffer, priority)
+        session.last_activity = now
+        self._sessions[key] = session
+        self._opened += 1
+        if len(self._sessions) > self._max_open:
+            self._max_open = len(self._sessions)
+        return session
+
+    def close(self, key, reason=None):
+        """Closes the session of the key
+
+        :param str reason:
+            None (aborted by the peer or replaced), 'completed' (payload delivered),
+            'timeout' or 'evicted'.
+        :return:
+            The closed session, None if there was none.
+        """
+        session = self._sessions.pop(key, None)
+        if session is None:
+            return None
+        if reason == 'completed':
+            self._completed += 1
+        elif reason == 'timeout':
+            self._timeouts += 1
+        elif reason == 'evicted':
+            self._evicted += 1
+        self.pool.release(session.data, reason == 'completed')
+        return session
+
+
+class TxSegmenter:
+    """Splits the payload of a transport protocol send session into TP.DT frames.
+
+    The payload is copied once into a buffer padded (0xFF) to a whole
+    number of packets. Each frame is assembled in a frame buffer which is
+    reused for every packet, so sending a packet allocates nothing. The
+    frame returned by :meth:`packet` is only valid until the next call.
+
+    :param data:
+        The payload (bytes, bytearray or list of ints).
+    :param int payload_size:
+        Payload bytes per packet, 7 for j1939-21, 60 for j1939-22.
+    :param int header_size:
+        Header bytes in front of the payload, filled in by the caller
+        (sequence number, session and segment number).
+    :param frame_length:
+        None to send every frame with the full length, or a callable
+        returning the frame length to use for the used bytes of the last
+        packet (e.g. the next valid CAN FD length).
+    """
+
+    def __init__(self, data, payload_size=7, header_size=1, frame_length=None):
+        message_size = len(data)
+        self.message_size = message_size
+        self.num_packets = (message_size + payload_size - 1) // payload_size
+        self._payload_size = payload_size
+        self._header_size = header_size
+        self._frame_length = frame_length
+        padded = self.num_packets * payload_size
+        self._buffer = bytearray(padded)
+        self._buffer[:message_size] = bytes(data)
+        if padded > message_size:
+            self._buffer[message_size:] = b'\xff' * (padded - message_size)
+        self._view = memoryview(self._buffer)
+        self.frame = bytearray(header_size + payload_size)
+        self._frame_view = memoryview(self.frame)
+
+    def packet(self, index):
+        """Copies the payload of packet index (0 based) behind the header of :attr:`frame`
+
+        :return:
+            The frame, or a view of its used part for a shortened last frame.
+        """
+        offset = index * self._payload_size
+        header_size = self._header_size
+        self._frame_view[header_size:] = self._view[offset:offset + self._payload_size]
+        if self._frame_length is None or offset + self._payload_size <= self.message_size:
+            return self.frame
+        return self._frame_view[:self._frame_length(header_size + self.message_size - offset)]
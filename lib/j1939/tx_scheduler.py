@@ -0,0 +1,289 @@
+import time
+from . import log
+
+_log = log.get(__name__)
+
+# transport protocol PGNs (TP.CM, TP.DT, FD TP.CM, FD TP.DT), a lost frame breaks the session
+_TP_CM_PGNS = (0xEC00, 0x4D00)
+_TP_PGNS = (0xEC00, 0xEB00, 0x4D00, 0x4E00)
+
+class TxScheduler:
+    """Transmit queue of an ECU, ordered by the J1939 priority of the frames.
+
+    Frames are sent lowest priority value first (0 is the most urgent),
+    frames of the same priority in the order they were queued. A minimum
+    interval between two frames of the same PGN can be set per PGN, frames
+    sent faster are held back until their time has come. The queue is
+    bounded, when it is full the drop policy decides which frame is lost:
+
+    * 'new': the new frame is rejected
+    * 'oldest': the frame waiting longest is dropped
+    * 'priority': the newest frame of the lowest priority is dropped if its
+      priority is lower than the one of the new frame, otherwise the new
+      frame is rejected
+
+    For a rejected frame the ECU raises RuntimeError to the sender: a
+    single frame PGN is not sent, a transport protocol session is aborted.
+    Frames of the transport protocols are never dropped for a new frame,
+    TP.CM frames (RTS, CTS, EOM, abort) are queued even beyond
+    ``max_frames``, there are a few per session and without them the
+    session can neither continue nor end.
+
+    A send raising RuntimeError (e.g. no free transmit buffer in the
+    controller) leaves the frame at the head of the queue, it is sent with
+    the next :meth:`flush`.
+
+    :param int max_frames:
+        Maximum number of frames waiting, including the held back ones.
+    :param str drop_policy:
+        'new', 'oldest' or 'priority'.
+    :param int burst:
+        Maximum number of frames handed to the bus per :meth:`flush`,
+        None for no limit.
+    :param clock:
+        Callable returning the current time in seconds, ``time.monotonic``
+        by default.
+
+    Example usage:
+
+    .. code-block:: python
+
+        scheduler = TxScheduler(max_frames=128)
+        # DM1 at most every 100 ms
+        scheduler.set_interval(0xFECA, 0.1)
+        ecu = j1939.ElectronicControlUnit(tx_scheduler=scheduler)
+    """
+
+    def __init__(self, max_frames=256, drop_policy='priority', burst=None, clock=None):
+        # levels set on the loggers before the scheduler was created
+        _log.refresh()
+        if drop_policy not in ('new', 'oldest', 'priority'):
+            raise ValueError("drop_policy must be 'new', 'oldest' or 'priority'")
+        self.max_frames = max_frames
+        self.drop_policy = drop_policy
+        self.burst = burst
+        self.clock = clock or time.monotonic
+        # one FIFO per priority, entries [can_id, extended_id, data, fd_format, queued_at],
+        # consumed from the head index, compacted when half of the list is consumed
+        self._queues = [[] for _ in range(8)]
+        self._heads = [0] * 8
+        self._ready = 0
+        # held back frames, ordered by release time: [release, seq, can_id, extended_id, data, fd_format, queued_at]
+        self._held = []
+        self._seq = 0
+        # minimum interval and next release time per PGN
+        self._intervals = {}
+        self._next_release = {}
+        self._sent = 0
+        self._dropped = 0
+        self._max_queued = 0
+        self._latency_sum = 0.0
+        self._latency_max = [0.0] * 8
+
+    def __len__(self):
+        return self._ready + len(self._held)
+
+    @staticmethod
+    def _pgn(can_id):
+        pgn = (can_id >> 8) & 0x3FFFF
+        if ((pgn >> 8) & 0xFF) < 240:
+            # PDU1, the pdu specific is the destination address
+            pgn &= 0x3FF00
+        return pgn
+
+    def set_interval(self, pgn, interval):
+        """Sets the minimum time between two frames of a PGN
+
+        :param int pgn:
+            Parameter Group Number, PDU1 PGNs with a pdu specific of 0.
+        :param float interval:
+            Seconds, None or 0 removes the limit.
+        """
+        if interval:
+            self._intervals[pgn] = interval
+        else:
+            self._intervals.pop(pgn, None)
+            self._next_release.pop(pgn, None)
+
+    @property
+    def stats(self):
+        """Transmit statistics.
+
+        :rtype: dict: 'queued', 'held', 'max_queued', 'sent', 'dropped',
+            'latency_avg' and 'latency_max' (seconds from queueing to the bus),
+            'latency_max_by_priority' (list of 8)
+        """
+        return {
+            'queued': self._ready,
+            'held': len(self._held),
+            'max_queued': self._max_queued,
+            'sent': self._sent,
+            'dropped': self._dropped,
+            'latency_avg': self._latency_sum / self._sent if self._sent else 0.0,
+            'latency_max': max(self._latency_max),
+            'latency_max_by_priority': list(self._latency_max),
+        }
+
+    def next_release(self):
+        """Returns the time the next held back frame is released, None if there is none."""
+        if self._held:
+            return self._held[0][0]
+        return None
+
+    def enqueue(self, can_id, extended_id, data, fd_format=False):
+        """Queues a frame, the data is copied
+
+        :return:
+            False if the frame was rejected because the queue is full.
+        """
+        pgn = self._pgn(can_id)
+        if (self._ready + len(self._held) >= self.max_frames and not self._make_room((can_id >> 26) & 7)
+                and pgn not in _TP_CM_PGNS):
+            self._dropped += 1
+            return False
+        now = self.clock()
+        data = bytes(data)
+        interval = self._intervals.get(pgn)
+        if interval is not None:
+            release = self._next_release.get(pgn, now)
+            if release < now:
+                release = now
+            self._next_release[pgn] = release + interval
+            if release > now:
+                self._hold([release, self._seq, can_id, extended_id, data, fd_format, now])
+                self._seq += 1
+                self._count_queued()
+                return True
+        self._push(can_id, extended_id, data, fd_format, now)
+        self._count_queued()
+        return True
+
+    def flush(self, send):
+        """Hands the queued frames to the bus, most urgent first
+
+        :param send:
+            Called as ``send(can_id, data, extended_id)``, e.g. :meth:`j1939.can.CanBus.send`.
+        :return:
+            The number of frames sent.
+        """
+        now = self.clock()
+        held = self._held
+        while held and held[0][0] <= now:
+            _release, _seq, can_id, extended_id, data, fd_format, queued_at = held.pop(0)
+            self._push(can_id, extended_id, data, fd_format, queued_at)
+        sent = 0
+        burst = self.burst
+        queues = self._queues
+        heads = self._heads
+        priority = 0
+        while self._ready and priority < 8:
+            queue = queues[priority]
+            head = heads[priority]
+            if head >= len(queue):
+                priority += 1
+                continue
+            if burst is not None and sent >= burst:
+                break
+            frame = queue[head]
+            try:
+                send(frame[0], frame[2], frame[1])
+            except RuntimeError as e:
+                # controller busy, retried with the next flush
+                if _log.debug_enabled:
+                    _log.debug("send deferred: {0}", e)
+                break
+            queue[head] = None
+            self._advance(priority)
+            latency = now - frame[4]
+            self._latency_sum += latency
+            if latency > self._latency_max[priority]:
+                self._latency_max[priority] = latency
+            self._sent += 1
+            sent += 1
+        return sent
+
+    def clear(self):
+        """Drops all queued and held back frames."""
+        self._queues = [[] for _ in range(8)]
+        self._heads = [0] * 8
+        self._ready = 0
+        self._held = []
+
+    def _push(self, can_id, extended_id, data, fd_format, queued_at):
+        self._queues[(can_id >> 26) & 7].append([can_id, extended_id, data, fd_format, queued_at])
+        self._ready += 1
+
+    def _hold(self, entry):
+        held = self._held
+        index = len(held)
+        while index > 0 and held[index - 1][0] > entry[0]:
+            index -= 1
+        held.insert(index, entry)
+
+    def _advance(self, priority):
+        # consume the head of a priority queue
+        self._ready -= 1
+        head = self._heads[priority] + 1
+        queue = self._queues[priority]
+        if head >= len(queue):
+            del queue[:]
+            head = 0
+        elif head > 32 and head * 2 > len(queue):
+            del queue[:head]
+            head = 0
+        self._heads[priority] = head
+
+    def _count_queued(self):
+        queued = self._ready + len(self._held)
+        if queued > self._max_queued:
+            self._max_queued = queued
+
+    def _make_room(self, priority):
+        # drops a queued frame according to the policy, False if the new frame is to be rejected,
+        # frames of the transport protocols are never dropped
+        if self.drop_policy == 'new':
+            return False
+        queues = self._queues
+        heads = self._heads
+        if self.drop_policy == 'oldest':
+            victim = None
+            for level in range(8):
+                queue = queues[level]
+                for index in range(heads[level], len(queue)):
+                    frame = queue[index]
+                    if self._pgn(frame[0]) not in _TP_PGNS:
+                        # the first one of a level is its oldest
+                        if victim is None or frame[4] < queues[victim[0]][victim[1]][4]:
+                            victim = (level, index)
+                        break
+            if victim is not None:
+                self._remove(victim[0], victim[1])
+            else:
+                for index in range(len(self._held)):
+                    if self._pgn(self._held[index][2]) not in _TP_PGNS:
+                        self._held.pop(index)
+                        break
+                else:
+                    return False
+        else:
+            level = 7
+            while level > priority:
+                queue = queues[level]
+                # newest frame of that priority
+                for index in range(len(queue) - 1, heads[level] - 1, -1):
+                    if self._pgn(queue[index][0]) not in _TP_PGNS:
+                        self._remove(level, index)
+                        self._dropped += 1
+                        return True
+                level -= 1
+            return False
+        self._dropped += 1
+        return True
+
+    def _remove(self, priority, index):
+        # removes a queued frame which is not consumed yet
+        if index == self._heads[priority]:
+            self._advance(priority)
+            return
+        del self._queues[priority][index]
+        self._ready -= 1
@@ -0,0 +1,205 @@
+import adafruit_logging as logging
+import array
+import time
+
+logger = logging.getLogger(__name__)
+
+class LastValueCache:
+    """Latest payload of each received PGN per source address
+
+    Subscribe :meth:`update` to an ECU or CA, it keeps the last payload,
+    its timestamp and a change sequence number of every (PGN, source
+    address). Readers such as telemetry bridges take :meth:`snapshot`
+    at their own rate, only what changed since their last one.
+
+    The payloads are stored in one preallocated bytearray with a slot of
+    ``slot_size`` bytes per entry, longer ones (transport protocol) are
+    kept as separate bytes objects. A payload equal to the stored one
+    (byte compare) only refreshes the timestamp, it is not a change.
+    When all entries are in use the one not updated the longest is
+    replaced.
+
+    :param int max_entries: number of (PGN, source address) entries
+    :param int slot_size: bytes stored in place per entry, up to 255
+    :param clock: callable returning the current time in seconds, the clock
+        of the timestamps of the messages, ``time.monotonic`` by default
+
+    Example usage:
+
+    .. code-block:: python
+
+        cache = LastValueCache(max_entries=128)
+        ecu.subscribe(cache.update)
+        ...
+        sequence, entries = cache.snapshot(last_sequence)
+        for pgn, sa, timestamp, data in entries:
+            ...
+        last_sequence = sequence
+    """
+
+    def __init__(self, max_entries=256, slot_size=8, clock=None):
+        if slot_size > 255:
+            raise ValueError("slot_size must not exceed 255")
+        self.max_entries = max_entries
+        self.slot_size = slot_size
+        self.clock = clock or time.monotonic
+        self._data = bytearray(max_entries * slot_size)
+        self._length = bytearray(max_entries)
+        self._sequences = array.array('L', [0] * max_entries)
+        self._timestamps = [0.0] * max_entries
+        # slot -> key (pgn << 8 | sa), None if free
+        self._keys = [None] * max_entries
+        self._index = {}
+        self._free = list(range(max_entries - 1, -1, -1))
+        # slot -> payload longer than slot_size
+        self._overflow = {}
+        self._sequence = 0
+        self._updates = 0
+        self._evicted = 0
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        pgn, sa = key
+        return ((pgn << 8) | sa) in self._index
+
+    @property
+    def sequence(self):
+        """Sequence number of the latest change, 0 before the first one"""
+        return self._sequence
+
+    @property
+    def stats(self):
+        """Cache statistics.
+
+        :rtype: dict: 'entries', 'updates', 'changes', 'evicted'
+        """
+        return {
+            'entries': len(self._index),
+            'updates': self._updates,
+            'changes': self._sequence,
+            'evicted': self._evicted,
+        }
+
+    def update(self, priority, pgn, sa, timestamp, data):
+        """Stores a received message, the signature of a subscriber"""
+        key = (pgn << 8) | sa
+        slot = self._index.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+        self._updates += 1
+        self._timestamps[slot] = timestamp
+        length = len(data)
+        if length > self.slot_size:
+            if self._sequences[slot] and self._overflow.get(slot) == data:
+                return
+            self._overflow[slot] = bytes(data)
+        else:
+            start = slot * self.slot_size
+            if slot in self._overflow:
+                del self._overflow[slot]
+            elif self._sequences[slot] and self._length[slot] == length and self._data[start:start + length] == data:
+                return
+            self._data[start:start + length] = bytes(data)
+            self._length[slot] = length
+        self._sequence += 1
+        self._sequences[slot] = self._sequence
+
+    def _allocate(self, key):
+        if self._free:
+            slot = self._free.pop()
+        else:
+            # replace the entry not updated the longest
+            timestamps = self._timestamps
+            slot = 0
+            for index in range(1, self.max_entries):
+                if timestamps[index] < timestamps[slot]:
+                    slot = index
+            del self._index[self._keys[slot]]
+            self._overflow.pop(slot, None)
+            self._evicted += 1
+        self._keys[slot] = key
+        self._index[key] = slot
+        self._length[slot] = 0
+        self._sequences[slot] = 0
+        return slot
+
+    def remove(self, pgn, sa):
+        """Drops the entry of the PGN and source address, False if there is none"""
+        slot = self._index.pop((pgn << 8) | sa, None)
+        if slot is None:
+            return False
+        self._keys[slot] = None
+        self._overflow.pop(slot, None)
+        self._free.append(slot)
+        return True
+
+    def clear(self):
+        """Drops all entries, the sequence numbers continue"""
+        self._keys = [None] * self.max_entries
+        self._index = {}
+        self._free = list(range(self.max_entries - 1, -1, -1))
+        self._overflow = {}
+
+    def _payload(self, slot):
+        if slot in self._overflow:
+            return self._overflow[slot]
+        start = slot * self.slot_size
+        return bytes(self._data[start:start + self._length[slot]])
+
+    def get(self, pgn, sa):
+        """Returns the last payload of the PGN from the source address, None if there is none"""
+        slot = self._index.get((pgn << 8) | sa)
+        if slot is None:
+            return None
+        return self._payload(slot)
+
+    def timestamp(self, pgn, sa):
+        """Returns the time the PGN was last received from the source address, None if never"""
+        slot = self._index.get((pgn << 8) | sa)
+        if slot is None:
+            return None
+        return self._timestamps[slot]
+
+    def changed(self, pgn, sa, since):
+        """True if the payload changed after the sequence number ``since``"""
+        slot = self._index.get((pgn << 8) | sa)
+        return slot is not None and self._sequences[slot] > since
+
+    def changed_since(self, since):
+        """Returns the (pgn, sa) of the entries changed after the sequence number ``since``"""
+        sequences = self._sequences
+        return [(key >> 8, key & 0xFF) for key, slot in self._index.items() if sequences[slot] > since]
+
+    def stale(self, max_age, now=None):
+        """Returns the (pgn, sa) of the entries not received for more than max_age seconds"""
+        if now is None:
+            now = self.clock()
+        limit = now - max_age
+        timestamps = self._timestamps
+        return [(key >> 8, key & 0xFF) for key, slot in self._index.items() if timestamps[slot] < limit]
+
+    def purge(self, max_age, now=None):
+        """Drops the stale entries
+
+        :return: the (pgn, sa) dropped
+        """
+        stale = self.stale(max_age, now)
+        for pgn, sa in stale:
+            self.remove(pgn, sa)
+        return stale
+
+    def snapshot(self, since=0):
+        """Returns the entries changed after the sequence number ``since``
+
+        :return: ``(sequence, entries)``, pass ``sequence`` as ``since`` to the
+            next snapshot, entries are ``(pgn, sa, timestamp, data)``
+        """
+        sequences = self._sequences
+        timestamps = self._timestamps
+        entries = []
+        for key, slot in self._index.items():
+            if sequences[slot] > since:
+                entries.append((key >> 8, key & 0xFF, timestamps[slot], self._payload(slot)))
+        return self._sequence, entries
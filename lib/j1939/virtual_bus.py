@@ -0,0 +1,246 @@
+import time
+import random
+from .acceptance_filter import accepts
+from . import log
+
+_log = log.get("virtual_bus")
+
+class SimulatedClock:
+    """Clock for a :class:`VirtualBus` which only moves when told to.
+
+    Lets a simulation run faster (or slower) than real time and makes it
+    reproducible.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        """Moves the clock forward."""
+        self.now += seconds
+        return self.now
+
+
+class VirtualBusNode:
+    """Connection of one :class:`j1939.can.CanBus` to a :class:`VirtualBus`.
+
+    Used as CanBus backend, created by :meth:`VirtualBus.attach`.
+    """
+
+    def __init__(self, bus, rx_buffers=None, loopback=False, filter_slots=None):
+        self._bus = bus
+        # the received frames are stamped with the bus clock
+        self.clock = bus.clock
+        self._rx_buffers = rx_buffers
+        self.loopback = loopback
+        self.filter_slots = filter_slots
+        self._filters = None
+        self._rx = []
+        self._overflows = 0
+        self.filtered = 0
+
+    def _receive(self, can_id, data, timestamp):
+        if self._filters is not None and not accepts(self._filters, can_id):
+            self.filtered += 1
+            return
+        if self._rx_buffers is not None and len(self._rx) >= self._rx_buffers:
+            self._overflows += 1
+            return
+        self._rx.append((can_id, data, timestamp))
+
+    def drain(self, ring):
+        self._bus.process()
+        received = len(self._rx)
+        for can_id, data, timestamp in self._rx:
+            ring.put(can_id, data, timestamp)
+        self._rx = []
+        return received
+
+    def overflows(self):
+        count = self._overflows
+        self._overflows = 0
+        return count
+
+    def set_filters(self, filters):
+        self._filters = filters
+
+    def send(self, can_id, data, extended_id):
+        self._bus.transmit(self, can_id, data, extended_id)
+
+    def deinit(self):
+        self._bus.detach(self)
+
+
+class VirtualBus:
+    """In-process CAN bus, connecting any number of ECUs on a host.
+
+    Frames are transmitted one at a time. When the bus gets idle, the
+    pending frame with the lowest CAN-ID wins the arbitration, like on a
+    real bus. The bus is busy for the time the frame takes at the
+    configured bitrate (worst case bit stuffing), afterwards the frame is
+    delivered to all other nodes.
+
+    :param int bitrate:
+        Nominal bitrate in bit/s.
+    :param int data_bitrate:
+        Bitrate of the data phase of CAN FD frames (more than 8 bytes), in bit/s.
+        Defaults to the nominal bitrate.
+    :param clock:
+        Callable returning the current time in seconds, ``time.monotonic``
+        by default, or a :class:`SimulatedClock`.
+    :param float drop_rate:
+        Fraction (0..1) of the frames lost for all receivers.
+    :param float delay:
+        Extra latency in seconds added to the delivery of every frame.
+    :param float jitter:
+        Random extra latency, 0..jitter seconds, added on top of delay.
+
+    Example usage:
+
+    .. code-block:: python
+
+        bus = VirtualBus(bitrate=250000)
+        ecu1.connect(bus_type='virtual', bus=bus)
+        ecu2.connect(bus_type='virtual', bus=bus)
+    """
+
+    # bits of an extended data frame without payload, SOF .. interframe space
+    _FRAME_OVERHEAD_BITS = 67
+    # bits of the overhead subject to bit stuffing
+    _STUFFED_OVERHEAD_BITS = 54
+
+    def __init__(self, bitrate=250000, data_bitrate=None, clock=None, drop_rate=0.0, delay=0.0, jitter=0.0):
+        _log.refresh()
+        self.bitrate = bitrate
+        self.data_bitrate = data_bitrate or bitrate
+        self.clock = clock or time.monotonic
+        self.drop_rate = drop_rate
+        self.delay = delay
+        self.jitter = jitter
+        # optional drop_filter(can_id, data) -> True drops the frame
+        self.drop_filter = None
+        self._nodes = []
+        # frames waiting for arbitration: [can_id, seq, queued_at, node, data]
+        self._pending = []
+        # frames on the wire or delayed: [deliver_at, seq, node, can_id, data]
+        self._in_flight = []
+        self._seq = 0
+        self._idle_at = self.clock()
+        self._frames = 0
+        self._dropped = 0
+        self._busy_time = 0.0
+        self._max_pending = 0
+        self._started = self._idle_at
+
+    def attach(self, rx_buffers=None, loopback=False, filter_slots=None, **kwargs):
+        """Connects a new node to the bus
+
+        :param int rx_buffers:
+            Receive buffers of the node, frames arriving while all are
+            occupied are lost (2 emulates a MCP2515). None is unlimited.
+        :param bool loopback:
+            Deliver the frames sent by the node to itself too.
+        :param tuple filter_slots:
+            Acceptance filters per mask to emulate, (2, 4) for a MCP2515,
+            None for no limit.
+        :return:
+            A :class:`VirtualBusNode`, to be used as CanBus backend.
+        """
+        node = VirtualBusNode(self, rx_buffers, loopback, filter_slots)
+        self._nodes.append(node)
+        return node
+
+    def detach(self, node):
+        """Disconnects a node, its pending frames are discarded."""
+        if node in self._nodes:
+            self._nodes.remove(node)
+        self._pending = [frame for frame in self._pending if frame[3] is not node]
+
+    @property
+    def stats(self):
+        """Bus statistics.
+
+        :rtype: dict: 'frames' (transmitted), 'dropped', 'pending', 'max_pending',
+            'busload' (0..1, since construction)
+        """
+        elapsed = self.clock() - self._started
+        return {
+            'frames': self._frames,
+            'dropped': self._dropped,
+            'pending': len(self._pending),
+            'max_pending': self._max_pending,
+            'busload': self._busy_time / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def frame_time(self, length):
+        """Returns the time in seconds an extended frame with length data bytes occupies the bus."""
+        data_bits = 8 * length
+        stuff_bits = (self._STUFFED_OVERHEAD_BITS + data_bits - 1) // 4
+        if length <= 8:
+            return (self._FRAME_OVERHEAD_BITS + data_bits + stuff_bits) / self.bitrate
+        # CAN FD: arbitration at the nominal rate, data phase (and crc) at the data rate
+        return self._FRAME_OVERHEAD_BITS / self.bitrate + (data_bits + stuff_bits) / self.data_bitrate
+
+    def transmit(self, node, can_id, data, extended_id=True):
+        """Queues a frame of the node for arbitration."""
+        self._seq += 1
+        self._pending.append([can_id, self._seq, self.clock(), node, bytes(data)])
+        if len(self._pending) > self._max_pending:
+            self._max_pending = len(self._pending)
+
+    def process(self):
+        """Runs the arbitration and delivers all frames complete by now.
+
+        Called by the nodes when their CanBus is read, so there is no need
+        to call it directly.
+        """
+        now = self.clock()
+        pending = self._pending
+        while pending:
+            # the bus gets idle, or the first frame is queued on an idle bus
+            start = self._idle_at
+            first = min(frame[2] for frame in pending)
+            if first > start:
+                start = first
+            if start > now:
+                break
+            # arbitration: lowest CAN-ID among the frames ready at start wins
+            winner = None
+            for frame in pending:
+                if frame[2] <= start and (winner is None or frame[0] < winner[0] or (frame[0] == winner[0] and frame[1] < winner[1])):
+                    winner = frame
+            duration = self.frame_time(len(winner[4]))
+            end = start + duration
+            if end > now:
+                break
+            pending.remove(winner)
+            self._idle_at = end
+            self._busy_time += duration
+            self._frames += 1
+            can_id, seq, _queued_at, node, data = winner
+            if random.random() < self.drop_rate or (self.drop_filter is not None and self.drop_filter(can_id, data)):
+                self._dropped += 1
+                if _log.debug_enabled:
+                    _log.debug("drop can_id {0:08X}", can_id)
+                continue
+            deliver_at = end + self.delay
+            if self.jitter:
+                deliver_at += random.random() * self.jitter
+            self._in_flight.append([deliver_at, seq, node, can_id, data])
+
+        if self._in_flight:
+            # frames overtaking each other (jitter) are delivered in time order
+            self._in_flight.sort()
+            count = 0
+            for deliver_at, _seq, sender, can_id, data in self._in_flight:
+                if deliver_at > now:
+                    break
+                for node in self._nodes:
+                    if node is not sender or node.loopback:
+                        node._receive(can_id, data, deliver_at)
+                count += 1
+            if count:
+                del self._in_flight[:count]
@@ -80,6 +80,11 @@ class TData_MQTT_Gateway:
         self._client.on_unsubscribe = self._on_unsubscribe_mqtt
         self._connected = False
 
+        # Session table: device name -> time of last activity
+        self._devices = {}
+        self._rpc_requested = False
+        self._rpc_subscribed = False
+
     def __enter__(self):
         return self
 
@@ -122,6 +127,11 @@ class TData_MQTT_Gateway:
             self._connected = True
         else:
             raise TData_MQTTError(return_code)
+        # Restore the server-side state of the session
+        self._rpc_subscribed = False
+        if self._rpc_requested:
+            self.subscribe_to_rpcs()
+        self.reannounce_devices()
         # Call the user-defined on_connect callback if defined
         if self.on_connect is not None:
             self.on_connect(self)
@@ -130,6 +140,7 @@ class TData_MQTT_Gateway:
     def _on_disconnect_mqtt(self, client, userdata, return_code):
         """Runs when the client calls on_disconnect."""
         self._connected = False
+        self._rpc_subscribed = False
         # Call the user-defined on_disconnect callblack if defined
         if self.on_disconnect is not None:
             self.on_disconnect(self)
@@ -146,6 +157,9 @@ class TData_MQTT_Gateway:
         topic_tokens = topic.split("/")
         payload_object = json.loads(payload)
         
+        if topic_tokens[2] == "rpc" and payload_object.get('device') in self._devices:
+            self._devices[payload_object['device']] = time.monotonic()
+
         if self.on_rpc is not None and topic_tokens[2] == "rpc":
             self.on_rpc(self, payload_object['device'], payload_object['data']['id'], payload_object['data']['method'], payload_object['data']['params'])
             
@@ -182,17 +196,23 @@ class TData_MQTT_Gateway:
     def device_connect(
         self,
         device_name: str = None,
+        force: bool = False,
     ):
         """Device Connect API
         Once received, T>Data will lookup or create a device with the name specified.
         Also, T>Data will publish messages about new attribute updates and RPC commands
         for a particular device to this Gateway
+
+        The device is recorded in the session table, connecting an already
+        connected device is a no-op unless force is set.
         """
-        if device_name is not None:
+        if device_name is None:
+            raise TData_MQTTError("Must provide a device_name.")
+        connected = device_name in self._devices
+        self._devices[device_name] = time.monotonic()
+        if force or not connected:
             data = { "device": device_name }
             self._client.publish("v1/gateway/connect", json.dumps(data))
-        else:
-            raise TData_MQTTError("Must provide a device_name.")
     
     def device_disconnect(
         self,
@@ -203,11 +223,43 @@ class TData_MQTT_Gateway:
         to this Gateway.
         """
         if device_name is not None:
+            self._devices.pop(device_name, None)
             data = { "device": device_name }
             self._client.publish("v1/gateway/disconnect", json.dumps(data))
         else:
             raise TData_MQTTError("Must provide a device_name.")
 
+    @property
+    def connected_devices(self):
+        """Names of the devices in the session table."""
+        return list(self._devices)
+
+    def is_device_connected(self, device_name: str):
+        """Returns if the device is in the session table."""
+        return device_name in self._devices
+
+    def reannounce_devices(self):
+        """Device Connect API
+        Sends a connect for every device in the session table, e.g. after a
+        reconnect to the TData MQTT Broker. Runs automatically on connect.
+        """
+        for device_name in self._devices:
+            data = { "device": device_name }
+            self._client.publish("v1/gateway/connect", json.dumps(data))
+
+    def expire_devices(self, max_idle: float):
+        """Disconnects the devices without activity (connect, publish, RPC)
+        for more than max_idle seconds.
+
+        :param float max_idle: Maximum idle time, in seconds.
+        :return: The names of the expired devices.
+        """
+        deadline = time.monotonic() - max_idle
+        expired = [name for name, last in self._devices.items() if last < deadline]
+        for device_name in expired:
+            self.device_disconnect(device_name)
+        return expired
+
                 
     def publish(
         self,
@@ -218,6 +270,11 @@ class TData_MQTT_Gateway:
         Publishes telemetry / attributes to T>Data.
         """
         self._client.publish("v1/gateway/{0}".format(publish_type), json.dumps(data))
+        if isinstance(data, dict):
+            now = time.monotonic()
+            for device_name in data:
+                if device_name in self._devices:
+                    self._devices[device_name] = now
         
     def subscribe_to_rpcs(
         self
@@ -228,7 +285,10 @@ class TData_MQTT_Gateway:
         :param str device: Device name.
 
         """
-        self._client.subscribe("v1/gateway/rpc")
+        self._rpc_requested = True
+        if not self._rpc_subscribed:
+            self._client.subscribe("v1/gateway/rpc")
+            self._rpc_subscribed = True
                 
     def rpc_response(
         self,
@@ -244,7 +304,6 @@ class TData_MQTT_Gateway:
         :param dict data: RPC response.
 
         """
-        self._client.subscribe("v1/gateway/rpc")
         data = { "device": device_name, "id": rpc_id, "data": data }
         self._client.publish("v1/gateway/rpc", json.dumps(data))
         
@@ -289,6 +348,9 @@ class TData_MQTT:
         self._client.on_unsubscribe = self._on_unsubscribe_mqtt
         self._connected = False
 
+        # Optional compact telemetry encoding (tdata.tdata_compact.TData_CompactEncoder)
+        self.compact_encoder = None
+
     def __enter__(self):
         return self
 
@@ -395,7 +457,18 @@ class TData_MQTT:
     ):
         """Telemetry upload / Attributes API 
         Publishes telemetry / attributes to T>Data.
+
+        With a compact_encoder set, telemetry is sent in the compact binary
+        format to v1/devices/me/telemetry/compact, preceded by the key table
+        (as attributes) whenever new keys show up, until both were published.
         """
+        if self.compact_encoder is not None and publish_type == "telemetry":
+            payload = self.compact_encoder.encode(data)
+            if self.compact_encoder.dirty:
+                self._client.publish("v1/devices/me/attributes", json.dumps(self.compact_encoder.key_table()))
+            self._client.publish("v1/devices/me/telemetry/compact", payload)
+            self.compact_encoder.mark_sent()
+            return
         self._client.publish("v1/devices/me/{}".format(publish_type), json.dumps(data))
 
     def subscribe_to_rpcs(
@@ -0,0 +1,298 @@
+# SPDX-FileCopyrightText: 2023 Luis Pichio for TwinDimension
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`tdata_asyncio`
+================================================================================
+
+Asyncio front-end for the TData MQTT clients.
+
+The blocking :meth:`TData_MQTT.loop` call is replaced by a set of tasks
+(reader, sender, keepalive and reconnect) so that TData can share one
+event loop with the Modbus and J1939 engines.
+
+* Author(s): Luis Pichio for TwinDimension
+
+
+Implementation Notes
+--------------------
+
+The MiniMQTT socket is still read synchronously, so the MiniMQTT client
+should be created with a short ``socket_timeout`` (e.g. 0.05 s): this is
+the longest time the reader task will hold the event loop. The reader
+reads one packet at a time instead of calling MiniMQTT's ``loop``, whose
+keep alive ping waits for the PINGRESP: the keepalive task only sends the
+PINGREQ, the reader receives the PINGRESP and takes the connection as
+lost if it does not arrive within half the keep alive period. A reconnect
+is a single attempt, bounded by ``socket_timeout`` for the socket connect
+and ``connect_timeout`` for the broker's answer, the backoff between two
+attempts is slept on the event loop.
+"""
+import time
+import asyncio
+
+from adafruit_minimqtt.adafruit_minimqtt import MMQTTException
+from tdata.tdata_errors import TData_MQTTError
+from tdata.tdata_supervisor import Backoff
+
+_MQTT_PINGREQ = b"\xc0\x00"
+_MQTT_PINGRESP = 0xD0
+
+
+class _SendItem:
+    """One entry of the send queue."""
+
+    def __init__(self, method, args):
+        self.method = method
+        self.args = args
+        self.done = asyncio.Event()
+        self.error = None
+
+
+class TData_MQTT_Async:
+    """
+    Asyncio wrapper for :class:`tdata.tdata.TData_MQTT` and
+    :class:`tdata.tdata.TData_MQTT_Gateway`.
+
+    :param tdata: TData_MQTT or TData_MQTT_Gateway object.
+    :param int queue_size: Maximum number of pending publishes.
+    :param float poll_interval: Pause between two socket reads, in seconds.
+    :param Backoff backoff: Reconnect policy, defaults to 1 s .. 60 s with 50 % jitter.
+    :param float connect_timeout: Longest wait for the broker's answer to a reconnect, in seconds.
+
+    Only transport errors (MMQTTException, OSError) take the connection down.
+    An exception raised while handling a received message, e.g. in an
+    ``on_message`` or ``on_rpc`` callback, is passed to :attr:`on_error`,
+    called as ``on_error(tdata_async, exception)``, printed if it is None.
+    """
+
+    def __init__(self, tdata, queue_size=32, poll_interval=0.01, backoff=None, connect_timeout=1.0):
+        self._tdata = tdata
+        self._client = tdata._client  # pylint: disable=protected-access
+        self._queue_size = queue_size
+        self._poll_interval = poll_interval
+        self._backoff = backoff if backoff is not None else Backoff()
+        self._connect_timeout = connect_timeout
+        self._subscriptions = []
+
+        self._send_queue = []
+        self._send_event = asyncio.Event()
+        self._connected_event = asyncio.Event()
+        self._disconnected_event = asyncio.Event()
+        self._tasks = []
+        self._last_activity = time.monotonic()
+        # time the PINGREQ waiting for its PINGRESP was sent
+        self._ping_sent = None
+
+        self.on_error = None
+
+    @property
+    def tdata(self):
+        """The wrapped TData client."""
+        return self._tdata
+
+    @property
+    def is_connected(self):
+        """Returns if connected to TData MQTT Broker."""
+        return self._connected_event.is_set()
+
+    @property
+    def pending(self):
+        """Number of publishes waiting in the send queue."""
+        return len(self._send_queue)
+
+    def _set_connected(self, connected):
+        if connected:
+            self._ping_sent = None
+            self._disconnected_event.clear()
+            self._connected_event.set()
+            # wake up the sender, there may be queued messages
+            self._send_event.set()
+        else:
+            self._connected_event.clear()
+            self._disconnected_event.set()
+
+    async def connect(self):
+        """Connects to the TData MQTT Broker and starts the background tasks."""
+        self._tdata.connect()
+        self._set_connected(True)
+        self.start()
+
+    def start(self):
+        """Starts the reader, sender, keepalive and reconnect tasks."""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._reader()),
+            asyncio.create_task(self._sender()),
+            asyncio.create_task(self._keepalive()),
+            asyncio.create_task(self._reconnector()),
+        ]
+
+    def stop(self):
+        """Cancels the background tasks."""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def disconnect(self):
+        """Stops the background tasks and disconnects from TData MQTT Broker.
+        Publishes still waiting in the send queue fail with TData_MQTTError.
+        """
+        self.stop()
+        for item in self._send_queue:
+            item.error = TData_MQTTError("Disconnected.")
+            item.done.set()
+        self._send_queue = []
+        self._tdata.disconnect()
+        self._set_connected(False)
+
+    async def wait_connected(self):
+        """Waits until the client is connected."""
+        await self._connected_event.wait()
+
+    def _enqueue(self, method, args):
+        if len(self._send_queue) >= self._queue_size:
+            raise TData_MQTTError("Send queue full.")
+        item = _SendItem(method, args)
+        self._send_queue.append(item)
+        self._send_event.set()
+        return item
+
+    async def _submit(self, method, args):
+        item = self._enqueue(method, args)
+        await item.done.wait()
+        if item.error is not None:
+            raise TData_MQTTError("Unable to publish to TData.") from item.error
+
+    def publish_nowait(self, publish_type="telemetry", data=None):
+        """Queues a telemetry / attributes upload without waiting for it."""
+        self._enqueue(self._tdata.publish, (publish_type, data))
+
+    async def publish(self, publish_type="telemetry", data=None):
+        """Telemetry upload / Attributes API
+        Queues the message and waits until it was written to the broker.
+        """
+        await self._submit(self._tdata.publish, (publish_type, data))
+
+    async def rpc_response(self, *args):
+        """RPC API
+        RPC response, arguments are the ones of the wrapped client
+        (``request_id, data`` for devices, ``device_name, rpc_id, data`` for gateways).
+        """
+        await self._submit(self._tdata.rpc_response, args)
+
+    async def subscribe_to_rpcs(self):
+        """RPC API
+        Server-side RPC.
+        """
+        if self._tdata.subscribe_to_rpcs not in self._subscriptions:
+            self._subscriptions.append(self._tdata.subscribe_to_rpcs)
+        await self._submit(self._tdata.subscribe_to_rpcs, ())
+
+    def _connection_lost(self):
+        if self._connected_event.is_set():
+            self._set_connected(False)
+
+    def _callback_error(self, err):
+        if self.on_error is not None:
+            self.on_error(self, err)
+        else:
+            print("TData message handling failed: {0!r}".format(err))
+
+    async def _reader(self):
+        client = self._client
+        ping_timeout = client.keep_alive / 2
+        while True:
+            await self._connected_event.wait()
+            try:
+                # one packet, waiting at most the socket timeout for it
+                packet_type = client._wait_for_msg()  # pylint: disable=protected-access
+            except (MMQTTException, OSError):
+                self._connection_lost()
+                continue
+            except Exception as err:  # pylint: disable=broad-except
+                # raised by a callback or the parsing of the message, the link is fine
+                self._callback_error(err)
+                packet_type = None
+            if packet_type == _MQTT_PINGRESP:
+                self._ping_sent = None
+            elif self._ping_sent is not None and time.monotonic() - self._ping_sent > ping_timeout:
+                # the broker does not answer, a half-open connection
+                self._connection_lost()
+                continue
+            if packet_type is None:
+                await asyncio.sleep(self._poll_interval)
+            else:
+                # more packets may be waiting
+                await asyncio.sleep(0)
+
+    async def _sender(self):
+        while True:
+            await self._send_event.wait()
+            self._send_event.clear()
+            while self._send_queue and self._connected_event.is_set():
+                item = self._send_queue[0]
+                try:
+                    item.method(*item.args)
+                except Exception as err:  # pylint: disable=broad-except
+                    if not self._tdata.is_connected:
+                        # keep the message, it is sent after reconnect
+                        self._connection_lost()
+                        break
+                    item.error = err
+                self._send_queue.pop(0)
+                self._last_activity = time.monotonic()
+                item.done.set()
+                # give the other tasks a chance between two messages
+                await asyncio.sleep(0)
+
+    async def _keepalive(self):
+        keep_alive = self._client.keep_alive
+        while True:
+            await self._connected_event.wait()
+            idle = time.monotonic() - self._last_activity
+            if idle >= keep_alive / 2:
+                if self._ping_sent is None:
+                    try:
+                        # the PINGRESP is received by the reader
+                        self._client._sock.send(_MQTT_PINGREQ)  # pylint: disable=protected-access
+                    except Exception:  # pylint: disable=broad-except
+                        self._connection_lost()
+                        continue
+                    self._ping_sent = time.monotonic()
+                self._last_activity = time.monotonic()
+                continue
+            await asyncio.sleep(keep_alive / 2 - idle)
+
+    def _reconnect_once(self):
+        # MiniMQTT retries a failed connect itself, sleeping in between,
+        # one attempt with a short wait for the CONNACK keeps the loop free
+        # pylint: disable=protected-access
+        client = self._client
+        attempts, recv_timeout = client._reconnect_attempts_max, client._recv_timeout
+        client._reconnect_attempts_max = 1
+        # a backoff left from failed attempts would be slept before connecting
+        client._reconnect_attempt = 0
+        # MiniMQTT needs the receive timeout above the socket timeout
+        client._recv_timeout = max(self._connect_timeout, 2 * client._socket_timeout)
+        try:
+            self._tdata.reconnect()
+        finally:
+            client._reconnect_attempts_max, client._recv_timeout = attempts, recv_timeout
+
+    async def _reconnector(self):
+        while True:
+            await self._disconnected_event.wait()
+            try:
+                self._reconnect_once()
+                # subscriptions first, the sender replays the queue afterwards
+                for subscribe in self._subscriptions:
+                    subscribe()
+            except Exception:  # pylint: disable=broad-except
+                await asyncio.sleep(self._backoff.next())
+                continue
+            self._backoff.reset()
+            self._last_activity = time.monotonic()
+            self._set_connected(True)
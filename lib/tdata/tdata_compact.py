@@ -0,0 +1,201 @@
+# SPDX-FileCopyrightText: 2023 Luis Pichio for TwinDimension
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`tdata_compact`
+================================================================================
+
+Compact binary wire format for TData telemetry.
+
+Keys are replaced by a one byte index into a key table which is sent once
+(as an attribute) and only again when new keys show up. Values are packed
+with typed struct codes.
+
+* Author(s): Luis Pichio for TwinDimension
+
+
+Implementation Notes
+--------------------
+
+Payload layout (little endian)::
+
+    u8 version | u8 key table size | u16 record count
+    record:  u8 entry count | entries
+    entry:   u8 key index | u8 type code | packed value
+
+The ``ts`` of a record is sent as an entry with key index ``TS_KEY``.
+Type codes are the struct format characters ``b h i q f d`` plus
+``?`` (bool, one byte), ``s`` (u8 length + utf-8) and ``n`` (null).
+Dict and list values are not supported, ints must fit in an int64.
+"""
+import struct
+
+from tdata.tdata_errors import TData_MQTTError
+
+FORMAT_VERSION = 1
+TS_KEY = 0xFF
+MAX_KEYS = 0xFF
+# attribute carrying the key table
+KEY_TABLE_ATTRIBUTE = "compact.keys"
+
+_INT_FORMATS = (
+    (-0x80, 0x7F, "b"),
+    (-0x8000, 0x7FFF, "h"),
+    (-0x80000000, 0x7FFFFFFF, "i"),
+)
+
+
+class TData_CompactEncoder:
+    """
+    Encodes telemetry dicts to the compact wire format.
+
+    :param str float_format: "f" (float32, default) or "d" (float64).
+    """
+
+    def __init__(self, float_format="f"):
+        if float_format not in ("f", "d"):
+            raise ValueError("float_format must be 'f' or 'd'")
+        self._float_format = float_format
+        self._keys = []
+        self._index = {}
+        self._dirty = False
+
+    @property
+    def keys(self):
+        """The key table, position is the key index."""
+        return self._keys
+
+    @property
+    def dirty(self):
+        """True if the key table changed since the last call of mark_sent()."""
+        return self._dirty
+
+    def key_table(self):
+        """Returns the key table as attribute dict."""
+        return {KEY_TABLE_ATTRIBUTE: list(self._keys)}
+
+    def mark_sent(self):
+        """Marks the key table as sent, call it once the key table and the
+        payload using it were published."""
+        self._dirty = False
+
+    def _key_index(self, key):
+        index = self._index.get(key)
+        if index is None:
+            index = len(self._keys)
+            if index >= MAX_KEYS:
+                raise TData_MQTTError("Compact key table full.")
+            self._keys.append(key)
+            self._index[key] = index
+            self._dirty = True
+        return index
+
+    def _pack_value(self, parts, index, value):
+        if value is None:
+            parts.append(struct.pack("<BB", index, ord("n")))
+        elif isinstance(value, bool):
+            parts.append(struct.pack("<BBB", index, ord("?"), 1 if value else 0))
+        elif isinstance(value, int):
+            fmt = "q"
+            for low, high, int_fmt in _INT_FORMATS:
+                if low <= value <= high:
+                    fmt = int_fmt
+                    break
+            else:
+                if not -0x8000000000000000 <= value <= 0x7FFFFFFFFFFFFFFF:
+                    raise TData_MQTTError("Compact int value out of the int64 range.")
+            parts.append(struct.pack("<BB" + fmt, index, ord(fmt), value))
+        elif isinstance(value, float):
+            fmt = self._float_format
+            parts.append(struct.pack("<BB" + fmt, index, ord(fmt), value))
+        elif isinstance(value, (dict, list, tuple)):
+            # a repr is no value the server can decode
+            raise TData_MQTTError("Compact values can not be a dict or a list.")
+        else:
+            raw = str(value).encode("utf-8")
+            if len(raw) > 0xFF:
+                raise TData_MQTTError("Compact string value too long.")
+            parts.append(struct.pack("<BBB", index, ord("s"), len(raw)))
+            parts.append(raw)
+
+    def _pack_record(self, parts, record):
+        has_ts = "ts" in record and "values" in record
+        values = record["values"] if has_ts else record
+        count = len(values) + 1 if has_ts else len(values)
+        if count > 0xFF:
+            raise TData_MQTTError("Too many values in a compact record.")
+        parts.append(struct.pack("<B", count))
+        if has_ts:
+            parts.append(struct.pack("<BBq", TS_KEY, ord("q"), record["ts"]))
+        for key, value in values.items():
+            self._pack_value(parts, self._key_index(key), value)
+
+    def encode(self, data):
+        """Encodes telemetry.
+
+        :param data: dict, ``{"ts": ..., "values": {...}}`` or a list of those.
+        :return: The compact payload.
+        :rtype: bytes
+        """
+        records = data if isinstance(data, list) else [data]
+        if len(records) > 0xFFFF:
+            raise TData_MQTTError("Too many compact records.")
+        parts = []
+        for record in records:
+            self._pack_record(parts, record)
+        header = struct.pack("<BBH", FORMAT_VERSION, len(self._keys), len(records))
+        return header + b"".join(parts)
+
+
+class TData_CompactDecoder:
+    """
+    Reference decoder for the compact wire format (server side / tests).
+    """
+
+    def __init__(self):
+        self._keys = []
+
+    def load_key_table(self, attributes):
+        """Loads the key table from the attribute dict sent by the encoder."""
+        self._keys = list(attributes[KEY_TABLE_ATTRIBUTE])
+
+    def decode(self, payload):
+        """Decodes a compact payload.
+
+        :return: A dict or ``{"ts": ..., "values": {...}}`` for a single record,
+            a list of those otherwise.
+        """
+        version, key_count, record_count = struct.unpack_from("<BBH", payload, 0)
+        if version != FORMAT_VERSION:
+            raise TData_MQTTError("Unsupported compact format {0}.".format(version))
+        if key_count > len(self._keys):
+            raise TData_MQTTError("Compact key table out of date.")
+        offset = 4
+        records = []
+        for _ in range(record_count):
+            entry_count = payload[offset]
+            offset += 1
+            ts = None
+            values = {}
+            for _ in range(entry_count):
+                index, type_code = payload[offset], chr(payload[offset + 1])
+                offset += 2
+                if type_code == "n":
+                    value = None
+                elif type_code == "?":
+                    value = payload[offset] != 0
+                    offset += 1
+                elif type_code == "s":
+                    length = payload[offset]
+                    value = bytes(payload[offset + 1:offset + 1 + length]).decode("utf-8")
+                    offset += 1 + length
+                else:
+                    value = struct.unpack_from("<" + type_code, payload, offset)[0]
+                    offset += struct.calcsize(type_code)
+                if index == TS_KEY:
+                    ts = value
+                else:
+                    values[self._keys[index]] = value
+            records.append(values if ts is None else {"ts": ts, "values": values})
+        return records[0] if record_count == 1 else records
@@ -0,0 +1,205 @@
+# SPDX-FileCopyrightText: 2023 Luis Pichio for TwinDimension
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`tdata_fake_broker`
+================================================================================
+
+In-process MQTT broker and MiniMQTT stand-in, to run the TData clients on
+a host without network or T>Data server.
+
+* Author(s): Luis Pichio for TwinDimension
+
+
+Implementation Notes
+--------------------
+
+:class:`FakeMQTT` offers the part of the MiniMQTT client API the TData
+clients use. Everything published is recorded by the :class:`FakeBroker`,
+messages for the clients are queued with :meth:`FakeBroker.deliver` and
+handed to ``on_message`` by the next ``loop``. Outages are simulated by
+setting :attr:`FakeBroker.up` to False: the connected clients lose their
+connection at their next operation and connects fail until it is set back.
+With :attr:`FakeBroker.silent` set, the connection is half-open: sends
+succeed, but nothing is received, neither messages nor PINGRESPs.
+"""
+from adafruit_minimqtt.adafruit_minimqtt import MMQTTException
+
+
+def _matches(subscription, topic):
+    # MQTT topic filter with the + and # wildcards
+    filter_tokens = subscription.split("/")
+    topic_tokens = topic.split("/")
+    for index, token in enumerate(filter_tokens):
+        if token == "#":
+            return True
+        if index >= len(topic_tokens) or token not in ("+", topic_tokens[index]):
+            return False
+    return len(filter_tokens) == len(topic_tokens)
+
+
+class FakeBroker:
+    """
+    In-process MQTT broker.
+
+    :attr:`published` lists the (topic, payload) pairs received from the
+    clients, :attr:`connects` counts the accepted connects.
+    """
+
+    def __init__(self):
+        self.up = True
+        self.silent = False
+        self.published = []
+        self.connects = 0
+        self._clients = []
+
+    def client(self, username="token", socket_timeout=0.01, keep_alive=60):
+        """Returns a new :class:`FakeMQTT` client of this broker."""
+        client = FakeMQTT(self, username, socket_timeout, keep_alive)
+        self._clients.append(client)
+        return client
+
+    def deliver(self, topic, payload):
+        """Queues a message for the clients subscribed to the topic.
+
+        :return: The number of clients the message was queued for.
+        """
+        count = 0
+        for client in self._clients:
+            if client.is_subscribed(topic):
+                client.inbox.append((topic, payload))
+                count += 1
+        return count
+
+
+class _FakeSocket:
+    # the socket of a FakeMQTT, for the packets sent directly (PINGREQ)
+
+    def __init__(self, client):
+        self._client = client
+
+    def send(self, data):
+        client = self._client
+        client._check()  # pylint: disable=protected-access
+        if bytes(data) == b"\xc0\x00":
+            client.pings += 1
+            client._pingresp = True  # pylint: disable=protected-access
+        return len(data)
+
+
+class FakeMQTT:
+    """
+    MiniMQTT client connected to a :class:`FakeBroker`, created by
+    :meth:`FakeBroker.client`.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+    def __init__(self, broker, username, socket_timeout, keep_alive):
+        self._broker = broker
+        self._username = username
+        self._socket_timeout = socket_timeout
+        self._recv_timeout = 10
+        self._reconnect_attempts_max = 5
+        self._reconnect_attempt = 0
+        self.keep_alive = keep_alive
+        self._connected = False
+        self.subscriptions = []
+        self.inbox = []
+        self.pings = 0
+        self._pingresp = False
+        self._sock = _FakeSocket(self)
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_subscribe = None
+        self.on_unsubscribe = None
+
+    def is_subscribed(self, topic):
+        """True if a subscription of the client matches the topic."""
+        for subscription in self.subscriptions:
+            if _matches(subscription, topic):
+                return True
+        return False
+
+    def _check(self):
+        if not self._connected:
+            raise MMQTTException("MiniMQTT is not connected")
+        if not self._broker.up:
+            # the connection broke, as noticed by a read or write on the socket
+            self._connected = False
+            raise MMQTTException("Connection lost")
+
+    def connect(self, clean_session=True):
+        """Connects in a single attempt, raises OSError while the broker is down."""
+        if not self._broker.up:
+            raise OSError("Connection refused")
+        self._connected = True
+        self._pingresp = False
+        self._broker.connects += 1
+        if clean_session:
+            self.subscriptions = []
+        if self.on_connect is not None:
+            self.on_connect(self, None, 0, 0)
+        return 0
+
+    def reconnect(self, resub_topics=True):
+        """Connects again, with the subscriptions of the last session."""
+        subscriptions = self.subscriptions
+        self.connect()
+        if resub_topics:
+            for topic in subscriptions:
+                self.subscribe(topic)
+
+    def disconnect(self):
+        self._check()
+        self._connected = False
+        if self.on_disconnect is not None:
+            self.on_disconnect(self, None, 0)
+
+    def is_connected(self):
+        return self._connected
+
+    def publish(self, topic, msg, retain=False, qos=0):
+        self._check()
+        self._broker.published.append((topic, msg))
+
+    def subscribe(self, topic, qos=0):
+        self._check()
+        if topic not in self.subscriptions:
+            self.subscriptions.append(topic)
+        if self.on_subscribe is not None:
+            self.on_subscribe(self, None, topic, qos)
+
+    def unsubscribe(self, topic):
+        self._check()
+        if topic in self.subscriptions:
+            self.subscriptions.remove(topic)
+        if self.on_unsubscribe is not None:
+            self.on_unsubscribe(self, None, topic, 0)
+
+    def ping(self):
+        self._check()
+        self.pings += 1
+
+    def loop(self, timeout=0):
+        """Hands the queued messages to on_message."""
+        if timeout < self._socket_timeout:
+            raise MMQTTException("loop timeout must be at least the socket timeout")
+        while self._wait_for_msg() is not None:
+            pass
+
+    def _wait_for_msg(self, timeout=None):
+        # one received packet: 0xD0 for a PINGRESP, 0x30 for a message handed to on_message
+        self._check()
+        if self._broker.silent:
+            return None
+        if self._pingresp:
+            self._pingresp = False
+            return 0xD0
+        if self.inbox:
+            topic, payload = self.inbox.pop(0)
+            if self.on_message is not None:
+                self.on_message(self, topic, payload)
+            return 0x30
+        return None
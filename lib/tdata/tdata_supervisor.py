@@ -0,0 +1,248 @@
+# SPDX-FileCopyrightText: 2023 Luis Pichio for TwinDimension
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`tdata_supervisor`
+================================================================================
+
+Connection supervisor for the TData MQTT clients.
+
+Keeps track of the connection state, retries with exponential backoff and
+jitter, re-establishes the subscriptions after a reconnect and replays the
+publishes queued during an outage.
+
+* Author(s): Luis Pichio for TwinDimension
+"""
+import time
+import random
+
+from adafruit_minimqtt.adafruit_minimqtt import MMQTTException
+from tdata.tdata_errors import TData_MQTTError
+
+# errors of the connection, any other exception is one of the payload or of a callback
+_CONNECTION_ERRORS = (TData_MQTTError, MMQTTException, OSError)
+
+
+class ConnectionState:
+    DISCONNECTED = 0
+    CONNECTED = 1
+
+
+class Backoff:
+    """Exponential backoff with jitter.
+
+    :param float initial: First delay, in seconds.
+    :param float maximum: Upper bound of the delay, in seconds.
+    :param float factor: Growth factor between two attempts.
+    :param float jitter: Fraction of the delay which is randomized (0..1).
+    """
+
+    def __init__(self, initial=1.0, maximum=60.0, factor=2.0, jitter=0.5):
+        self._initial = initial
+        self._maximum = maximum
+        self._factor = factor
+        self._jitter = jitter
+        self._delay = initial
+
+    def reset(self):
+        """Starts over with the initial delay."""
+        self._delay = self._initial
+
+    def next(self):
+        """Returns the delay before the next attempt and grows the backoff."""
+        delay = self._delay
+        self._delay = min(self._delay * self._factor, self._maximum)
+        # randomize to keep a fleet of devices from retrying in lockstep
+        return delay * (1.0 - self._jitter * random.random())
+
+
+class TData_Supervisor:
+    """
+    Supervises the connection of a TData_MQTT or TData_MQTT_Gateway object.
+
+    :param tdata: TData_MQTT or TData_MQTT_Gateway object.
+    :param Backoff backoff: Retry policy, defaults to 1 s .. 60 s with 50 % jitter.
+    :param int queue_size: Maximum number of publishes kept during an outage,
+        the oldest ones are dropped first.
+
+    Only connection errors (TData_MQTTError, MMQTTException, OSError) mark
+    the connection as lost. Other exceptions, e.g. a payload which cannot
+    be serialized or an error in an ``on_message`` callback, are raised to
+    the caller. A queued publish failing that way on replay is dropped and
+    counted as rejected.
+
+    Example usage:
+
+    .. code-block:: python
+
+        supervisor = TData_Supervisor(tdata_device)
+        supervisor.subscribe_to_rpcs()
+        while True:
+            supervisor.loop()
+            supervisor.publish("telemetry", telemetry)
+    """
+
+    def __init__(self, tdata, backoff=None, queue_size=32):
+        self._tdata = tdata
+        self._backoff = backoff if backoff is not None else Backoff()
+        self._queue_size = queue_size
+        self._queue = []
+        self._subscriptions = []
+        self._state = ConnectionState.DISCONNECTED
+        self._next_attempt = 0
+        # start of the running outage, None while connected or not yet tried
+        self._outage_start = None
+
+        self.on_state_change = None
+
+        self._connects = 0
+        self._reconnects = 0
+        self._failures = 0
+        self._dropped = 0
+        self._rejected = 0
+        self._last_connect_latency = None
+        self._last_outage = None
+        self._total_outage = 0.0
+
+    @property
+    def state(self):
+        """The current :class:`ConnectionState`."""
+        return self._state
+
+    @property
+    def is_connected(self):
+        """Returns if connected to TData MQTT Broker."""
+        return self._state == ConnectionState.CONNECTED
+
+    @property
+    def metrics(self):
+        """Connection metrics.
+
+        :rtype: dict: 'connects', 'reconnects', 'failures', 'dropped', 'rejected'
+            (queued publishes failing on replay other than by the connection), 'queued',
+            'last_connect_latency', 'last_outage', 'total_outage' (seconds)
+        """
+        return {
+            "connects": self._connects,
+            "reconnects": self._reconnects,
+            "failures": self._failures,
+            "dropped": self._dropped,
+            "rejected": self._rejected,
+            "queued": len(self._queue),
+            "last_connect_latency": self._last_connect_latency,
+            "last_outage": self._last_outage,
+            "total_outage": self._total_outage,
+        }
+
+    def _set_state(self, state):
+        if state == self._state:
+            return
+        self._state = state
+        if self.on_state_change is not None:
+            self.on_state_change(self, state)
+
+    def connect(self):
+        """Tries to connect once.
+
+        :return: True if the connection is established. On failure the next
+            attempt is scheduled according to the backoff policy.
+        """
+        now = time.monotonic()
+        try:
+            if self._connects == 0:
+                self._tdata.connect()
+            else:
+                self._tdata.reconnect()
+        except TData_MQTTError:
+            self._failures += 1
+            if self._outage_start is None:
+                self._outage_start = now
+            self._next_attempt = now + self._backoff.next()
+            return False
+
+        connected_at = time.monotonic()
+        self._last_connect_latency = connected_at - now
+        if self._outage_start is not None:
+            self._last_outage = connected_at - self._outage_start
+            self._total_outage += self._last_outage
+            self._outage_start = None
+        if self._connects > 0:
+            self._reconnects += 1
+        self._connects += 1
+        self._backoff.reset()
+        self._set_state(ConnectionState.CONNECTED)
+
+        for subscribe in self._subscriptions:
+            if not self._call(subscribe, ()):
+                return False
+        self._replay()
+        return self.is_connected
+
+    def _connection_lost(self):
+        if self._state == ConnectionState.CONNECTED:
+            self._outage_start = time.monotonic()
+            self._next_attempt = self._outage_start + self._backoff.next()
+            self._set_state(ConnectionState.DISCONNECTED)
+
+    def _call(self, method, args):
+        try:
+            method(*args)
+        except _CONNECTION_ERRORS:
+            self._connection_lost()
+            return False
+        return True
+
+    def _replay(self):
+        while self._queue and self.is_connected:
+            publish_type, data = self._queue[0]
+            try:
+                if not self._call(self._tdata.publish, (publish_type, data)):
+                    return
+            except Exception:  # pylint: disable=broad-except
+                # not an error of the connection, the replay would fail again
+                self._rejected += 1
+            self._queue.pop(0)
+
+    def loop(self, timeout=1):
+        """Processes incoming messages while connected, otherwise retries the
+        connection once its backoff delay has expired.
+
+        :param int timeout: Socket timeout, in seconds.
+        """
+        if self.is_connected:
+            self._call(self._tdata.loop, (timeout,))
+        elif time.monotonic() >= self._next_attempt:
+            self.connect()
+
+    def publish(self, publish_type="telemetry", data=None):
+        """Telemetry upload / Attributes API
+        Publishes right away while connected, queues the message otherwise.
+
+        :return: True if the message was sent, False if it was queued.
+        """
+        if self.is_connected and not self._queue:
+            if self._call(self._tdata.publish, (publish_type, data)):
+                return True
+        if len(self._queue) >= self._queue_size:
+            self._queue.pop(0)
+            self._dropped += 1
+        self._queue.append((publish_type, data))
+        return False
+
+    def add_subscription(self, subscribe):
+        """Registers a callable which (re-)establishes a subscription.
+        It is called now if connected, and after every reconnect.
+
+        :param subscribe: Callable without arguments.
+        """
+        if subscribe not in self._subscriptions:
+            self._subscriptions.append(subscribe)
+        if self.is_connected:
+            self._call(subscribe, ())
+
+    def subscribe_to_rpcs(self):
+        """RPC API
+        Server-side RPC, kept across reconnects.
+        """
+        self.add_subscription(self._tdata.subscribe_to_rpcs)
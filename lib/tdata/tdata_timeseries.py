@@ -0,0 +1,211 @@
+# SPDX-FileCopyrightText: 2023 Luis Pichio for TwinDimension
+#
+# SPDX-License-Identifier: MIT
+
+"""
+`tdata_timeseries`
+================================================================================
+
+Time-series buffering for high-rate sampling (e.g. 10 Hz vibration or
+current). Samples are kept delta encoded in preallocated ``array``
+storage and flushed as the array form of the TData telemetry payload::
+
+    [{"ts": 1700000000000, "values": {"key": 1.23}}, ...]
+
+* Author(s): Luis Pichio for TwinDimension
+
+
+Implementation Notes
+--------------------
+
+Timestamps (ms) are stored as delta-of-delta, values as deltas of the
+value scaled to an integer (``round(value * scale)``). For a steady
+sample rate the timestamp deltas are mostly 0. The deltas are stored
+in ``array("l")``, 32 bit on CircuitPython: a sample whose deltas do not
+fit (e.g. after a gap of 24 days or a jump of the value by more than
+2**31 / scale) is kept as a new base sample, outside of the arrays.
+Memory is bounded by the capacity given at construction, samples added
+to a full series are dropped and counted.
+"""
+from array import array
+
+# range of the 32 bit array("l") of CircuitPython
+_DELTA_MIN = -0x80000000
+_DELTA_MAX = 0x7FFFFFFF
+
+
+class TData_TimeSeries:
+    """
+    Delta encoded buffer for a single telemetry key.
+
+    :param str key: Telemetry key.
+    :param int capacity: Maximum number of samples held.
+    :param int scale: Values are stored as round(value * scale), e.g. 100 keeps
+        two decimals. 1 keeps integers as they are, float samples need a
+        scale other than 1.
+    """
+
+    def __init__(self, key, capacity=600, scale=1):
+        self.key = key
+        self._capacity = capacity
+        self._scale = scale
+        self._ts_dod = array("l", (0 for _ in range(capacity)))
+        self._value_delta = array("l", (0 for _ in range(capacity)))
+        self._count = 0
+        self._dropped = 0
+        # base samples, (index, ts, raw value), the first sample and those whose deltas overflow
+        self._bases = []
+        # running state of the encoder
+        self._last_ts = 0
+        self._last_delta = 0
+        self._last_value = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def capacity(self):
+        """Maximum number of samples held."""
+        return self._capacity
+
+    @property
+    def is_full(self):
+        """True if the next sample would be dropped."""
+        return self._count >= self._capacity
+
+    @property
+    def dropped(self):
+        """Number of samples dropped because the buffer was full."""
+        return self._dropped
+
+    def add(self, ts, value):
+        """Adds a sample.
+
+        :param int ts: Timestamp in milliseconds.
+        :param value: Sample value (int, or float with a scale other than 1).
+        :return: False if the sample was dropped.
+        """
+        if self._scale == 1 and isinstance(value, float):
+            raise ValueError("Float samples of {0} need a scale.".format(self.key))
+        if self._count >= self._capacity:
+            self._dropped += 1
+            return False
+        raw = round(value * self._scale)
+        delta = ts - self._last_ts
+        dod = delta - self._last_delta
+        value_delta = raw - self._last_value
+        if (self._count == 0 or not _DELTA_MIN <= dod <= _DELTA_MAX
+                or not _DELTA_MIN <= value_delta <= _DELTA_MAX):
+            self._bases.append((self._count, ts, raw))
+            self._last_delta = 0
+        else:
+            self._ts_dod[self._count] = dod
+            self._value_delta[self._count] = value_delta
+            self._last_delta = delta
+        self._last_ts = ts
+        self._last_value = raw
+        self._count += 1
+        return True
+
+    def samples(self):
+        """Iterates the decoded (ts, value) pairs."""
+        ts = raw = delta = 0
+        scale = self._scale
+        bases = self._bases
+        base = 0
+        for i in range(self._count):
+            if base < len(bases) and bases[base][0] == i:
+                _index, ts, raw = bases[base]
+                delta = 0
+                base += 1
+            else:
+                delta += self._ts_dod[i]
+                ts += delta
+                raw += self._value_delta[i]
+            yield ts, (raw if scale == 1 else raw / scale)
+
+    def clear(self):
+        """Drops all samples, the storage is kept."""
+        self._count = 0
+        self._bases = []
+
+    def flush(self):
+        """Returns the samples as TData telemetry payload and clears the buffer.
+
+        :rtype: list of dict: 'ts', 'values'
+        """
+        key = self.key
+        payload = [{"ts": ts, "values": {key: value}} for ts, value in self.samples()]
+        self.clear()
+        return payload
+
+
+class TData_TimeSeriesBuffer:
+    """
+    Set of :class:`TData_TimeSeries`, one per key. Samples of different keys
+    sharing a timestamp are merged into one record on flush.
+
+    :param int capacity: Capacity of each series.
+    :param int scale: Default scale of each series.
+
+    Example usage:
+
+    .. code-block:: python
+
+        buffer = TData_TimeSeriesBuffer(capacity=100, scale=1000)
+        buffer.add("current", ts_ms, read_current())
+        if buffer.is_full:
+            tdata_device.publish("telemetry", buffer.flush())
+    """
+
+    def __init__(self, capacity=600, scale=1):
+        self._capacity = capacity
+        self._scale = scale
+        self._series = {}
+
+    def series(self, key, scale=None):
+        """Returns the series of the key, it is created on first use."""
+        series = self._series.get(key)
+        if series is None:
+            series = TData_TimeSeries(key, self._capacity, self._scale if scale is None else scale)
+            self._series[key] = series
+        return series
+
+    def add(self, key, ts, value):
+        """Adds a sample to the series of the key.
+
+        :return: False if the sample was dropped.
+        """
+        return self.series(key).add(ts, value)
+
+    def __len__(self):
+        return sum(len(series) for series in self._series.values())
+
+    @property
+    def is_full(self):
+        """True if at least one series is full."""
+        for series in self._series.values():
+            if series.is_full:
+                return True
+        return False
+
+    @property
+    def dropped(self):
+        """Number of samples dropped in all series."""
+        return sum(series.dropped for series in self._series.values())
+
+    def flush(self):
+        """Returns the samples of all series as TData telemetry payload,
+        ordered by timestamp, and clears the buffers.
+
+        :rtype: list of dict: 'ts', 'values'
+        """
+        records = {}
+        for key, series in self._series.items():
+            for ts, value in series.samples():
+                values = records.get(ts)
+                if values is None:
+                    values = records[ts] = {}
+                values[key] = value
+            series.clear()
+        return [{"ts": ts, "values": records[ts]} for ts in sorted(records)]
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import time
+from tdata.tdata import TData_MQTT
+from tdata.tdata_asyncio import TData_MQTT_Async
+from tdata.tdata_supervisor import Backoff
+from tdata.tdata_fake_broker import FakeBroker
+
+# The asyncio T>Data client against an in-process fake broker: publishes,
+# an RPC, a broker outage with publishes queued meanwhile, the reconnect
+# and the replay of the queue. Runs on a host (CPython with the
+# adafruit-circuitpython-minimqtt package), no network needed
+
+RPC_TOPIC = "v1/devices/me/rpc/request/{}"
+
+def rpc(client, rpc_id, method, params):
+    print("RPC received | rpc_id {0} | method {1} | params {2}".format(rpc_id, method, params))
+    asyncio.create_task(tdata_async.rpc_response(rpc_id, {"success": True}))
+
+async def ticker(stalls):
+    """Another task sharing the event loop, records how long it was held up"""
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(0.01)
+        stalls.append(time.monotonic() - started - 0.01)
+
+async def main():
+    global tdata_async
+    broker = FakeBroker()
+    tdata_device = TData_MQTT(broker.client(username="device-token", socket_timeout=0.01))
+    tdata_device.on_rpc = rpc
+    tdata_async = TData_MQTT_Async(tdata_device, backoff=Backoff(initial=0.2, maximum=1.0))
+
+    stalls = []
+    ticker_task = asyncio.create_task(ticker(stalls))
+
+    await tdata_async.connect()
+    await tdata_async.subscribe_to_rpcs()
+    await tdata_async.publish("telemetry", {"temperature": 21.5})
+
+    broker.deliver(RPC_TOPIC.format(1), json.dumps({"method": "setLed", "params": True}))
+    await asyncio.sleep(0.1)
+
+    print("broker down")
+    broker.up = False
+    for i in range(3):
+        tdata_async.publish_nowait("telemetry", {"counter": i})
+        await asyncio.sleep(0.2)
+    print("connected: {}, pending: {}".format(tdata_async.is_connected, tdata_async.pending))
+
+    print("broker up")
+    broker.up = True
+    started = time.monotonic()
+    await tdata_async.wait_connected()
+    print("reconnected after {:.2f} s".format(time.monotonic() - started))
+    while tdata_async.pending:
+        await asyncio.sleep(0.01)
+
+    broker.deliver(RPC_TOPIC.format(2), json.dumps({"method": "getState", "params": {}}))
+    await asyncio.sleep(0.1)
+
+    ticker_task.cancel()
+    await tdata_async.disconnect()
+
+    for topic, payload in broker.published:
+        print("{} {}".format(topic, payload))
+    print("connects: {}, longest stall of the event loop: {:.3f} s".format(broker.connects, max(stalls)))
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the stack is imported from lib/, as on the board
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lib"))
@@ -0,0 +1,59 @@
+from j1939.acceptance_filter import MASK_PGN, accepts, fit_filters, pgn_filter
+from j1939.can import Mcp2515Backend
+
+MCP2515_SLOTS = Mcp2515Backend.filter_slots
+
+
+class RegisterRecorder:
+    """Stands in for the MCP2515 driver, records the mask and filter registers written"""
+
+    def __init__(self):
+        self.registers = {}
+
+    def _write_id_to_register(self, register, value, extended):
+        self.registers[register] = (value, extended)
+
+
+def mcp2515_registers(filters):
+    backend = Mcp2515Backend.__new__(Mcp2515Backend)
+    backend._can = RegisterRecorder()
+    backend.set_filters(filters)
+    return backend._can.registers
+
+
+def test_filters_sharing_a_mask_stay_exact():
+    pgns = [0xFEF1, 0xFEEE, 0xF004, 0xFECA, 0xFEE5, 0xFEF5]
+    for count in range(1, len(pgns) + 1):
+        wanted = [pgn_filter(pgn) for pgn in pgns[:count]]
+        filters = fit_filters(wanted, MCP2515_SLOTS)
+        assert sorted(filters) == sorted(wanted)
+
+
+def test_seventh_filter_is_merged():
+    wanted = [pgn_filter(pgn) for pgn in range(0xFEF0, 0xFEF7)]
+    filters = fit_filters(wanted, MCP2515_SLOTS)
+    assert len(filters) == 6
+    for can_id, _mask in wanted:
+        assert accepts(filters, can_id)
+
+
+def test_mcp2515_registers_of_a_shared_mask():
+    wanted = [pgn_filter(pgn) for pgn in (0xFEF1, 0xFEEE, 0xF004, 0xFECA, 0xFEE5, 0xFEF5)]
+    registers = mcp2515_registers(fit_filters(wanted, MCP2515_SLOTS))
+    assert registers[0x20] == (MASK_PGN, True)
+    assert registers[0x24] == (MASK_PGN, True)
+    programmed = [registers[register][0] for register in (0x00, 0x04, 0x08, 0x10, 0x14, 0x18)]
+    assert sorted(programmed) == sorted(can_id for can_id, _mask in wanted)
+
+
+def test_mcp2515_registers_of_one_filter():
+    registers = mcp2515_registers(fit_filters([pgn_filter(0xFECA)], MCP2515_SLOTS))
+    # mask 1 repeats the filter of mask 0, RXB1 accepts nothing else
+    assert registers[0x24] == registers[0x20]
+    assert {registers[register][0] for register in (0x00, 0x04, 0x08, 0x10, 0x14, 0x18)} == {0xFECA00}
+
+
+def test_mcp2515_accepts_everything_without_filters():
+    registers = mcp2515_registers(None)
+    assert registers[0x20] == (0, False)
+    assert registers[0x24] == (0, False)